@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from analyzers.damage_analyzer import DamageAnalyzer
+from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
+from services.instrumentation import Instrumentation
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Finished results kept for repeat requests that name the same ETag
+MAX_RECENT_RESULTS = 1024
+
+# Finished jobs are forgotten after this long, and the oldest go first beyond MAX_JOBS
+DEFAULT_JOB_TTL = 3600
+MAX_JOBS = 10000
+
+MAX_BATCH_SIZE = 10000
+
+
+class AnalysisService:
+    def __init__(self,
+                 analyzer: DamageAnalyzer,
+                 batch_analyzer: Optional[MultiImageDamageAnalyzer] = None,
+                 output_bucket: Optional[str] = None,
+                 max_workers: int = 16,
+                 job_ttl: float = DEFAULT_JOB_TTL,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Long-lived front end to the analyzers for interactive callers
+
+        Built once per process, so clients, connection pools and caches stay
+        warm between requests. Concurrent requests for the same
+        bucket/key/ETag share one in-flight analysis, and results for a
+        given ETag are remembered, so repeated lookups of an unchanged
+        object cost nothing. Single images can be analysed synchronously or
+        as polled jobs; batches run through the concurrent pipeline.
+
+        :param analyzer: Single-image analyzer
+        :param batch_analyzer: Pipeline analyzer for batch jobs (batches are rejected without it)
+        :param output_bucket: Default bucket to save reports in (None: reports are only returned)
+        :param max_workers: Single-image analyses running at the same time
+        :param job_ttl: Seconds a finished job stays pollable
+        :param instrumentation: Optional metrics registry
+        """
+        self.analyzer = analyzer
+        self.batch_analyzer = batch_analyzer
+        self.output_bucket = output_bucket
+        self.job_ttl = job_ttl
+        self.instrumentation = instrumentation
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis')
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Tuple, Future] = {}
+        self._recent = OrderedDict()
+        self._jobs = OrderedDict()
+        self._counts = {'analyses': 0, 'coalesced': 0, 'recent_hits': 0, 'failed': 0}
+
+        if instrumentation is not None:
+            self._analyses_metric = instrumentation.counter(
+                'service_analyses_total', 'Single-image requests by how they were served', ('source',))
+
+    def analyze(self, bucket: str, key: str, etag: Optional[str] = None,
+                output_bucket: Optional[str] = None, timeout: Optional[float] = None) -> Dict:
+        """
+        Analyse one image and wait for the result
+
+        :param bucket: Bucket holding the image
+        :param key: Key of the image
+        :param etag: Optional ETag; the object is only read if it still has it, and the
+                     result is then reused for later requests naming the same ETag
+        :param output_bucket: Bucket to save the report in (default: the service's)
+        :param timeout: Max seconds to wait
+        :return: Result dictionary (a copy; coalesced and cached results are shared internally)
+        """
+        return dict(self._analysis(bucket, key, etag, output_bucket).result(timeout=timeout))
+
+    def submit(self, bucket: str, key: str, etag: Optional[str] = None,
+               output_bucket: Optional[str] = None) -> str:
+        """
+        Start analysing one image in the background
+
+        :return: Job id to poll with job()
+        """
+        job = self._new_job('image', {'bucket': bucket, 'key': key, 'etag': etag})
+        future = self._analysis(bucket, key, etag, output_bucket)
+        job['status'] = JOB_RUNNING
+        future.add_done_callback(lambda done: self._finish_image_job(job, done))
+        return job['job_id']
+
+    def submit_batch(self, items: List[Dict], output_bucket: Optional[str] = None) -> str:
+        """
+        Run many images through the concurrent pipeline as one job
+
+        :param items: Dicts with 'bucket' and 'key', optionally 'etag' and 'size'
+        :param output_bucket: Bucket to save reports in (default: the service's)
+        :return: Job id to poll with job(); results accumulate while it runs
+        """
+        if self.batch_analyzer is None:
+            raise ValueError("Batch analysis is not configured")
+        if not items:
+            raise ValueError("Batch is empty")
+        if len(items) > MAX_BATCH_SIZE:
+            raise ValueError(f"Batch exceeds {MAX_BATCH_SIZE} images")
+        contexts = []
+        for item in items:
+            obj = {'Key': item['key']}
+            if item.get('etag'):
+                obj['ETag'] = item['etag']
+            if item.get('size'):
+                obj['Size'] = item['size']
+            contexts.append({'bucket': item['bucket'], 'key': item['key'], 'object': obj})
+
+        job = self._new_job('batch', {'total': len(contexts)})
+        job.update({'completed': 0, 'failed': 0, 'results': [], 'errors': []})
+        threading.Thread(
+            target=self._run_batch, args=(job, contexts, output_bucket or self.output_bucket),
+            name=f"batch-{job['job_id'][:8]}", daemon=True
+        ).start()
+        return job['job_id']
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        """
+        Current state of a job
+
+        :return: Copy of the job record, or None if unknown or expired
+        """
+        with self._lock:
+            self._expire_jobs()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            for field in ('results', 'errors'):
+                if field in snapshot:
+                    snapshot[field] = list(snapshot[field])
+            return snapshot
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counts)
+            stats['in_flight'] = len(self._in_flight)
+            stats['jobs'] = len(self._jobs)
+            return stats
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _analysis(self, bucket: str, key: str, etag: Optional[str], output_bucket: Optional[str]) -> Future:
+        output_bucket = output_bucket or self.output_bucket
+        identity = (bucket, key, etag, output_bucket)
+        with self._lock:
+            if etag is not None and identity in self._recent:
+                self._recent.move_to_end(identity)
+                future = Future()
+                future.set_result(self._recent[identity])
+                self._record('recent_hits', 'recent')
+                return future
+            future = self._in_flight.get(identity)
+            if future is not None:
+                self._record('coalesced', 'coalesced')
+                return future
+            future = self._executor.submit(self._run_single, bucket, key, etag, output_bucket)
+            self._in_flight[identity] = future
+            self._record('analyses', 'analysed')
+        future.add_done_callback(lambda done: self._settle(identity, done))
+        return future
+
+    def _run_single(self, bucket: str, key: str, etag: Optional[str], output_bucket: Optional[str]) -> Dict:
+        # The ETag is checked on the S3 read, so a cached result never belongs to another version
+        result = self.analyzer.analyze_damage(bucket, key, output_bucket, etag=etag)
+        result.update({'source_bucket': bucket, 'source_key': key, 'etag': etag})
+        return result
+
+    def _settle(self, identity: Tuple, future: Future) -> None:
+        with self._lock:
+            self._in_flight.pop(identity, None)
+            if future.exception() is not None:
+                self._counts['failed'] += 1
+                return
+            if identity[2] is not None:
+                # Only a known ETag pins the result to one version of the object
+                self._recent[identity] = future.result()
+                if len(self._recent) > MAX_RECENT_RESULTS:
+                    self._recent.popitem(last=False)
+
+    def _record(self, count: str, source: str) -> None:
+        self._counts[count] += 1
+        if self.instrumentation is not None:
+            self._analyses_metric.inc(source=source)
+
+    def _new_job(self, kind: str, fields: Dict) -> Dict:
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': JOB_PENDING,
+            'submitted_at': time.time(),
+            'finished_at': None
+        }
+        job.update(fields)
+        with self._lock:
+            self._expire_jobs()
+            self._jobs[job['job_id']] = job
+        return job
+
+    def _finish_image_job(self, job: Dict, future: Future) -> None:
+        with self._lock:
+            error = future.exception()
+            if error is None:
+                job['result'] = dict(future.result())
+                job['status'] = JOB_DONE
+            else:
+                job['error'] = str(error)
+                job['status'] = JOB_FAILED
+            job['finished_at'] = time.time()
+
+    def _run_batch(self, job: Dict, contexts: List[Dict], output_bucket: Optional[str]) -> None:
+        job['status'] = JOB_RUNNING
+        try:
+            for item in self.batch_analyzer.iter_process_contexts(contexts, output_bucket):
+                with self._lock:
+                    if item.ok:
+                        job['completed'] += 1
+                        job['results'].append(item.value)
+                    else:
+                        job['failed'] += 1
+                        job['errors'].append({'key': item.value['key'], 'stage': item.failed_stage,
+                                              'error': str(item.error)})
+            status = JOB_DONE
+        except Exception as e:
+            logger.error(f"Batch job {job['job_id']} failed: {e}")
+            job['error'] = str(e)
+            status = JOB_FAILED
+        with self._lock:
+            job['status'] = status
+            job['finished_at'] = time.time()
+
+    def _expire_jobs(self) -> None:
+        # Called with the lock held
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] is not None and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        while len(self._jobs) > MAX_JOBS:
+            self._jobs.popitem(last=False)
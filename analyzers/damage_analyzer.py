@@ -1,61 +1,143 @@
-from typing import Optional, Dict, List
-from datetime import datetime
-import logging
-from services.s3_service import S3Service
-from services.rekognition_service import RekognitionService
-from services.bedrock_service import BedrockService
-
-logger = logging.getLogger(__name__)
-
-class DamageAnalyzer:
-    def __init__(self, s3_service: S3Service, rekognition_service: RekognitionService, bedrock_service: BedrockService):
-        """
-        Initialize DamageAnalyzer with required services
-        """
-        self.s3_service = s3_service
-        self.rekognition_service = rekognition_service
-        self.bedrock_service = bedrock_service
-
-    def analyze_damage(self, source_bucket: str, source_key: str, output_bucket: Optional[str] = None) -> Dict:
-        try:
-            # Read image bytes
-            image_bytes = self.s3_service.read_image(source_bucket, source_key)
-            
-            # Detect damage from S3 reference
-            s3_reference = {'Bucket': source_bucket, 'Name': source_key}
-            damage_labels = self.rekognition_service.detect_damage(
-                s3_reference, 
-                source_type='s3'
-            )
-            
-            # Generate report using image bytes
-            report = self.bedrock_service.generate_report(
-                image_bytes, damage_labels
-            )
-            
-            # Save report if output bucket specified
-            #if output_bucket:
-             #   timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-              #  report_key = f"reports/{source_key.split('/')[-1]}_{timestamp}.txt"
-               # self.s3_service.upload_file(output_bucket, report_key, report)
-
-            # Save report if output bucket specified
-            if output_bucket:
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                report_key = f"reports/{source_key.split('/')[-1]}_{timestamp}.txt"
-                upload_success = self.s3_service.upload_text(
-                    bucket=output_bucket,
-                    key=report_key,
-                    text_content=report
-                )
-                if not upload_success:
-                    logger.warning("Failed to save report to S3")
-            
-            return {
-                'damage_labels': damage_labels,
-                'report': report
-            }
-            
-        except Exception as e:
-            logger.error(f"Analysis error: {e}")
+from typing import Optional, Dict, List
+from datetime import datetime, timezone
+import logging
+import time
+from services.s3_service import S3Service
+from services.rekognition_service import RekognitionService
+from services.bedrock_service import BedrockService
+from services.report_cache import hash_image
+from services.image_preprocessor import ImagePreprocessor
+from services.result_sink import ResultSink, compact_labels
+from services.triage import ROUTE_SKIP, TriagePolicy, route_model
+
+logger = logging.getLogger(__name__)
+
+class DamageAnalyzer:
+    def __init__(self, s3_service: S3Service, rekognition_service: RekognitionService, bedrock_service: BedrockService,
+                 single_fetch: bool = True, preprocessor: Optional[ImagePreprocessor] = None,
+                 result_sink: Optional[ResultSink] = None, text_reports: bool = True,
+                 triage: Optional[TriagePolicy] = None):
+        """
+        Initialize DamageAnalyzer with required services
+
+        :param single_fetch: Send the fetched bytes to Rekognition instead of a second S3 read
+        :param preprocessor: Optional image pre-processor shrinking the Bedrock payload
+        :param result_sink: Optional sink receiving one compact record per analysed image
+        :param text_reports: Also save every report as its own text object in the output bucket
+        :param triage: Optional policy skipping undamaged images and sending minor damage to the fast model
+        """
+        self.s3_service = s3_service
+        self.rekognition_service = rekognition_service
+        self.bedrock_service = bedrock_service
+        self.single_fetch = single_fetch
+        self.preprocessor = preprocessor
+        self.result_sink = result_sink
+        self.text_reports = text_reports
+        self.triage = triage
+
+    def analyze_damage(self, source_bucket: str, source_key: str, output_bucket: Optional[str] = None,
+                       etag: Optional[str] = None) -> Dict:
+        """
+        Analyse one image
+
+        :param source_bucket: Bucket holding the image
+        :param source_key: Key of the image
+        :param output_bucket: Optional bucket to save the report in
+        :param etag: Optional ETag the object must still have; the read fails otherwise
+        :return: Result dictionary
+        """
+        try:
+            timings = {}
+            start = time.perf_counter()
+            # Read image bytes
+            image_bytes = self.s3_service.read_image(source_bucket, source_key, if_match=etag)
+            image_hash = hash_image(image_bytes)
+            timings['fetch'] = round(time.perf_counter() - start, 4)
+            start = time.perf_counter()
+            
+            # Detect damage from the fetched bytes (S3 reference if not single-fetch or too large)
+            damage_labels = self.rekognition_service.detect_damage_for_object(
+                source_bucket,
+                source_key,
+                image_bytes=image_bytes if self.single_fetch else None,
+                image_hash=image_hash
+            )
+            timings['detect'] = round(time.perf_counter() - start, 4)
+            start = time.perf_counter()
+            
+            decision = None
+            model_id = None
+            if self.triage is not None:
+                decision = self.triage.decide(damage_labels)
+                model_id = decision['model_id'] = route_model(decision['route'], self.bedrock_service)
+
+            report_metrics = {}
+            if decision is not None and decision['route'] == ROUTE_SKIP:
+                report = self.triage.skip_report
+            else:
+                # Shrink the Bedrock payload if a pre-processor is configured
+                report_image, media_type = image_bytes, None
+                if self.preprocessor is not None:
+                    report_image, media_type = self.preprocessor.preprocess(image_bytes)
+                    image_hash = f"{image_hash}:{self.preprocessor.fingerprint}"
+
+                # Generate report using image bytes
+                report = self.bedrock_service.generate_report(
+                    report_image, damage_labels,
+                    image_hash=image_hash,
+                    media_type=media_type,
+                    metrics=report_metrics,
+                    model_id=model_id
+                )
+            timings['report'] = round(time.perf_counter() - start, 4)
+            
+            # Save report if output bucket specified
+            #if output_bucket:
+             #   timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+              #  report_key = f"reports/{source_key.split('/')[-1]}_{timestamp}.txt"
+               # self.s3_service.upload_file(output_bucket, report_key, report)
+
+            # Save report if output bucket specified
+            report_key = None
+            if output_bucket and self.text_reports:
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                report_key = f"reports/{source_key.split('/')[-1]}_{timestamp}.txt"
+                upload_success = self.s3_service.upload_text(
+                    bucket=output_bucket,
+                    key=report_key,
+                    text_content=report
+                )
+                if not upload_success:
+                    logger.warning("Failed to save report to S3")
+                    report_key = None
+
+            result_key = None
+            if self.result_sink is not None:
+                record = {
+                    'source_bucket': source_bucket,
+                    'source_key': source_key,
+                    'etag': etag,
+                    'size': len(image_bytes),
+                    'labels': compact_labels(damage_labels),
+                    'report': report,
+                    'report_key': report_key,
+                    'report_metrics': report_metrics,
+                    'timings': timings,
+                    'processed_at': datetime.now(timezone.utc).isoformat()
+                }
+                if decision is not None:
+                    record['triage'] = decision
+                result_key = self.result_sink.write(record)
+            
+            result = {
+                'damage_labels': damage_labels,
+                'report': report,
+                'result_key': result_key
+            }
+            if decision is not None:
+                result['triage'] = decision
+            return result
+            
+        except Exception as e:
+            logger.error(f"Analysis error: {e}")
             raise
\ No newline at end of file
@@ -0,0 +1,255 @@
+import functools
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from analyzers.multiimagedamage_analyzer import IMAGE_EXTENSIONS, MultiImageDamageAnalyzer
+from services.event_queue import EventQueue, QueueMessage, parse_s3_events
+from services.instrumentation import Instrumentation, LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _MessageTracker:
+    """
+    Outstanding images of one queue message; the message is settled when none remain
+    """
+    __slots__ = ('message', 'remaining', 'failed')
+
+    def __init__(self, message: QueueMessage, remaining: int):
+        self.message = message
+        self.remaining = remaining
+        self.failed = False
+
+
+class EventWorker:
+    def __init__(self,
+                 analyzer: MultiImageDamageAnalyzer,
+                 event_queue: EventQueue,
+                 output_bucket: Optional[str] = None,
+                 prefetch: int = 32,
+                 wait_seconds: float = 20,
+                 visibility_timeout: int = 300,
+                 retry_delay: int = 30,
+                 on_result: Optional[Callable[[Dict], None]] = None,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Long-running worker analysing images as their object-created events arrive
+
+        A receiver thread long-polls the queue and keeps up to prefetch images
+        queued in front of the analyzer pipeline, so new uploads start
+        processing within seconds. A message is acknowledged only once every
+        image it names has been analysed and its report persisted; otherwise
+        it is released for redelivery after retry_delay (configure a
+        dead-letter queue on the SQS side for poison messages). With a result
+        sink, persisted means the result file holding the record has been
+        written, so messages are acknowledged as files rotate and the sink's
+        max_file_seconds bounds how long they stay in flight.
+
+        :param analyzer: Analyzer whose pipeline processes the images
+        :param event_queue: Queue delivering S3 notifications
+        :param output_bucket: Optional bucket to save reports in
+        :param prefetch: Max images received but not yet in the pipeline
+        :param wait_seconds: Long-poll time per receive
+        :param visibility_timeout: Seconds a received message stays hidden; extended while it is being processed
+        :param retry_delay: Seconds before a failed message is redelivered
+        :param on_result: Optional callback receiving every result dict (e.g. to send notifications)
+        :param instrumentation: Optional metrics registry
+        """
+        self.analyzer = analyzer
+        self.event_queue = event_queue
+        self.output_bucket = output_bucket
+        self.prefetch = prefetch
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.on_result = on_result
+        self.instrumentation = instrumentation
+
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._trackers = {}
+        self._active = {}
+        self._counts = {}
+
+        if instrumentation is not None:
+            self._messages_metric = instrumentation.counter(
+                'worker_messages_total', 'Queue messages settled by outcome', ('result',))
+            self._latency_metric = instrumentation.histogram(
+                'worker_event_to_report_seconds', 'Time from S3 upload to persisted report', buckets=LATENCY_BUCKETS)
+
+    def run(self, drain: bool = False) -> Dict[str, int]:
+        """
+        Consume events until stop() is called
+
+        :param drain: Return as soon as the queue is empty instead of waiting for new events
+        :return: Dictionary of message and image counts
+        """
+        self._stop.clear()
+        self._finished.clear()
+        self._counts = dict.fromkeys(('messages', 'acked', 'retried', 'skipped', 'malformed', 'images', 'failed'), 0)
+        ready = queue.Queue(maxsize=self.prefetch)
+        receiver = threading.Thread(target=self._receive_loop, args=(ready, drain), name='worker-receive', daemon=True)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='worker-heartbeat', daemon=True)
+        receiver.start()
+        heartbeat.start()
+
+        logger.info("Event worker started")
+        try:
+            for item in self.analyzer.iter_process_contexts(self._contexts(ready), self.output_bucket):
+                self._settle(item)
+        finally:
+            # The receiver has already exited unless the pipeline failed; it is a daemon either way
+            self._stop.set()
+            # Write out the results still buffered, which settles the messages waiting on them
+            if self.analyzer.result_sink is not None:
+                self.analyzer.result_sink.rotate()
+            with self._lock:
+                unsettled = list(self._trackers)
+            for seq in unsettled:
+                self._on_persisted(seq, False)
+            self._finished.set()
+            heartbeat.join()
+        logger.info(f"Event worker stopped: {self._counts}")
+        return dict(self._counts)
+
+    def stop(self) -> None:
+        """
+        Stop receiving; images already received are finished and settled before run() returns
+        """
+        self._stop.set()
+
+    def _receive_loop(self, ready: queue.Queue, drain: bool) -> None:
+        try:
+            while not self._stop.is_set():
+                try:
+                    messages = self.event_queue.receive(wait_seconds=0 if drain else self.wait_seconds)
+                except Exception as e:
+                    logger.error(f"Error receiving events: {e}")
+                    self._stop.wait(self.retry_delay if not drain else 0)
+                    if drain:
+                        break
+                    continue
+                if not messages and drain:
+                    break
+                for message in messages:
+                    self._enqueue(message, ready)
+        finally:
+            ready.put(_DONE)
+
+    def _enqueue(self, message: QueueMessage, ready: queue.Queue) -> None:
+        with self._lock:
+            self._counts['messages'] += 1
+        try:
+            events = parse_s3_events(message.body)
+        except (ValueError, KeyError, TypeError) as e:
+            # Unparseable bodies never succeed; drop them rather than loop forever
+            logger.error(f"Discarding malformed event message: {e}: {message.body[:200]}")
+            self._finish(message, 'malformed', ack=True)
+            return
+
+        contexts = []
+        for event in events:
+            if not event.bucket or not event.key or not event.key.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            obj = event.to_object()
+            manifest = self.analyzer.manifest
+            if manifest is not None and not manifest.needs_processing(event.bucket, obj):
+                logger.info(f"Skipping already processed {event.key}")
+                continue
+            contexts.append({'bucket': event.bucket, 'key': event.key, 'object': obj, 'event_time': event.event_time})
+
+        if not contexts:
+            self._finish(message, 'skipped', ack=True)
+            return
+
+        tracker = _MessageTracker(message, len(contexts))
+        with self._lock:
+            self._active[id(tracker)] = tracker
+        for context in contexts:
+            context['tracker'] = tracker
+            # Blocks while the pipeline is prefetch images behind
+            ready.put(context)
+
+    def _contexts(self, ready: queue.Queue):
+        seq = 0
+        while True:
+            context = ready.get()
+            if context is _DONE:
+                return
+            # The pipeline numbers items in input order, so seq identifies the context later
+            with self._lock:
+                self._trackers[seq] = (context.pop('tracker'), context.get('event_time'), context['key'])
+            # Called by the analyzer once the result is persisted (or could not be)
+            context['on_persisted'] = functools.partial(self._on_persisted, seq)
+            seq += 1
+            yield context
+
+    def _settle(self, item) -> None:
+        if not item.ok:
+            self._on_persisted(item.seq, False)
+        elif self.on_result is not None:
+            try:
+                self.on_result(item.value)
+            except Exception as e:
+                logger.error(f"Result callback failed for {item.value['source_key']}: {e}")
+
+    def _on_persisted(self, seq: int, persisted: bool) -> None:
+        with self._lock:
+            entry = self._trackers.pop(seq, None)
+            if entry is None:
+                # Already settled, e.g. failed after its outcome was reported
+                return
+            tracker, event_time, key = entry
+            self._counts['images' if persisted else 'failed'] += 1
+            tracker.failed = tracker.failed or not persisted
+            tracker.remaining -= 1
+            finished = tracker.remaining == 0
+            if finished:
+                self._active.pop(id(tracker), None)
+
+        if persisted and event_time is not None:
+            latency = time.time() - event_time
+            logger.info(f"Report for {key} persisted {latency:.1f}s after upload")
+            if self.instrumentation is not None:
+                self._latency_metric.observe(latency)
+
+        if finished:
+            if tracker.failed:
+                self._finish(tracker.message, 'retried', ack=False)
+            else:
+                self._finish(tracker.message, 'acked', ack=True)
+
+    def _finish(self, message: QueueMessage, result: str, ack: bool) -> None:
+        try:
+            if ack:
+                self.event_queue.ack(message)
+            else:
+                self.event_queue.nack(message, self.retry_delay)
+        except Exception as e:
+            logger.error(f"Error settling message ({result}): {e}")
+        with self._lock:
+            self._counts[result] += 1
+        if self.instrumentation is not None:
+            self._messages_metric.inc(result=result)
+
+    def _heartbeat_loop(self) -> None:
+        interval = max(1.0, self.visibility_timeout / 3)
+        # Runs until everything received has been settled, not just until stop()
+        while not self._finished.wait(interval):
+            now = time.time()
+            with self._lock:
+                trackers = list(self._active.values())
+            for tracker in trackers:
+                # Keep long-running messages hidden so another worker does not pick them up
+                if now - tracker.message.received_at >= self.visibility_timeout / 2:
+                    try:
+                        self.event_queue.extend(tracker.message, self.visibility_timeout)
+                        tracker.message.received_at = now
+                    except Exception as e:
+                        logger.warning(f"Could not extend message visibility: {e}")
@@ -1,86 +1,751 @@
-import boto3
-from typing import Optional, Dict, List
-from datetime import datetime
-import logging
-from services.s3_service import S3Service
-from services.rekognition_service import RekognitionService
-from services.bedrock_service import BedrockService
-
-logger = logging.getLogger(__name__)
-
-class MultiImageDamageAnalyzer:
-    def __init__(self, s3_service: S3Service, rekognition_service: RekognitionService, bedrock_service: BedrockService):
-        """
-        Initialize MultiImageDamageAnalyzer with required services
-        """
-        self.s3_service = s3_service
-        self.rekognition_service = rekognition_service
-        self.bedrock_service = bedrock_service
-        self.s3_client = boto3.client('s3')
-
-    def list_jpg_images(self, source_bucket: str) -> List[str]:
-        """
-        List all JPG/JPEG images in the source bucket
-        """
-        try:
-            response = self.s3_client.list_objects_v2(Bucket=source_bucket)
-            return [
-                obj['Key'] for obj in response.get('Contents', []) 
-                if obj['Key'].lower().endswith(('.jpg', '.jpeg'))
-            ]
-        except Exception as e:
-            logger.error(f"Error listing images: {e}")
-            return []
-
-    def process_images(self, source_bucket: str, output_bucket: Optional[str] = None) -> List[Dict]:
-        """
-        Process all images in the source bucket
-        """
-        image_keys = self.list_jpg_images(source_bucket)
-        
-        if not image_keys:
-            logger.warning("No images found in the source bucket")
-            return []
-        
-        processing_results = []
-
-        for source_key in image_keys:
-            try:
-                # Read image bytes
-                image_bytes = self.s3_service.read_image(source_bucket, source_key)
-               
-                # Detect damage from S3 reference
-                s3_reference = {'Bucket': source_bucket, 'Name': source_key}
-                damage_labels = self.rekognition_service.detect_damage(
-                    s3_reference,
-                    source_type='s3'
-                )
-               
-                # Generate report using image bytes
-                report = self.bedrock_service.generate_report(
-                    image_bytes, damage_labels
-                )
-               
-                # Save report if output bucket specified
-                if output_bucket:
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    report_key = f"reports/{source_key.split('/')[-1]}_{timestamp}.txt"
-                    upload_success = self.s3_service.upload_text(
-                        bucket=output_bucket,
-                        key=report_key,
-                        text_content=report
-                    )
-                    if not upload_success:
-                        logger.warning(f"Failed to save report for {source_key}")
-               
-                processing_results.append({
-                    'source_key': source_key,
-                    'damage_labels': damage_labels,
-                    'report': report
-                })
-               
-            except Exception as e:
-                logger.error(f"Error processing {source_key}: {e}")
-                continue
-        
-        return processing_results
\ No newline at end of file
+from typing import Optional, Dict, List, Iterable, Iterator, Callable
+from datetime import datetime, timezone
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from services.s3_service import S3Service
+from services.rekognition_service import RekognitionService
+from services.bedrock_service import BedrockService
+from services.report_cache import hash_image
+from services.checkpoint_manifest import CheckpointManifest
+from services.image_preprocessor import ImagePreprocessor
+from services.instrumentation import Instrumentation
+from services.near_duplicates import DuplicateSession, NearDuplicateDetector
+from services.memory_budget import MemoryBudget, estimate_image_memory
+from services.result_sink import ResultSink, compact_labels
+from services.triage import ROUTE_FAST, ROUTE_SKIP, TriagePolicy, route_model
+from analyzers.pipeline import PipelineItem, StagePipeline, resolve_stage_concurrency
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+# list_objects_v2 returns at most this many keys per page
+LISTING_PAGE_SIZE = 1000
+
+# Claims with more photos than this are assessed in several groups
+MAX_CLAIM_GROUP_SIZE = 100
+
+# Results of representatives kept for near-duplicates that arrive after them
+MAX_RESOLVED_REPRESENTATIVES = 10000
+
+_LISTING_DONE = object()
+
+
+def claim_id_from_key(key: str) -> str:
+    """
+    Default claim grouping: all images in the same S3 folder belong to one claim
+    """
+    return key.rsplit('/', 1)[0] if '/' in key else ''
+
+
+class MultiImageDamageAnalyzer:
+    def __init__(self, s3_service: S3Service, rekognition_service: RekognitionService, bedrock_service: BedrockService,
+                 stage_concurrency: Optional[Dict[str, int]] = None,
+                 manifest: Optional[CheckpointManifest] = None,
+                 single_fetch: bool = True,
+                 preprocessor: Optional[ImagePreprocessor] = None,
+                 s3_client=None,
+                 instrumentation: Optional[Instrumentation] = None,
+                 deduplicator: Optional[NearDuplicateDetector] = None,
+                 memory_budget: Optional[MemoryBudget] = None,
+                 result_sink: Optional[ResultSink] = None,
+                 text_reports: bool = True,
+                 triage: Optional[TriagePolicy] = None):
+        """
+        Initialize MultiImageDamageAnalyzer with required services
+
+        :param stage_concurrency: Optional worker count per stage
+                                  ('fetch', 'dedupe', 'preprocess', 'detect', 'triage', 'report', 'persist')
+        :param manifest: Optional checkpoint manifest enabling incremental, resumable runs
+        :param single_fetch: Send the fetched bytes to Rekognition instead of a second S3 read
+        :param preprocessor: Optional image pre-processor shrinking the Bedrock payload
+        :param s3_client: Client used for listing (default: the S3Service's shared client)
+        :param instrumentation: Optional registry receiving per-image, per-stage spans
+        :param deduplicator: Optional near-duplicate detector; look-alike photos reuse the result of the
+                             first one instead of calling Rekognition and Bedrock again
+        :param memory_budget: Optional cap on the bytes of in-flight images; images wait for room
+                              before they are downloaded, so peak memory does not grow with the batch
+        :param result_sink: Optional sink receiving one compact record (labels, report, timings) per image
+        :param text_reports: Also save every report as its own text object in the output bucket
+        :param triage: Optional policy routing images with no damage to a templated report and minor
+                       damage to the fast model; without it every image goes to the full model
+        """
+        self.s3_service = s3_service
+        self.rekognition_service = rekognition_service
+        self.bedrock_service = bedrock_service
+        self.s3_client = s3_client or s3_service.s3_client
+        self.stage_concurrency = resolve_stage_concurrency(stage_concurrency)
+        self.manifest = manifest
+        self.single_fetch = single_fetch
+        self.preprocessor = preprocessor
+        self.instrumentation = instrumentation
+        self.deduplicator = deduplicator
+        self.memory_budget = memory_budget
+        self.result_sink = result_sink
+        self.text_reports = text_reports
+        self.triage = triage
+
+    def list_jpg_images(self, source_bucket: str, prefix: str = '', start_after: Optional[str] = None) -> List[str]:
+        """
+        List all JPG/JPEG images in the source bucket
+        """
+        return list(self.iter_jpg_images(source_bucket, prefix=prefix, start_after=start_after))
+
+    def iter_jpg_images(self, source_bucket: str, prefix: str = '', start_after: Optional[str] = None) -> Iterator[str]:
+        """
+        Lazily yield JPG/JPEG keys, following continuation tokens past the first 1000
+
+        :param source_bucket: Bucket to list
+        :param prefix: Only list keys under this prefix
+        :param start_after: Only list keys that sort after this key
+        :return: Iterator of image keys, in S3 listing order
+        """
+        for obj in self.iter_image_objects(source_bucket, prefix=prefix, start_after=start_after):
+            yield obj['Key']
+
+    def iter_image_objects(self, source_bucket: str, prefix: str = '', start_after: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Lazily yield the list_objects_v2 entries (Key, ETag, Size, LastModified) of JPG/JPEG images
+
+        Listing errors are logged and end the listing, like list_jpg_images always did.
+        """
+        request = {'Bucket': source_bucket}
+        if prefix:
+            request['Prefix'] = prefix
+        if start_after:
+            request['StartAfter'] = start_after
+
+        try:
+            while True:
+                response = self.s3_client.list_objects_v2(**request)
+                for obj in response.get('Contents', []):
+                    if obj['Key'].lower().endswith(IMAGE_EXTENSIONS):
+                        yield obj
+                if not response.get('IsTruncated'):
+                    break
+                request['ContinuationToken'] = response['NextContinuationToken']
+        except Exception as e:
+            logger.error(f"Error listing images in {source_bucket}/{prefix}: {e}")
+
+    def iter_jpg_images_sharded(self, source_bucket: str, prefixes: List[str],
+                                max_workers: int = 8) -> Iterator[str]:
+        """
+        List several key prefixes in parallel and yield keys as soon as any listing returns them
+
+        :param source_bucket: Bucket to list
+        :param prefixes: Key prefixes to list, e.g. one per date or region folder
+        :param max_workers: Max prefixes listed at the same time
+        :return: Iterator of image keys, interleaved across prefixes
+        """
+        for obj in self.iter_image_objects_sharded(source_bucket, prefixes, max_workers=max_workers):
+            yield obj['Key']
+
+    def iter_image_objects_sharded(self, source_bucket: str, prefixes: List[str],
+                                   max_workers: int = 8) -> Iterator[Dict]:
+        """
+        Object-entry variant of iter_jpg_images_sharded
+        """
+        if not prefixes:
+            yield from self.iter_image_objects(source_bucket)
+            return
+
+        results = queue.Queue(maxsize=LISTING_PAGE_SIZE * max_workers)
+        stop = threading.Event()
+        pending_prefixes = queue.Queue()
+        for prefix in prefixes:
+            pending_prefixes.put(prefix)
+
+        def list_prefixes():
+            while not stop.is_set():
+                try:
+                    prefix = pending_prefixes.get_nowait()
+                except queue.Empty:
+                    break
+                for obj in self.iter_image_objects(source_bucket, prefix=prefix):
+                    if not self._put_until_stopped(results, obj, stop):
+                        return
+            self._put_until_stopped(results, _LISTING_DONE, stop)
+
+        workers = min(max_workers, len(prefixes))
+        for worker_number in range(workers):
+            threading.Thread(target=list_prefixes, name=f'list-{worker_number}', daemon=True).start()
+
+        finished = 0
+        try:
+            while finished < workers:
+                obj = results.get()
+                if obj is _LISTING_DONE:
+                    finished += 1
+                    continue
+                yield obj
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _put_until_stopped(target: queue.Queue, value, stop: threading.Event) -> bool:
+        # Block on a full queue, but give up once the consumer has gone away
+        while not stop.is_set():
+            try:
+                target.put(value, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def process_images(self, source_bucket: str, output_bucket: Optional[str] = None,
+                       ordered: bool = False, prefixes: Optional[List[str]] = None,
+                       start_after: Optional[str] = None) -> List[Dict]:
+        """
+        Process all images in the source bucket
+
+        Keys are fed into the pipeline while the listing is still running, so
+        the first reports are produced before the bucket has been fully listed.
+
+        :param ordered: Return results in listing order instead of completion order
+        :param prefixes: Optional key prefixes to list in parallel instead of the whole bucket
+        :param start_after: Only process keys that sort after this key (single-prefix listing only)
+
+        With a checkpoint manifest configured, objects already processed in
+        their current version are skipped and unfinished ones are retried.
+        """
+        if prefixes:
+            image_objects = self.iter_image_objects_sharded(source_bucket, prefixes)
+        else:
+            image_objects = self.iter_image_objects(source_bucket, start_after=start_after)
+
+        processing_results = list(self.iter_process_objects(source_bucket, image_objects, output_bucket, ordered=ordered))
+
+        if not processing_results:
+            logger.warning("No images processed from the source bucket")
+
+        return processing_results
+
+    def iter_process_keys(self, source_bucket: str, image_keys: Iterable[str],
+                          output_bucket: Optional[str] = None, ordered: bool = False) -> Iterator[Dict]:
+        """
+        Run images through the fetch -> detect -> report -> persist pipeline
+
+        Failed images are logged and skipped, exactly like the sequential loop did.
+
+        :param source_bucket: Bucket holding the images
+        :param image_keys: Keys to process (may be a lazy iterable)
+        :param output_bucket: Optional bucket to save reports in
+        :param ordered: Yield in submission order instead of completion order
+        :return: Iterator of result dictionaries
+        """
+        image_objects = ({'Key': key} for key in image_keys)
+        return self.iter_process_objects(source_bucket, image_objects, output_bucket, ordered=ordered)
+
+    def iter_process_objects(self, source_bucket: str, image_objects: Iterable[Dict],
+                             output_bucket: Optional[str] = None, ordered: bool = False) -> Iterator[Dict]:
+        """
+        Pipeline variant of iter_process_keys taking list_objects_v2 entries
+
+        :param image_objects: Entries with at least 'Key' (ETag/Size/LastModified feed the manifest)
+        """
+        if self.manifest is not None:
+            image_objects = self.manifest.filter_pending(source_bucket, image_objects)
+
+        contexts = ({'bucket': source_bucket, 'key': obj['Key'], 'object': obj} for obj in image_objects)
+        for item in self._run_pipeline(contexts, output_bucket, ordered):
+            if item.ok:
+                yield item.value
+            else:
+                logger.error(f"Error processing {item.value['key']} ({item.failed_stage}): {item.error}")
+                if self.manifest is not None:
+                    self.manifest.mark_failed(source_bucket, item.value['key'])
+
+    def iter_process_contexts(self, contexts: Iterable[Dict], output_bucket: Optional[str] = None,
+                              ordered: bool = False) -> Iterator[PipelineItem]:
+        """
+        Lowest-level entry point: run caller-built contexts and yield every outcome
+
+        Unlike iter_process_objects, failures are yielded too and the manifest
+        filter is left to the caller, so item.seq is always the position of the
+        context in the input. Used by the event worker to tie results back to
+        queue messages.
+
+        :param contexts: Dicts with 'bucket', 'key' and 'object' (a list_objects_v2-style entry)
+        :return: Iterator of PipelineItems; ok items carry the result dict, failed ones the context
+        """
+        for item in self._run_pipeline(contexts, output_bucket, ordered):
+            if not item.ok:
+                logger.error(f"Error processing {item.value['key']} ({item.failed_stage}): {item.error}")
+                if self.manifest is not None:
+                    self.manifest.mark_failed(item.value['bucket'], item.value['key'])
+            yield item
+
+    def process_claims(self, source_bucket: str, output_bucket: Optional[str] = None,
+                       group_by: Optional[Callable[[str], str]] = None,
+                       prefixes: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Process the bucket claim by claim, assessing each claim's photos in shared Bedrock requests
+
+        :param source_bucket: Bucket holding the images
+        :param output_bucket: Optional bucket to save per-image reports and claim summaries in
+        :param group_by: Maps an image key to its claim id (default: the key's folder)
+        :param prefixes: Optional key prefixes to list in parallel instead of the whole bucket
+        :return: List of claim results with 'claim_id', 'summary' and per-image 'images'
+        """
+        if prefixes:
+            image_objects = self.iter_image_objects_sharded(source_bucket, prefixes)
+        else:
+            image_objects = self.iter_image_objects(source_bucket)
+        return list(self.iter_process_claims(source_bucket, image_objects, output_bucket, group_by=group_by))
+
+    def iter_process_claims(self, source_bucket: str, image_objects: Iterable[Dict],
+                            output_bucket: Optional[str] = None,
+                            group_by: Optional[Callable[[str], str]] = None) -> Iterator[Dict]:
+        """
+        Claim-batched variant of iter_process_objects
+
+        Images are fetched and run through Rekognition by the usual pipeline,
+        then grouped into claims. A claim is closed as soon as an image of a
+        different claim arrives, which keeps memory bounded because S3 lists
+        keys of the same folder together; a claim seen again later is simply
+        assessed as a separate group. Failed claims are logged and skipped.
+
+        :param image_objects: list_objects_v2 entries with at least 'Key'
+        :param group_by: Maps an image key to its claim id (default: the key's folder)
+        :return: Iterator of claim results
+        """
+        group_by = group_by or claim_id_from_key
+        if self.manifest is not None:
+            image_objects = self.manifest.filter_pending(source_bucket, image_objects)
+
+        contexts = ({'bucket': source_bucket, 'key': obj['Key'], 'object': obj} for obj in image_objects)
+        analyzed = self._build_pipeline(output_bucket, include_report=False).run(self._admit(contexts), ordered=True)
+
+        report_workers = self.stage_concurrency['report']
+        with ThreadPoolExecutor(max_workers=report_workers, thread_name_prefix='claim-report') as executor:
+            pending = deque()
+            for claim_id, claim_contexts in self._group_claims(analyzed, group_by):
+                pending.append(executor.submit(self._report_claim, claim_id, claim_contexts, output_bucket))
+                # Bound the number of claims (and their image bytes) waiting for Bedrock
+                while len(pending) >= report_workers * 2:
+                    claim_result = pending.popleft().result()
+                    if claim_result is not None:
+                        yield claim_result
+            while pending:
+                claim_result = pending.popleft().result()
+                if claim_result is not None:
+                    yield claim_result
+
+    def _group_claims(self, analyzed: Iterable, group_by: Callable[[str], str]) -> Iterator:
+        claim_id = None
+        claim_contexts = []
+        for item in analyzed:
+            if not item.ok:
+                logger.error(f"Error processing {item.value['key']} ({item.failed_stage}): {item.error}")
+                if self.manifest is not None:
+                    self.manifest.mark_failed(item.value['bucket'], item.value['key'])
+                continue
+            # A claim only closes when the next one arrives, which a full budget could
+            # hold back; grouped images are bounded by the claim size and pending claims instead
+            self._release_reservation(item.value)
+            item_claim = group_by(item.value['key'])
+            if claim_contexts and (item_claim != claim_id or len(claim_contexts) >= MAX_CLAIM_GROUP_SIZE):
+                yield claim_id, claim_contexts
+                claim_contexts = []
+            claim_id = item_claim
+            claim_contexts.append(item.value)
+        if claim_contexts:
+            yield claim_id, claim_contexts
+
+    def _report_claim(self, claim_id: str, claim_contexts: List[Dict], output_bucket: Optional[str]) -> Optional[Dict]:
+        span = nullcontext()
+        if self.instrumentation is not None:
+            span = self.instrumentation.span('claim.report', claim_id=claim_id, images=len(claim_contexts))
+        with span:
+            try:
+                # Images triaged as undamaged already carry their templated report
+                pending = [context for context in claim_contexts if 'report' not in context]
+                images = []
+                for context in pending:
+                    image = {
+                        'key': context['key'],
+                        'image_bytes': context.get('report_image') or context['image_bytes'],
+                        'damage_labels': context['damage_labels'],
+                        'image_hash': context['image_hash'],
+                        'media_type': context.get('media_type')
+                    }
+                    if 'report_image' in context:
+                        image['image_hash'] = f"{context['image_hash']}:{self.preprocessor.fingerprint}"
+                    images.append(image)
+
+                claim_report = {'reports': [], 'summary': '', 'requests': 0}
+                if images:
+                    claim_report = self.bedrock_service.generate_claim_report(images, model_id=self._claim_model(pending))
+                for context, report in zip(pending, claim_report['reports']):
+                    context['report'] = report
+
+                image_results = []
+                for context in claim_contexts:
+                    context['claim_id'] = claim_id
+                    image_results.append(self._persist_stage(context, output_bucket))
+
+                summary_key = None
+                if output_bucket and claim_report['summary']:
+                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                    summary_key = f"reports/claims/{claim_id.replace('/', '_') or 'root'}_{timestamp}.txt"
+                    if not self.s3_service.upload_text(bucket=output_bucket, key=summary_key,
+                                                       text_content=claim_report['summary']):
+                        logger.warning(f"Failed to save claim summary for {claim_id}")
+                        summary_key = None
+
+                return {
+                    'claim_id': claim_id,
+                    'summary': claim_report['summary'],
+                    'summary_key': summary_key,
+                    'bedrock_requests': claim_report['requests'],
+                    'images': image_results
+                }
+            except Exception as e:
+                logger.error(f"Error processing claim {claim_id}: {e}")
+                if self.instrumentation is not None:
+                    self.instrumentation.counter('claims_failed_total', 'Claims that could not be reported').inc()
+                if self.manifest is not None:
+                    for context in claim_contexts:
+                        self.manifest.mark_failed(context['bucket'], context['key'])
+                return None
+
+    def _claim_model(self, contexts: List[Dict]) -> Optional[str]:
+        # One request covers the claim, so a single image needing the full model escalates it
+        if all(context.get('triage', {}).get('route') == ROUTE_FAST for context in contexts):
+            return self.bedrock_service.fast_model_id
+        return None
+
+    def _run_pipeline(self, contexts: Iterable[Dict], output_bucket: Optional[str],
+                      ordered: bool) -> Iterator[PipelineItem]:
+        contexts = self._admit(contexts)
+        if self.deduplicator is None:
+            return self._build_pipeline(output_bucket).run(contexts, ordered=ordered)
+        session = self.deduplicator.new_session()
+        items = self._build_pipeline(output_bucket, session=session).run(contexts, ordered=ordered)
+        return self._link_duplicates(items, session)
+
+    def _link_duplicates(self, items: Iterator[PipelineItem], session: DuplicateSession) -> Iterator[PipelineItem]:
+        # Duplicates skip every stage, so they can overtake their representative;
+        # they are held back here until its outcome is known
+        resolved = OrderedDict()
+        waiting = {}
+        for item in items:
+            if item.ok and 'duplicate_of' in item.value:
+                representative = item.value['duplicate_of']
+                if representative in resolved:
+                    yield self._link_duplicate(item, resolved[representative])
+                elif session.is_representative(representative):
+                    waiting.setdefault(representative, []).append(item)
+                else:
+                    yield self._link_duplicate(item, RuntimeError(f"Result of {representative} is no longer available"))
+                continue
+
+            yield item
+            key = item.value['source_key'] if item.ok else item.value['key']
+            outcome = item.value if item.ok else item.error
+            if not item.ok:
+                # Let the next look-alike be analysed in its own right
+                session.forget(key)
+            resolved[key] = outcome
+            if len(resolved) > MAX_RESOLVED_REPRESENTATIVES:
+                session.forget(resolved.popitem(last=False)[0])
+            for duplicate in waiting.pop(key, []):
+                yield self._link_duplicate(duplicate, outcome)
+
+        for representative, duplicates in waiting.items():
+            for duplicate in duplicates:
+                yield self._link_duplicate(duplicate, RuntimeError(f"{representative} was not processed"))
+
+    def _link_duplicate(self, item: PipelineItem, outcome) -> PipelineItem:
+        duplicate = item.value
+        result_key = None
+        text_missing = not isinstance(outcome, Exception) and \
+            duplicate['report_required'] and outcome['report_key'] is None
+        if not isinstance(outcome, Exception) and self.result_sink is not None:
+            context = {
+                'bucket': duplicate['source_bucket'],
+                'key': duplicate['source_key'],
+                'object': duplicate['object'],
+                'damage_labels': outcome['damage_labels'],
+                'report': outcome['report'],
+                'timings': duplicate['timings'],
+                'duplicate_of': duplicate['duplicate_of'],
+                'duplicate_distance': duplicate['duplicate_distance']
+            }
+            bucket, key, on_persisted = duplicate['source_bucket'], duplicate['source_key'], duplicate['on_persisted']
+
+            def written(file_key: Optional[str]) -> None:
+                self._settle_persisted(bucket, key, outcome['report_key'] or file_key,
+                                       file_key is not None and not text_missing, on_persisted)
+            try:
+                result_key = self.result_sink.write(self._result_record(context, outcome['report_key']),
+                                                    callback=written)
+            except Exception as e:
+                item.error = e
+                item.failed_stage = 'persist'
+
+        if isinstance(outcome, Exception):
+            item.error = RuntimeError(f"Representative {duplicate['duplicate_of']} failed: {outcome}")
+            item.failed_stage = 'dedupe'
+        if not item.ok:
+            item.value = {'bucket': duplicate['source_bucket'], 'key': duplicate['source_key']}
+            return item
+
+        item.value = {
+            'source_key': duplicate['source_key'],
+            'damage_labels': outcome['damage_labels'],
+            'report': outcome['report'],
+            'report_key': outcome['report_key'],
+            'result_key': result_key,
+            'report_metrics': {},
+            'duplicate_of': duplicate['duplicate_of'],
+            'duplicate_distance': duplicate['duplicate_distance']
+        }
+        if self.result_sink is None:
+            self._settle_persisted(duplicate['source_bucket'], duplicate['source_key'], outcome['report_key'],
+                                   not text_missing, duplicate['on_persisted'])
+        if self.instrumentation is not None:
+            self.instrumentation.counter('near_duplicates_total', 'Images linked to a near-duplicate').inc()
+        return item
+
+    def _admit(self, contexts: Iterable[Dict]) -> Iterator[Dict]:
+        if self.memory_budget is None:
+            yield from contexts
+            return
+        for context in contexts:
+            # Reserved in input order by the pipeline's feeder, so the oldest image in
+            # flight always holds its memory and ordered output cannot starve it
+            context['memory_reserved'] = self.memory_budget.reserve(
+                estimate_image_memory(context['object'].get('Size'))
+            )
+            yield context
+
+    def _release_memory(self, context: Dict) -> None:
+        context.pop('image_bytes', None)
+        context.pop('report_image', None)
+        self._release_reservation(context)
+
+    def _release_reservation(self, context: Dict) -> None:
+        if self.memory_budget is not None:
+            self.memory_budget.release(context.pop('memory_reserved', 0))
+
+    def _instrumented(self, name: str, stage: Callable[[Dict], Dict]) -> Callable[[Dict], Dict]:
+        def run(context: Dict) -> Dict:
+            start = time.perf_counter()
+            try:
+                return stage(context)
+            except Exception:
+                # A failed item skips the remaining stages, so its buffers are dropped here
+                self._release_memory(context)
+                raise
+            finally:
+                context.setdefault('timings', {})[name] = round(time.perf_counter() - start, 4)
+        return run
+
+    def _build_pipeline(self, output_bucket: Optional[str], include_report: bool = True,
+                        session: Optional[DuplicateSession] = None) -> StagePipeline:
+        concurrency = self.stage_concurrency
+
+        # Stages mutate and return a per-image context dict, so a failing item
+        # still carries its key to the error log
+        def persist(context: Dict) -> Dict:
+            return self._persist_stage(context, output_bucket)
+
+        stages = [('fetch', self._fetch_stage, concurrency['fetch'])]
+        if session is not None:
+            stages.append(('dedupe', lambda context: self._dedupe_stage(context, session), concurrency['dedupe']))
+        if self.preprocessor is not None:
+            stages.append(('preprocess', self._preprocess_stage, concurrency['preprocess']))
+        stages.append(('detect', self._detect_stage, concurrency['detect']))
+        if self.triage is not None:
+            stages.append(('triage', self._triage_stage, concurrency['triage']))
+        if include_report:
+            stages += [
+                ('report', self._report_stage, concurrency['report']),
+                ('persist', persist, concurrency['persist'])
+            ]
+        stages = [(name, self._instrumented(name, stage), workers) for name, stage, workers in stages]
+        return StagePipeline(
+            stages,
+            instrumentation=self.instrumentation,
+            item_attributes=lambda context: {'key': context.get('key') or context.get('source_key')}
+        )
+
+    def _fetch_stage(self, context: Dict) -> Dict:
+        if self.manifest is not None:
+            self.manifest.mark_started(context['bucket'], context['object'])
+
+        # Read image bytes
+        context['image_bytes'] = self.s3_service.read_image(context['bucket'], context['key'])
+        context['image_hash'] = hash_image(context['image_bytes'])
+        if self.memory_budget is not None:
+            # The listing size may be missing or stale; account for what was actually read
+            context['memory_reserved'] = self.memory_budget.resize(
+                context.get('memory_reserved', 0), estimate_image_memory(len(context['image_bytes']))
+            )
+        return context
+
+    def _dedupe_stage(self, context: Dict, session: DuplicateSession) -> Dict:
+        match = session.check(context['key'], context['image_bytes'])
+        # A redelivered key matches itself; analyse it again rather than link it to itself
+        if match is not None and match[0] != context['key']:
+            context['duplicate_of'], context['duplicate_distance'] = match
+            # Nothing downstream needs the bytes of a duplicate
+            self._release_memory(context)
+        return context
+
+    def _preprocess_stage(self, context: Dict) -> Dict:
+        if 'duplicate_of' in context:
+            return context
+        # Rekognition keeps the original; only the Bedrock payload is shrunk
+        context['report_image'], context['media_type'] = self.preprocessor.preprocess(context['image_bytes'])
+        return context
+
+    def _detect_stage(self, context: Dict) -> Dict:
+        if 'duplicate_of' in context:
+            return context
+        # Reuse the fetched bytes so Rekognition does not read the object from S3 again
+        context['damage_labels'] = self.rekognition_service.detect_damage_for_object(
+            context['bucket'],
+            context['key'],
+            image_bytes=context['image_bytes'] if self.single_fetch else None,
+            image_hash=context['image_hash']
+        )
+        if 'report_image' in context:
+            # Only the pre-processed copy is sent to Bedrock
+            del context['image_bytes']
+        return context
+
+    def _triage_stage(self, context: Dict) -> Dict:
+        if 'duplicate_of' in context:
+            return context
+        decision = self.triage.decide(context['damage_labels'])
+        route = decision['route']
+        decision['model_id'] = route_model(route, self.bedrock_service)
+        context['triage'] = decision
+        if route == ROUTE_SKIP:
+            context['report'] = self.triage.skip_report
+            context['report_metrics'] = {}
+            # Nothing is sent to Bedrock, so the image can go now
+            self._release_memory(context)
+        if self.instrumentation is not None:
+            self.instrumentation.counter(
+                'triage_decisions_total', 'Images per triage route', ('route',)).inc(route=route)
+        return context
+
+    def _report_stage(self, context: Dict) -> Dict:
+        if 'duplicate_of' in context or 'report' in context:
+            return context
+        # Generate report using image bytes
+        if 'report_image' in context:
+            report_image = context['report_image']
+            # Keep reports for differently pre-processed payloads apart in the cache
+            image_hash = f"{context['image_hash']}:{self.preprocessor.fingerprint}"
+        else:
+            report_image = context.pop('image_bytes')
+            image_hash = context['image_hash']
+        context.pop('report_image', None)
+
+        context['report_metrics'] = {}
+        context['report'] = self.bedrock_service.generate_report(
+            report_image, context['damage_labels'],
+            image_hash=image_hash,
+            media_type=context.get('media_type'),
+            metrics=context['report_metrics'],
+            model_id=context['triage']['model_id'] if 'triage' in context else None
+        )
+        del report_image
+        self._release_memory(context)
+        return context
+
+    def _persist_stage(self, context: Dict, output_bucket: Optional[str]) -> Dict:
+        if 'duplicate_of' in context:
+            # Completed by _link_duplicates once the representative's result is known
+            return {
+                'source_key': context['key'],
+                'source_bucket': context['bucket'],
+                'object': context['object'],
+                'timings': context.get('timings', {}),
+                'duplicate_of': context['duplicate_of'],
+                'duplicate_distance': context['duplicate_distance'],
+                'report_required': bool(output_bucket and self.text_reports),
+                'on_persisted': context.get('on_persisted')
+            }
+        source_key = context['key']
+        report_key = None
+        result_key = None
+
+        # Save report if output bucket specified
+        if output_bucket and self.text_reports:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            report_key = f"reports/{source_key.split('/')[-1]}_{timestamp}.txt"
+            upload_success = self.s3_service.upload_text(
+                bucket=output_bucket,
+                key=report_key,
+                text_content=context['report']
+            )
+            if not upload_success:
+                logger.warning(f"Failed to save report for {source_key}")
+                report_key = None
+
+        text_missing = bool(output_bucket and self.text_reports and report_key is None)
+        bucket, on_persisted = context['bucket'], context.get('on_persisted')
+        if self.result_sink is not None:
+            # Only buffered so far; settled once the result file is written
+            def written(file_key: Optional[str]) -> None:
+                self._settle_persisted(bucket, source_key, report_key or file_key,
+                                       file_key is not None and not text_missing, on_persisted)
+            result_key = self.result_sink.write(self._result_record(context, report_key), callback=written)
+        else:
+            self._settle_persisted(bucket, source_key, report_key, not text_missing, on_persisted)
+
+        result = {
+            'source_key': source_key,
+            'damage_labels': context['damage_labels'],
+            'report': context['report'],
+            'report_key': report_key,
+            'result_key': result_key,
+            'report_metrics': context.get('report_metrics', {})
+        }
+        for field in ('claim_id', 'triage'):
+            if field in context:
+                result[field] = context[field]
+        return result
+
+    def _settle_persisted(self, bucket: str, key: str, persisted_key: Optional[str], saved: bool,
+                          on_persisted: Optional[Callable[[bool], None]]) -> None:
+        # Runs once the result is durable, or known to be lost; with a result sink
+        # that is when its file is written, which can be long after the item left the pipeline
+        if self.manifest is not None:
+            if saved:
+                self.manifest.mark_done(bucket, key, persisted_key)
+            else:
+                # Not persisted, so leave it for the next run to retry
+                self.manifest.mark_failed(bucket, key)
+        if on_persisted is not None:
+            on_persisted(saved)
+
+    @staticmethod
+    def _result_record(context: Dict, report_key: Optional[str]) -> Dict:
+        obj = context.get('object') or {}
+        record = {
+            'source_bucket': context['bucket'],
+            'source_key': context['key'],
+            'etag': obj.get('ETag'),
+            'size': obj.get('Size'),
+            'labels': compact_labels(context['damage_labels']),
+            'report': context['report'],
+            'report_key': report_key,
+            'report_metrics': context.get('report_metrics', {}),
+            'timings': context.get('timings', {}),
+            'processed_at': datetime.now(timezone.utc).isoformat()
+        }
+        for field in ('claim_id', 'triage', 'duplicate_of', 'duplicate_distance'):
+            if field in context:
+                record[field] = context[field]
+        return record
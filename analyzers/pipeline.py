@@ -0,0 +1,215 @@
+import heapq
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Default worker count per stage; network-bound stages get the most threads
+DEFAULT_STAGE_CONCURRENCY = {
+    'fetch': 16,
+    'dedupe': 4,
+    'preprocess': 4,
+    'detect': 8,
+    'triage': 2,
+    'report': 8,
+    'persist': 16
+}
+
+_SENTINEL = object()
+
+
+class PipelineItem:
+    """
+    Unit of work travelling through the pipeline
+
+    :param seq: Submission sequence number
+    :param value: Current payload (the output of the previous stage)
+    """
+    __slots__ = ('seq', 'value', 'error', 'failed_stage')
+
+    def __init__(self, seq: int, value: Any):
+        self.seq = seq
+        self.value = value
+        self.error = None
+        self.failed_stage = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class StagePipeline:
+    def __init__(self,
+                 stages: List[Tuple[str, Callable[[Any], Any], int]],
+                 queue_size: Optional[int] = None,
+                 instrumentation=None,
+                 item_attributes: Optional[Callable[[Any], Dict]] = None):
+        """
+        Run items through a chain of stages, each with its own bounded worker pool
+
+        Every stage owns a fixed number of worker threads and a bounded input
+        queue, so a slow stage applies backpressure to the stages before it
+        instead of letting work pile up in memory.
+
+        :param stages: List of (name, function, workers) tuples, in execution order
+        :param queue_size: Max items waiting in front of each stage (default: 2x its workers)
+        :param instrumentation: Optional Instrumentation registry; each stage call becomes a 'pipeline.<stage>' span
+        :param item_attributes: Optional function mapping an item's value to extra span attributes (e.g. its key)
+        """
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        for name, _, workers in stages:
+            if workers < 1:
+                raise ValueError(f"Stage '{name}' needs at least one worker")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.instrumentation = instrumentation
+        self.item_attributes = item_attributes
+
+    def run(self, items: Iterable[Any], ordered: bool = False) -> Iterator[PipelineItem]:
+        """
+        Feed items through all stages and yield them as they finish
+
+        A failing stage marks the item with the error and forwards it straight
+        to the output, so one bad item never stops the rest of the batch.
+
+        :param items: Input items; consumed lazily, so a generator can still be producing
+        :param ordered: Yield in submission order instead of completion order
+        :return: Iterator of finished PipelineItems (check .ok / .error)
+        """
+        queues = [
+            queue.Queue(maxsize=self.queue_size or workers * 2)
+            for _, _, workers in self.stages
+        ]
+        output = queue.Queue()
+        stop = threading.Event()
+        threads = []
+
+        feeder = threading.Thread(
+            target=self._feed, args=(items, queues[0], output, stop), name='pipeline-feed', daemon=True
+        )
+        threads.append(feeder)
+
+        remaining = [workers for _, _, workers in self.stages]
+        remaining_lock = threading.Lock()
+
+        for index, (name, func, workers) in enumerate(self.stages):
+            next_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+            next_workers = self.stages[index + 1][2] if next_queue is not None else 1
+            for worker_number in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(index, name, func, queues[index], next_queue, next_workers,
+                          output, remaining, remaining_lock, stop),
+                    name=f'pipeline-{name}-{worker_number}',
+                    daemon=True
+                ))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            if ordered:
+                yield from self._ordered(output)
+            else:
+                yield from self._unordered(output)
+        finally:
+            # Consumer stopped early (or finished): let the threads drain out
+            stop.set()
+
+    def _feed(self, items, first_queue, output, stop):
+        seq = 0
+        try:
+            for value in items:
+                if stop.is_set():
+                    break
+                first_queue.put(PipelineItem(seq, value))
+                seq += 1
+        except Exception as e:
+            logger.error(f"Error reading pipeline input: {e}")
+        finally:
+            # Tell the output how many items to expect, then shut down the first stage
+            output.put(('count', seq))
+            for _ in range(self.stages[0][2]):
+                first_queue.put(_SENTINEL)
+
+    def _work(self, index, name, func, in_queue, next_queue, next_workers,
+              output, remaining, remaining_lock, stop):
+        while True:
+            item = in_queue.get()
+            if item is _SENTINEL:
+                break
+            if not stop.is_set():
+                try:
+                    if self.instrumentation is not None:
+                        with self.instrumentation.span(f"pipeline.{name}", **self._attributes(item)):
+                            item.value = func(item.value)
+                    else:
+                        item.value = func(item.value)
+                except Exception as e:
+                    item.error = e
+                    item.failed_stage = name
+            else:
+                item.error = RuntimeError("Pipeline stopped")
+                item.failed_stage = name
+
+            if item.ok and next_queue is not None:
+                next_queue.put(item)
+            else:
+                output.put(('item', item))
+
+        # The last worker of a stage closes the next one
+        with remaining_lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last and next_queue is not None:
+            for _ in range(next_workers):
+                next_queue.put(_SENTINEL)
+
+    def _attributes(self, item: PipelineItem) -> Dict:
+        attributes = {'seq': item.seq}
+        if self.item_attributes is not None:
+            try:
+                attributes.update(self.item_attributes(item.value))
+            except Exception:
+                pass
+        return attributes
+
+    def _unordered(self, output) -> Iterator[PipelineItem]:
+        expected = None
+        done = 0
+        while expected is None or done < expected:
+            kind, payload = output.get()
+            if kind == 'count':
+                expected = payload
+                continue
+            done += 1
+            yield payload
+
+    def _ordered(self, output) -> Iterator[PipelineItem]:
+        pending = []
+        next_seq = 0
+        for item in self._unordered(output):
+            heapq.heappush(pending, (item.seq, id(item), item))
+            while pending and pending[0][0] == next_seq:
+                yield heapq.heappop(pending)[2]
+                next_seq += 1
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+
+def resolve_stage_concurrency(overrides: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Merge per-stage worker overrides onto the defaults
+
+    :param overrides: Optional mapping of stage name to worker count
+    :return: Complete stage -> workers mapping
+    """
+    concurrency = dict(DEFAULT_STAGE_CONCURRENCY)
+    for stage, workers in (overrides or {}).items():
+        if stage not in concurrency:
+            raise ValueError(f"Unknown pipeline stage '{stage}'")
+        concurrency[stage] = int(workers)
+    return concurrency
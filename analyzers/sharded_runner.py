@@ -0,0 +1,243 @@
+import functools
+import logging
+import os
+import socket
+import threading
+import uuid
+from typing import Callable, Dict, Iterator, List, Optional
+
+from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
+from services.shard_coordinator import SHARD_DONE, LeaseBackend, jump_hash
+from services.instrumentation import Instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedRunner:
+    def __init__(self,
+                 analyzer: MultiImageDamageAnalyzer,
+                 backend: LeaseBackend,
+                 run_id: str,
+                 worker_id: Optional[str] = None,
+                 lease_seconds: float = 60.0,
+                 poll_interval: float = 5.0,
+                 on_result: Optional[Callable[[Dict], None]] = None,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Process a bucket cooperatively with other nodes, one leased shard at a time
+
+        Every node runs a ShardedRunner with the same run_id and backend. A
+        node leases a shard, streams its keys through the analyzer pipeline in
+        key order and renews the lease with a checkpoint (the last key up to
+        which every result is persisted) while it works. If it dies, the lease
+        expires and another node resumes the shard after that checkpoint, so
+        at most the images that were in flight, or whose results were still
+        buffered in the result sink, are analysed twice. A node that loses its
+        lease stops feeding that shard immediately.
+
+        :param analyzer: Analyzer whose pipeline processes each shard
+        :param backend: Coordination store shared by all nodes
+        :param run_id: Identifies one pass over the bucket; reuse it to resume, change it to start over
+        :param worker_id: Unique name of this node (default: host name, pid and a random suffix)
+        :param lease_seconds: Lease length; renewed every third of it
+        :param poll_interval: Seconds between claim attempts while other nodes hold the remaining shards
+        :param on_result: Optional callback receiving every result dict
+        :param instrumentation: Optional metrics registry
+        """
+        self.analyzer = analyzer
+        self.backend = backend
+        self.run_id = run_id
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.on_result = on_result
+        self.instrumentation = instrumentation
+        self._stop = threading.Event()
+
+        if instrumentation is not None:
+            self._images_metric = instrumentation.counter(
+                'shard_images_total', 'Images processed by this node per outcome', ('result',))
+            self._shards_metric = instrumentation.counter(
+                'shards_total', 'Shards handled by this node per outcome', ('result',))
+
+    def run(self, source_bucket: str, output_bucket: Optional[str], shards: List[Dict],
+            wait_for_others: bool = True) -> Dict[str, int]:
+        """
+        Claim and process shards until the whole run is done
+
+        :param source_bucket: Bucket holding the images
+        :param output_bucket: Optional bucket to save reports in
+        :param shards: Shard plan (plan_hash_shards / plan_prefix_shards); must be identical on every node
+        :param wait_for_others: Keep polling while other nodes hold leases, to take over if they die
+        :return: Dictionary with the shards, images and failures handled by this node
+        """
+        self.backend.register_shards(self.run_id, shards)
+        totals = {'shards': 0, 'images': 0, 'failed': 0}
+        logger.info(f"Worker {self.worker_id} joined run {self.run_id}")
+
+        while not self._stop.is_set():
+            shard = self.backend.acquire(self.run_id, self.worker_id, self.lease_seconds)
+            if shard is None:
+                status = self.backend.status(self.run_id)
+                if all(row['state'] == SHARD_DONE for row in status) or not wait_for_others:
+                    break
+                # Remaining shards are leased elsewhere; wait in case a lease lapses
+                self._stop.wait(self.poll_interval)
+                continue
+
+            outcome = self._process_shard(source_bucket, output_bucket, shard)
+            totals['shards'] += outcome['completed']
+            totals['images'] += outcome['processed']
+            totals['failed'] += outcome['failed']
+            self.log_progress()
+            if outcome['unsettled']:
+                # Results could not be written (e.g. S3 is unavailable); give it time before retrying
+                self._stop.wait(self.poll_interval)
+
+        logger.info(f"Worker {self.worker_id} finished: {totals}")
+        return totals
+
+    def stop(self) -> None:
+        """
+        Stop after the current images; the shard is released so another node can continue it
+        """
+        self._stop.set()
+
+    def progress(self) -> Dict:
+        """
+        Run-wide progress summed over all shards
+
+        :return: Dictionary with shard counts per state, processed and failed images, and per-shard rows
+        """
+        status = self.backend.status(self.run_id)
+        summary = {'shards': len(status), 'processed': 0, 'failed': 0, 'rows': status}
+        for row in status:
+            summary[row['state']] = summary.get(row['state'], 0) + 1
+            summary['processed'] += row['processed']
+            summary['failed'] += row['failed']
+        return summary
+
+    def log_progress(self) -> None:
+        summary = self.progress()
+        logger.info(
+            f"Run {self.run_id}: {summary.get(SHARD_DONE, 0)}/{summary['shards']} shards done, "
+            f"{summary['processed']} images processed, {summary['failed']} failed"
+        )
+
+    def _process_shard(self, source_bucket: str, output_bucket: Optional[str], shard: Dict) -> Dict[str, int]:
+        shard_id = shard['shard_id']
+        resume = f" after {shard['checkpoint_key']}" if shard['checkpoint_key'] else ''
+        logger.info(f"Worker {self.worker_id} leased {shard_id} (attempt {shard['attempts']}){resume}")
+
+        state = {'checkpoint_key': None, 'processed': 0, 'failed': 0, 'reported_processed': 0, 'reported_failed': 0,
+                 'fed': 0, 'next_seq': 0}
+        # Key and outcome of every image past the checkpoint, by input position
+        keys = {}
+        outcomes = {}
+        state_lock = threading.Lock()
+        lost = threading.Event()
+        done = threading.Event()
+
+        def settle(seq: int, outcome: str) -> None:
+            # 'processed' and 'failed' (analysis failed) let the checkpoint pass; 'unpersisted' holds it
+            with state_lock:
+                if seq < state['next_seq'] or seq in outcomes:
+                    return
+                outcomes[seq] = outcome
+                state['processed' if outcome == 'processed' else 'failed'] += 1
+                while outcomes.get(state['next_seq'], 'unpersisted') != 'unpersisted':
+                    del outcomes[state['next_seq']]
+                    state['checkpoint_key'] = keys.pop(state['next_seq'])
+                    state['next_seq'] += 1
+            if self.instrumentation is not None:
+                self._images_metric.inc(result='processed' if outcome == 'processed' else 'failed')
+
+        def persisted(seq: int, saved: bool) -> None:
+            settle(seq, 'processed' if saved else 'unpersisted')
+
+        def contexts():
+            for obj in self._shard_objects(source_bucket, shard, lost):
+                with state_lock:
+                    seq = state['fed']
+                    keys[seq] = obj['Key']
+                    state['fed'] += 1
+                # The analyzer calls this once the result is durable (with a result sink,
+                # when its file is written), which is what moves the checkpoint
+                yield {'bucket': source_bucket, 'key': obj['Key'], 'object': obj,
+                       'on_persisted': functools.partial(persisted, seq)}
+
+        def renew() -> bool:
+            with state_lock:
+                checkpoint_key = state['checkpoint_key']
+                processed = state['processed'] - state['reported_processed']
+                failed = state['failed'] - state['reported_failed']
+                state['reported_processed'] += processed
+                state['reported_failed'] += failed
+            return self.backend.renew(self.run_id, shard_id, self.worker_id, self.lease_seconds,
+                                      checkpoint_key, processed, failed)
+
+        def heartbeat():
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not renew():
+                        logger.warning(f"Worker {self.worker_id} lost the lease on {shard_id}")
+                        lost.set()
+                        return
+                except Exception as e:
+                    logger.error(f"Error renewing lease on {shard_id}: {e}")
+
+        renewer = threading.Thread(target=heartbeat, name=f'lease-{shard_id}', daemon=True)
+        renewer.start()
+
+        try:
+            for item in self.analyzer.iter_process_contexts(contexts(), output_bucket, ordered=True):
+                if not item.ok:
+                    settle(item.seq, 'failed')
+                elif self.on_result is not None:
+                    try:
+                        self.on_result(item.value)
+                    except Exception as e:
+                        logger.error(f"Result callback failed for {item.value['source_key']}: {e}")
+            # Write out the shard's buffered results, so the checkpoint can reach its end
+            if self.analyzer.result_sink is not None:
+                self.analyzer.result_sink.rotate()
+        finally:
+            done.set()
+            renewer.join()
+
+        with state_lock:
+            unsettled = state['fed'] - state['next_seq']
+        completed = 0
+        if lost.is_set():
+            result = 'lost'
+        elif not renew():
+            result = 'lost'
+            logger.warning(f"Worker {self.worker_id} lost the lease on {shard_id} before finishing")
+        elif self._stop.is_set() or unsettled:
+            if unsettled:
+                logger.warning(f"{unsettled} results of {shard_id} were not persisted; "
+                               f"releasing it to resume after {state['checkpoint_key']}")
+            result = 'released'
+            self.backend.release(self.run_id, shard_id, self.worker_id)
+        else:
+            result = 'completed' if self.backend.complete(self.run_id, shard_id, self.worker_id) else 'lost'
+            completed = 1 if result == 'completed' else 0
+        logger.info(f"Shard {shard_id} {result}: {state['processed']} processed, {state['failed']} failed")
+        if self.instrumentation is not None:
+            self._shards_metric.inc(result=result)
+        return {'completed': completed, 'processed': state['processed'], 'failed': state['failed'],
+                'unsettled': unsettled}
+
+    def _shard_objects(self, source_bucket: str, shard: Dict, lost: threading.Event) -> Iterator[Dict]:
+        objects = self.analyzer.iter_image_objects(
+            source_bucket, prefix=shard['prefix'], start_after=shard['checkpoint_key']
+        )
+        if shard['hash_count']:
+            objects = (obj for obj in objects if jump_hash(obj['Key'], shard['hash_count']) == shard['hash_index'])
+        if self.analyzer.manifest is not None:
+            objects = self.analyzer.manifest.filter_pending(source_bucket, objects)
+        for obj in objects:
+            # Stop feeding as soon as the shard belongs to someone else or we are shutting down
+            if lost.is_set() or self._stop.is_set():
+                return
+            yield obj
@@ -1,61 +1,159 @@
-import logging
-from config.aws_config import AWSConfig
-from services.s3_service import S3Service
-from services.rekognition_service import RekognitionService
-from services.bedrock_service import BedrockService
-from analyzers.damage_analyzer import DamageAnalyzer
-from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-def main():
-    try:
-        # Initialize AWS configuration
-        aws_config = AWSConfig(
-            region_name='us-east-1'
-        )
-        aws_clients = aws_config.get_client()
-        
-        # Initialize services
-        s3_service = S3Service(aws_clients['s3'])
-        rekognition_service = RekognitionService(aws_clients['rekognition'])
-        bedrock_service = BedrockService(aws_clients['bedrock'])
-        
-        # Initialize analyzer with services
-        analyzer = MultiImageDamageAnalyzer(
-            s3_service=s3_service,
-            rekognition_service=rekognition_service,
-            bedrock_service=bedrock_service
-        )
-        
-        # Configuration
-        source_bucket = 'damage-analyzer1124-test'
-        #source_key = 'damage_images/home.jpg'
-        output_bucket = 'damage-analyzer1124-test'  # Optional
-        
-        # Perform analysis
-        #result = analyzer.analyze_damage(
-        results = analyzer.process_images(
-            source_bucket=source_bucket,
-            #source_key=source_key,
-            output_bucket=output_bucket
-        )
-        
-        # Log results
-        for result in results:
-            print(f"Image: {result['source_key']}")
-            print("Damage Labels:", result['damage_labels'])
-            print("Report:", result['report'])
-            print("-" * 50)
-        
-    except Exception as e:
-        logger.error(f"Application error: {e}")
-        raise
-
-if __name__ == "__main__":
+import logging
+from config.aws_config import AWSConfig
+from services.s3_service import S3Service
+from services.rekognition_service import RekognitionService
+from services.bedrock_service import BedrockService
+from services.report_cache import ReportCache
+from services.checkpoint_manifest import CheckpointManifest
+from services.instrumentation import Instrumentation
+from services.shard_coordinator import SQLiteLeaseBackend, plan_hash_shards
+from analyzers.damage_analyzer import DamageAnalyzer
+from services.near_duplicates import NearDuplicateDetector
+from services.memory_budget import MemoryBudget
+from services.damage_taxonomy import DamageTaxonomy
+from services.result_sink import ResultSink
+from services.triage import TriagePolicy
+from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer, claim_id_from_key
+from analyzers.sharded_runner import ShardedRunner
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Incremental mode keeps a manifest of processed images and skips unchanged ones
+INCREMENTAL = True
+MANIFEST_PATH = 'manifest.sqlite'
+MANIFEST_KEY = 'manifests/damage_analyzer_manifest.sqlite'
+
+# Metrics snapshot written at the end of a run (.prom for Prometheus text, otherwise JSON)
+METRICS_PATH = 'metrics.prom'
+
+# Multi-node mode: start this script on several hosts with the same RUN_ID;
+# they split the bucket into SHARD_COUNT hash shards leased through a shared database
+SHARD_COUNT = 0
+RUN_ID = 'damage-analyzer'
+COORDINATION_DB = 'shards.sqlite'
+
+# Photos of a claim within this many bits (of 64) of an earlier one reuse its report; None disables
+DUPLICATE_THRESHOLD = 6
+
+# Cap on the memory held by in-flight images; downloads wait once it is reached
+MEMORY_BUDGET_MB = 1024
+
+# Results (labels, report, timings) go to rolling JSON Lines files under this prefix;
+# set TEXT_REPORTS to also write one reports/<image>_<timestamp>.txt object per image
+RESULTS_PREFIX = 'results/'
+TEXT_REPORTS = False
+
+# Skip Bedrock for images without damage labels and send minor damage to the fast model
+TRIAGE = True
+
+# YAML damage taxonomy (terms, categories, severity weights); None uses the built-in one
+TAXONOMY_PATH = None
+
+# Client-side rate limiting and retries; off by default since the limits in
+# services/rate_limiter.DEFAULT_LIMITS are placeholders. Before enabling, set
+# RATE_LIMITS to the account's quotas, e.g. {'bedrock-runtime': {'tokens_per_minute': 2000000.0}}
+RATE_LIMITED = False
+RATE_LIMITS = {}
+
+def log_result(result):
+    print(f"Image: {result['source_key']}")
+    print("Damage Labels:", result['damage_labels'])
+    print("Report:", result['report'])
+    print("-" * 50)
+
+def main():
+    try:
+        # Per-stage spans plus AWS call, cache and token metrics
+        instrumentation = Instrumentation()
+
+        # Initialize AWS configuration
+        # Shared, lazily created clients; pools sized for the pipeline concurrency,
+        # with per-service rate limits and retries shared by every worker
+        aws_config = AWSConfig(
+            region_name='us-east-1',
+            max_pool_connections=64,
+            rate_limited=RATE_LIMITED,
+            rate_limits=RATE_LIMITS,
+            instrumentation=instrumentation
+        )
+        aws_clients = aws_config.get_client()
+        
+        # Shared label/report cache so re-runs skip Rekognition and Bedrock
+        report_cache = ReportCache(db_path='report_cache.sqlite', instrumentation=instrumentation)
+
+        # Initialize services
+        s3_service = S3Service(aws_clients['s3'])
+        taxonomy = DamageTaxonomy.from_file(TAXONOMY_PATH) if TAXONOMY_PATH else None
+        rekognition_service = RekognitionService(aws_clients['rekognition'], cache=report_cache, taxonomy=taxonomy)
+        bedrock_service = BedrockService(aws_clients['bedrock'], cache=report_cache,
+                                         instrumentation=instrumentation)
+        
+        # Configuration
+        source_bucket = 'damage-analyzer1124-test'
+        #source_key = 'damage_images/home.jpg'
+        output_bucket = 'damage-analyzer1124-test'  # Optional
+
+        manifest = None
+        if INCREMENTAL:
+            manifest = CheckpointManifest.load_from_s3(
+                aws_clients['s3'], output_bucket, MANIFEST_KEY, db_path=MANIFEST_PATH
+            )
+
+        result_sink = ResultSink(aws_clients['s3'], output_bucket, prefix=RESULTS_PREFIX,
+                                 instrumentation=instrumentation)
+
+        # Initialize analyzer with services
+        analyzer = MultiImageDamageAnalyzer(
+            s3_service=s3_service,
+            rekognition_service=rekognition_service,
+            bedrock_service=bedrock_service,
+            stage_concurrency={'fetch': 16, 'detect': 8, 'report': 8, 'persist': 16},
+            manifest=manifest,
+            instrumentation=instrumentation,
+            deduplicator=(NearDuplicateDetector(DUPLICATE_THRESHOLD, group_by=claim_id_from_key)
+                          if DUPLICATE_THRESHOLD is not None else None),
+            memory_budget=MemoryBudget(MEMORY_BUDGET_MB * 1024 * 1024, instrumentation=instrumentation),
+            result_sink=result_sink,
+            text_reports=TEXT_REPORTS,
+            triage=TriagePolicy() if TRIAGE else None
+        )
+        
+        # Perform analysis
+        #result = analyzer.analyze_damage(
+        # Results are logged as they arrive; the full set lives in the result files, not in memory
+        with result_sink:
+            if SHARD_COUNT:
+                runner = ShardedRunner(
+                    analyzer, SQLiteLeaseBackend(COORDINATION_DB), RUN_ID,
+                    on_result=log_result, instrumentation=instrumentation
+                )
+                runner.run(source_bucket, output_bucket, plan_hash_shards(SHARD_COUNT))
+            else:
+                for result in analyzer.iter_process_objects(
+                    source_bucket,
+                    analyzer.iter_image_objects(source_bucket),
+                    output_bucket=output_bucket
+                ):
+                    log_result(result)
+        logger.info(f"Result sink: {result_sink.stats()}")
+
+        logger.info(f"Report cache: {report_cache.stats()}")
+
+        if manifest is not None:
+            logger.info(f"Manifest: {manifest.counts(source_bucket)}")
+            manifest.sync_to_s3(aws_clients['s3'], output_bucket, MANIFEST_KEY)
+
+        instrumentation.write(METRICS_PATH)
+        logger.info(f"Metrics written to {METRICS_PATH}")
+        
+    except Exception as e:
+        logger.error(f"Application error: {e}")
+        raise
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
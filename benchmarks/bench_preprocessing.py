@@ -0,0 +1,119 @@
+"""
+Measure how much the image pre-processing stage shrinks Bedrock requests
+
+Usage:
+    python -m benchmarks.bench_preprocessing [--images DIR] [--live]
+
+Without --images a synthetic 12 MP photo is generated. With --live each
+image is also sent to Bedrock twice (original and pre-processed) to
+measure end-to-end invoke_model latency; this costs real money.
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import statistics
+import time
+
+from services.image_preprocessor import ImagePreprocessor, preprocess_image, DEFAULT_MAX_EDGE, DEFAULT_QUALITY
+
+
+def synthetic_photo(width: int = 4032, height: int = 3024) -> bytes:
+    from PIL import Image
+    # Noise compresses badly, which is close to what phone photos look like to JPEG
+    image = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=92)
+    return output.getvalue()
+
+
+def load_images(directory: str):
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(os.path.join(directory, name), 'rb') as f:
+                yield name, f.read()
+
+
+def estimated_image_tokens(image_bytes: bytes) -> int:
+    from PIL import Image
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        width, height = image.size
+    # Anthropic's published estimate; images beyond the max edge are downscaled server-side
+    scale = min(1.0, DEFAULT_MAX_EDGE / max(width, height))
+    return int((width * scale) * (height * scale) / 750)
+
+
+def request_body_size(image_bytes: bytes) -> int:
+    return len(json.dumps({'data': base64.b64encode(image_bytes).decode('ascii')}))
+
+
+def time_invoke(bedrock_service, image_bytes: bytes, media_type: str) -> float:
+    start = time.perf_counter()
+    bedrock_service.generate_report(image_bytes, [], media_type=media_type)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', help='Directory of sample images')
+    parser.add_argument('--max-edge', type=int, default=DEFAULT_MAX_EDGE)
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY)
+    parser.add_argument('--live', action='store_true', help='Also time real Bedrock calls')
+    parser.add_argument('--region', default='us-east-1')
+    args = parser.parse_args()
+
+    images = list(load_images(args.images)) if args.images else [('synthetic_12mp.jpg', synthetic_photo())]
+
+    bedrock_service = None
+    if args.live:
+        import boto3
+        from services.bedrock_service import BedrockService
+        bedrock_service = BedrockService(boto3.client('bedrock-runtime', region_name=args.region))
+
+    preprocessor = ImagePreprocessor(max_edge=args.max_edge, quality=args.quality)
+    rows = []
+    try:
+        # Warm the process pool so the first image does not pay for worker start-up
+        preprocessor.preprocess(images[0][1])
+        for name, original in images:
+            start = time.perf_counter()
+            processed, media_type = preprocessor.preprocess(original)
+            pool_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            preprocess_image(original, args.max_edge, args.quality)
+            inline_seconds = time.perf_counter() - start
+
+            row = {
+                'image': name,
+                'original_bytes': len(original),
+                'processed_bytes': len(processed),
+                'original_body_bytes': request_body_size(original),
+                'processed_body_bytes': request_body_size(processed),
+                'original_tokens': estimated_image_tokens(original),
+                'processed_tokens': estimated_image_tokens(processed),
+                'preprocess_seconds_pool': round(pool_seconds, 4),
+                'preprocess_seconds_inline': round(inline_seconds, 4)
+            }
+            if bedrock_service is not None:
+                row['invoke_seconds_original'] = round(time_invoke(bedrock_service, original, 'image/jpeg'), 3)
+                row['invoke_seconds_processed'] = round(time_invoke(bedrock_service, processed, media_type), 3)
+            rows.append(row)
+    finally:
+        preprocessor.close()
+
+    for row in rows:
+        print(json.dumps(row))
+
+    reduction = 1 - sum(r['processed_body_bytes'] for r in rows) / sum(r['original_body_bytes'] for r in rows)
+    print(f"Request body reduction: {reduction:.1%}")
+    print(f"Median pre-processing time: {statistics.median(r['preprocess_seconds_pool'] for r in rows):.3f}s")
+    if bedrock_service is not None:
+        original = statistics.median(r['invoke_seconds_original'] for r in rows)
+        processed = statistics.median(r['invoke_seconds_processed'] for r in rows)
+        print(f"Median invoke_model latency: {original:.2f}s -> {processed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
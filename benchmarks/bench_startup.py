@@ -0,0 +1,166 @@
+"""
+Measure import time and cold start of the serverless handler
+
+Usage:
+    python -m benchmarks.bench_startup [--modules handler app] [--runs 5]
+                                       [--import-budget-ms 100] [--cold-start-budget-ms 1500]
+
+Every measurement runs in a fresh interpreter. Import times come from
+`python -X importtime`; the cold start is the wall time of importing the
+handler plus building its runtime (boto3 clients are created, no AWS call
+is made). Exits non-zero when the handler exceeds a budget, so CI can
+enforce them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List
+
+from benchmarks.run_benchmark import git_revision
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only load when an invocation needs them
+HEAVY_MODULES = ('boto3', 'botocore', 'reportlab', 'PIL', 'yaml', 'asyncio')
+
+_COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+import handler
+imported = time.perf_counter()
+handler.get_runtime()
+built = time.perf_counter()
+handler.get_runtime()
+warm = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'runtime_ms': (built - imported) * 1000,
+    'warm_ms': (warm - built) * 1000,
+    'heavy_loaded': [name for name in %r if name in sys.modules]
+}))
+"""
+
+
+def _environment() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault('AWS_REGION', 'us-east-1')
+    env.setdefault('AWS_DEFAULT_REGION', env['AWS_REGION'])
+    # Outside AWS the metadata endpoint times out, which would swamp the measurement
+    env.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+    return env
+
+
+def import_profile(module: str) -> Dict:
+    """
+    Import a module in a fresh interpreter under -X importtime
+
+    :param module: Module to import
+    :return: Dictionary with 'total_ms', the 'largest' direct imports and the 'heavy' modules it loaded
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT, env=_environment(), capture_output=True, text=True, check=True
+    )
+    total_us = 0
+    children = {}
+    pending = {}
+    loaded = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        loaded.add(name.split('.')[0])
+        # Children are printed before their parent, so direct imports wait for the top-level line
+        if depth == 1:
+            pending[name] = int(cumulative)
+        elif depth == 0:
+            if name == module:
+                total_us = int(cumulative)
+                children = pending
+            pending = {}
+    largest = sorted(children.items(), key=lambda child: -child[1])[:8]
+    return {
+        'total_ms': total_us / 1000,
+        'largest': {name: us / 1000 for name, us in largest},
+        'heavy': [name for name in HEAVY_MODULES if name in loaded]
+    }
+
+
+def cold_start() -> Dict:
+    """
+    Import the handler and build its runtime in a fresh interpreter
+
+    :return: Dictionary with 'import_ms', 'runtime_ms', 'warm_ms' and 'heavy_loaded'
+    """
+    completed = subprocess.run(
+        [sys.executable, '-c', _COLD_START % (HEAVY_MODULES,)],
+        cwd=REPO_ROOT, env=_environment(), capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def median_of(runs: List[Dict], field: str) -> float:
+    return statistics.median(run[field] for run in runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=['handler', 'app'], help='Modules to profile the import of')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per measurement (median is kept)')
+    parser.add_argument('--import-budget-ms', type=float, default=100.0, help='Max import time of the handler')
+    parser.add_argument('--cold-start-budget-ms', type=float, default=1500.0,
+                        help='Max import plus runtime build time of the handler')
+    parser.add_argument('--label', default='startup', help='Name for the results file')
+    parser.add_argument('--results-dir', default=os.path.join(os.path.dirname(__file__), 'results'))
+    args = parser.parse_args()
+
+    results = {
+        'label': args.label,
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'imports': {},
+        'budgets': {'import_ms': args.import_budget_ms, 'cold_start_ms': args.cold_start_budget_ms}
+    }
+
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.runs)]
+        profile = dict(runs[-1], total_ms=median_of(runs, 'total_ms'))
+        results['imports'][module] = profile
+        heavy = ', '.join(profile['heavy']) or 'none'
+        print(f"import {module:10s} {profile['total_ms']:8.1f}ms  heavy modules loaded: {heavy}")
+        for name, ms in profile['largest'].items():
+            print(f"        {name:40s} {ms:8.1f}ms")
+
+    runs = [cold_start() for _ in range(args.runs)]
+    cold = {field: median_of(runs, field) for field in ('import_ms', 'runtime_ms', 'warm_ms')}
+    cold['cold_start_ms'] = cold['import_ms'] + cold['runtime_ms']
+    results['cold_start'] = cold
+    print(f"cold start {cold['cold_start_ms']:8.1f}ms  (import {cold['import_ms']:.1f}ms, "
+          f"runtime {cold['runtime_ms']:.1f}ms, warm {cold['warm_ms']:.3f}ms)")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{args.label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+    over_budget = []
+    handler_import = results['imports'].get('handler', {}).get('total_ms', cold['import_ms'])
+    if handler_import > args.import_budget_ms:
+        over_budget.append(f"handler import {handler_import:.1f}ms > {args.import_budget_ms:.0f}ms")
+    if cold['cold_start_ms'] > args.cold_start_budget_ms:
+        over_budget.append(f"cold start {cold['cold_start_ms']:.1f}ms > {args.cold_start_budget_ms:.0f}ms")
+    for problem in over_budget:
+        print(f"OVER BUDGET: {problem}")
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
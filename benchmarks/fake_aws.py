@@ -0,0 +1,400 @@
+"""
+Local stand-ins for the boto3 clients used by the analyzers
+
+The fakes implement the call signatures this code base relies on
+(get_object, list_objects_v2, detect_labels, invoke_model, send_raw_email,
+...) with configurable latency distributions, error and throttle rates and
+payload sizes, so the real pipeline can be benchmarked without AWS.
+"""
+import bisect
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+
+class LatencyModel:
+    def __init__(self, kind: str = 'lognormal', median: float = 0.05, sigma: float = 0.4,
+                 low: Optional[float] = None, high: Optional[float] = None):
+        """
+        Latency distribution for one fake operation, in seconds
+
+        :param kind: 'constant', 'uniform' or 'lognormal'
+        :param median: Median latency (the constant value for 'constant')
+        :param sigma: Spread of the lognormal distribution
+        :param low: Lower bound for 'uniform' (default: half the median)
+        :param high: Upper bound for 'uniform' (default: 1.5x the median)
+        """
+        if kind not in ('constant', 'uniform', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution '{kind}'")
+        self.kind = kind
+        self.median = median
+        self.sigma = sigma
+        self.low = low if low is not None else median * 0.5
+        self.high = high if high is not None else median * 1.5
+
+    @classmethod
+    def parse(cls, spec: str) -> 'LatencyModel':
+        """
+        Build a model from a CLI string such as 'lognormal:0.08:0.5', 'uniform:0.01:0.03' or '0.02'
+        """
+        parts = spec.split(':')
+        if len(parts) == 1:
+            return cls('constant', float(parts[0]))
+        if parts[0] == 'uniform':
+            low, high = float(parts[1]), float(parts[2])
+            return cls('uniform', (low + high) / 2, low=low, high=high)
+        return cls(parts[0], float(parts[1]), *(float(part) for part in parts[2:3]))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'constant':
+            return self.median
+        if self.kind == 'uniform':
+            return rng.uniform(self.low, self.high)
+        return rng.lognormvariate(0, self.sigma) * self.median
+
+    def to_dict(self) -> Dict:
+        return {'kind': self.kind, 'median': self.median, 'sigma': self.sigma, 'low': self.low, 'high': self.high}
+
+
+class FakeClientError(Exception):
+    """
+    Mimics botocore.exceptions.ClientError closely enough for error_code() and retries
+    """
+    def __init__(self, code: str, operation: str):
+        self.response = {'Error': {'Code': code, 'Message': f"Simulated {code}"}}
+        self.operation_name = operation
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation: Simulated {code}")
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def read(self, amount: Optional[int] = None) -> bytes:
+        data = self._data
+        self._data = b''
+        return data
+
+
+class _Meta:
+    def __init__(self, service_name: str):
+        self.service_model = type('ServiceModel', (), {'service_name': service_name})()
+
+
+class FakeClient:
+    service_name = 'fake'
+    throttle_code = 'ThrottlingException'
+
+    def __init__(self, latency: Optional[Dict[str, LatencyModel]] = None, default_latency: Optional[LatencyModel] = None,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Shared behaviour of the fakes: latency, injected failures and call timing records
+
+        :param latency: Latency model per operation name
+        :param default_latency: Latency model for operations not in latency
+        :param error_rate: Probability of a simulated InternalServerError per call
+        :param throttle_rate: Probability of a simulated throttling error per call
+        :param seed: Seed for reproducible runs
+        """
+        self.latency = latency or {}
+        self.default_latency = default_latency or LatencyModel('constant', 0.0)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.meta = _Meta(self.service_name)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.timings = defaultdict(list)
+
+    def _simulate(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+            delay = self.latency.get(operation, self.default_latency).sample(self._rng)
+            roll = self._rng.random()
+        start = time.perf_counter()
+        time.sleep(delay)
+        try:
+            if roll < self.throttle_rate:
+                raise FakeClientError(self.throttle_code, operation)
+            if roll < self.throttle_rate + self.error_rate:
+                raise FakeClientError('InternalServerError', operation)
+        except FakeClientError:
+            with self._lock:
+                self.errors[operation] += 1
+            raise
+        finally:
+            self._record(operation, time.perf_counter() - start)
+
+    def _record(self, operation: str, seconds: float) -> None:
+        with self._lock:
+            self.timings[operation].append(seconds)
+
+
+def fake_jpeg(key: str, size: int) -> bytes:
+    """
+    Deterministic JPEG-looking payload of the given size, unique per key
+    """
+    seed = hashlib.sha256(key.encode('utf-8')).digest()
+    body = (seed * (size // len(seed) + 1))[:max(0, size - 5)]
+    return b'\xff\xd8\xff\xe0' + body + b'\xd9'
+
+
+class FakeS3(FakeClient):
+    service_name = 's3'
+    throttle_code = 'SlowDown'
+
+    def __init__(self, num_objects: int = 1000, object_size: int = 2 * 1024 * 1024,
+                 prefixes: Optional[List[str]] = None, **kwargs):
+        """
+        In-memory bucket pre-populated with num_objects JPEG keys
+
+        :param num_objects: Number of images per bucket
+        :param object_size: Size of each image in bytes
+        :param prefixes: Key prefixes to spread images across (default: one 'images/' folder)
+        """
+        super().__init__(**kwargs)
+        self.object_size = object_size
+        prefixes = prefixes or ['images/']
+        self.keys = sorted(f"{prefixes[i % len(prefixes)]}{i:08d}.jpg" for i in range(num_objects))
+        self._key_set = set(self.keys)
+        self.objects = {}
+        self.multipart = {}
+
+    def _image(self, key: str) -> Optional[bytes]:
+        if key in self.objects:
+            return self.objects[key]
+        if key in self._key_set:
+            return fake_jpeg(key, self.object_size)
+        return None
+
+    def _size(self, key: str) -> int:
+        return len(self.objects[key]) if key in self.objects else self.object_size
+
+    def get_object(self, Bucket: str, Key: str, IfMatch: Optional[str] = None, **kwargs) -> Dict:
+        self._simulate('get_object')
+        data = self._image(Key)
+        if data is None:
+            raise FakeClientError('NoSuchKey', 'GetObject')
+        if IfMatch is not None and IfMatch.strip('"') != self._etag(Key).strip('"'):
+            raise FakeClientError('PreconditionFailed', 'GetObject')
+        return {'Body': _Body(data), 'ContentLength': len(data), 'ETag': self._etag(Key)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        self._simulate('head_object')
+        data = self._image(Key)
+        if data is None:
+            raise FakeClientError('404', 'HeadObject')
+        return {'ContentLength': len(data), 'ETag': self._etag(Key)}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', StartAfter: str = '',
+                        ContinuationToken: Optional[str] = None, MaxKeys: int = 1000, **kwargs) -> Dict:
+        self._simulate('list_objects_v2')
+        # Keys are sorted, so prefixes and StartAfter resolve to index ranges
+        first = bisect.bisect_left(self.keys, Prefix)
+        last = bisect.bisect_left(self.keys, Prefix + '\uffff') if Prefix else len(self.keys)
+        if ContinuationToken:
+            start = int(ContinuationToken)
+        else:
+            start = max(first, bisect.bisect_right(self.keys, StartAfter) if StartAfter else first)
+        page = self.keys[start:min(start + MaxKeys, last)]
+        response = {
+            'Contents': [
+                {'Key': key, 'ETag': self._etag(key), 'Size': self._size(key), 'LastModified': '2024-01-01T00:00:00Z'}
+                for key in page
+            ],
+            'KeyCount': len(page),
+            'IsTruncated': start + MaxKeys < last
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def put_object(self, Bucket: str, Key: str, Body=b'', **kwargs) -> Dict:
+        self._simulate('put_object')
+        data = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        self.objects[Key] = data
+        return {'ETag': self._etag(Key)}
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **kwargs) -> None:
+        self._simulate('put_object')
+        with open(Filename, 'rb') as f:
+            self.objects[Key] = f.read()
+
+    def download_file(self, Bucket: str, Key: str, Filename: str, **kwargs) -> None:
+        self._simulate('get_object')
+        if Key not in self.objects:
+            raise FakeClientError('404', 'HeadObject')
+        with open(Filename, 'wb') as f:
+            f.write(self.objects[Key])
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        self._simulate('create_multipart_upload')
+        upload_id = hashlib.md5(f"{Key}{time.time()}".encode('utf-8')).hexdigest()
+        self.multipart[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body=b'', **kwargs) -> Dict:
+        self._simulate('upload_part')
+        data = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        self.multipart[UploadId][PartNumber] = data
+        return {'ETag': hashlib.md5(data).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict, **kwargs) -> Dict:
+        self._simulate('complete_multipart_upload')
+        parts = self.multipart.pop(UploadId)
+        self.objects[Key] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        return {'ETag': self._etag(Key)}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> Dict:
+        self.multipart.pop(UploadId, None)
+        return {}
+
+    @staticmethod
+    def _etag(key: str) -> str:
+        return '"' + hashlib.md5(key.encode('utf-8')).hexdigest() + '"'
+
+
+# Labels returned by the fake Rekognition; a mix of damage and non-damage names
+_FAKE_LABELS = [
+    ('Car', ['Vehicle', 'Transportation'], 'Vehicles and Automotive'),
+    ('Dent', [], 'Damage Detection'),
+    ('Scratch', [], 'Damage Detection'),
+    ('Broken Glass', ['Glass'], 'Damage Detection'),
+    ('Bumper', ['Car', 'Vehicle'], 'Vehicles and Automotive'),
+    ('Rust', [], 'Materials'),
+    ('Wall', ['Building'], 'Buildings and Architecture'),
+    ('Crack', [], 'Damage Detection'),
+    ('Person', [], 'Person Description'),
+    ('Collision', ['Accident'], 'Damage Detection')
+]
+
+
+class FakeRekognition(FakeClient):
+    service_name = 'rekognition'
+
+    def __init__(self, labels_per_image: int = 6, **kwargs):
+        super().__init__(**kwargs)
+        self.labels_per_image = labels_per_image
+
+    def detect_labels(self, Image: Dict, MaxLabels: int = 10, MinConfidence: float = 70.0, **kwargs) -> Dict:
+        self._simulate('detect_labels')
+        source = Image.get('Bytes') or json.dumps(Image.get('S3Object', {}), sort_keys=True).encode('utf-8')
+        rng = random.Random(hashlib.sha256(bytes(source[:4096])).digest())
+        chosen = rng.sample(_FAKE_LABELS, min(self.labels_per_image, MaxLabels, len(_FAKE_LABELS)))
+        labels = []
+        for name, parents, category in chosen:
+            confidence = rng.uniform(MinConfidence, 99.9)
+            labels.append({
+                'Name': name,
+                'Confidence': confidence,
+                'Instances': [],
+                'Parents': [{'Name': parent} for parent in parents],
+                'Aliases': [],
+                'Categories': [{'Name': category}]
+            })
+        return {'Labels': labels, 'LabelModelVersion': '3.0'}
+
+
+class FakeBedrock(FakeClient):
+    service_name = 'bedrock-runtime'
+
+    def __init__(self, output_tokens: int = 250, tokens_per_second: float = 60.0,
+                 time_to_first_token: Optional[LatencyModel] = None, **kwargs):
+        """
+        Fake Anthropic Messages endpoint
+
+        :param output_tokens: Tokens generated per response
+        :param tokens_per_second: Generation speed, used for both streaming and non-streaming calls
+        :param time_to_first_token: Latency before the first token (default: the invoke latency model)
+        """
+        super().__init__(**kwargs)
+        self.output_tokens = output_tokens
+        self.tokens_per_second = tokens_per_second
+        self.time_to_first_token = time_to_first_token
+        self.request_bytes = []
+
+    def invoke_model(self, modelId: str, body, **kwargs) -> Dict:
+        self._simulate('invoke_model')
+        input_tokens = self._note_request(body)
+        time.sleep(self.output_tokens / self.tokens_per_second)
+        return {'body': _Body(json.dumps({
+            'content': [{'type': 'text', 'text': self._report_text(body)}],
+            'usage': {'input_tokens': input_tokens, 'output_tokens': self.output_tokens},
+            'stop_reason': 'end_turn'
+        }).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, modelId: str, body, **kwargs) -> Dict:
+        self._simulate('invoke_model_with_response_stream')
+        input_tokens = self._note_request(body)
+        return {'body': self._events(self._report_text(body), input_tokens)}
+
+    def _events(self, text: str, input_tokens: int):
+        def event(payload):
+            return {'chunk': {'bytes': json.dumps(payload).encode('utf-8')}}
+
+        yield event({'type': 'message_start', 'message': {'usage': {'input_tokens': input_tokens, 'output_tokens': 1}}})
+        words = text.split(' ')
+        delay = self.output_tokens / self.tokens_per_second / max(1, len(words))
+        for index, word in enumerate(words):
+            time.sleep(delay)
+            yield event({'type': 'content_block_delta', 'index': 0,
+                         'delta': {'type': 'text_delta', 'text': word if index == 0 else ' ' + word}})
+        yield event({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+                     'usage': {'output_tokens': self.output_tokens}})
+        yield event({'type': 'message_stop'})
+
+    def _note_request(self, body) -> int:
+        with self._lock:
+            self.request_bytes.append(len(body))
+        return 1600 * self._image_count(body) + 400
+
+    @staticmethod
+    def _image_count(body) -> int:
+        if isinstance(body, (bytes, bytearray)):
+            return body.count(b'"type": "image"')
+        return body.count('"type": "image"')
+
+    def _report_text(self, body) -> str:
+        images = max(1, self._image_count(body))
+        sentence = "Moderate dent on the rear door with paint scratches; repair complexity medium, cost $400-$900."
+        if images == 1:
+            return ' '.join([sentence] * 3)
+        sections = [f"=== IMAGE {number} ===\n{sentence}" for number in range(1, images + 1)]
+        return '\n'.join(sections + ["=== SUMMARY ===\nConsistent minor collision damage across the claim."])
+
+
+class FakeSES(FakeClient):
+    service_name = 'ses'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = 0
+        self.sent_bytes = 0
+
+    def send_raw_email(self, Source: str, Destinations: List[str], RawMessage: Dict, **kwargs) -> Dict:
+        self._simulate('send_raw_email')
+        with self._lock:
+            self.sent += 1
+            self.sent_bytes += len(RawMessage['Data'])
+        return {'MessageId': hashlib.md5(f"{self.sent}".encode('utf-8')).hexdigest()}
+
+
+class FakeAWSConfig:
+    def __init__(self, s3: FakeS3, rekognition: FakeRekognition, bedrock: FakeBedrock, ses: Optional[FakeSES] = None,
+                 instrumentation=None):
+        """
+        Drop-in for config.aws_config.AWSConfig that hands out the fakes
+        """
+        self.instrumentation = instrumentation
+        self._clients = {'s3': s3, 'rekognition': rekognition, 'bedrock': bedrock, 'ses': ses or FakeSES()}
+
+    def client(self, name: str):
+        return self._clients[{'bedrock-runtime': 'bedrock'}.get(name, name)]
+
+    def get_client(self) -> Dict:
+        return {name: self._clients[name] for name in ('s3', 'rekognition', 'bedrock')}
@@ -0,0 +1,376 @@
+"""
+End-to-end throughput benchmark against local AWS stand-ins
+
+Usage:
+    python -m benchmarks.run_benchmark [--scenario multi|single|notify|all] [--images 500]
+                                       [--label v2] [--compare benchmarks/results/v1_....json]
+
+Runs the real analyzers and notification path on top of benchmarks.fake_aws,
+reports images/sec, p50/p95/p99 per stage and peak RSS, and writes the
+results to a JSON file that later runs can be compared against.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+from benchmarks.fake_aws import FakeAWSConfig, FakeBedrock, FakeRekognition, FakeS3, FakeSES, LatencyModel
+from services.s3_service import S3Service
+from services.rekognition_service import RekognitionService
+from services.bedrock_service import BedrockService
+from services.rate_limiter import wrap_clients
+from services.instrumentation import Instrumentation, instrument_client
+from services.memory_budget import MemoryBudget
+from services.result_sink import ResultSink
+from services.triage import TriagePolicy
+from analyzers.damage_analyzer import DamageAnalyzer
+from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Requests counted as S3 writes in the multi scenario
+S3_WRITE_OPERATIONS = ('put_object', 'create_multipart_upload', 'upload_part', 'complete_multipart_upload')
+
+# Metrics where a higher value is a regression
+LOWER_IS_BETTER = ('p50', 'p95', 'p99', 'peak_rss_mb', 'seconds')
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': at(0.50),
+        'p95': at(0.95),
+        'p99': at(0.99),
+        'max': ordered[-1]
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageTimer:
+    def __init__(self):
+        """
+        Records wall time of every analyzer stage call
+        """
+        self.samples = defaultdict(list)
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - start)
+        return timed
+
+    def instrument(self, analyzer) -> None:
+        # The pipeline looks stage methods up on the instance, so shadowing them is enough
+        for name in dir(analyzer):
+            if name.startswith('_') and name.endswith('_stage') and callable(getattr(analyzer, name)):
+                stage = name[1:-len('_stage')]
+                setattr(analyzer, name, self.wrap(stage, getattr(analyzer, name)))
+
+    def report(self) -> Dict[str, Dict]:
+        return {stage: percentiles(samples) for stage, samples in sorted(self.samples.items())}
+
+
+def build_fakes(args) -> FakeAWSConfig:
+    common = {'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate, 'seed': args.seed}
+    s3 = FakeS3(
+        num_objects=args.images,
+        object_size=args.image_size,
+        prefixes=[f"claims/{index:04d}/" for index in range(args.claims)],
+        latency={
+            'get_object': LatencyModel.parse(args.s3_get_latency),
+            'put_object': LatencyModel.parse(args.s3_put_latency),
+            'list_objects_v2': LatencyModel.parse(args.s3_list_latency)
+        },
+        default_latency=LatencyModel.parse(args.s3_put_latency),
+        **common
+    )
+    rekognition = FakeRekognition(default_latency=LatencyModel.parse(args.rekognition_latency), **common)
+    bedrock = FakeBedrock(
+        output_tokens=args.output_tokens,
+        tokens_per_second=args.tokens_per_second,
+        default_latency=LatencyModel.parse(args.bedrock_latency),
+        **common
+    )
+    ses = FakeSES(default_latency=LatencyModel.parse(args.ses_latency), **common)
+    return FakeAWSConfig(s3, rekognition, bedrock, ses, instrumentation=Instrumentation() if args.instrument else None)
+
+
+def build_services(fakes: FakeAWSConfig, args) -> Dict:
+    instrumentation = fakes.instrumentation
+    clients = {
+        name: instrument_client(fakes.client(name), fakes.client(name).service_name, instrumentation)
+        for name in ('s3', 'rekognition', 'bedrock')
+    }
+    if args.rate_limited:
+        clients = wrap_clients(clients, instrumentation=instrumentation)
+    return {
+        's3_service': S3Service(clients['s3']),
+        'rekognition_service': RekognitionService(clients['rekognition']),
+        'bedrock_service': BedrockService(clients['bedrock'], instrumentation=instrumentation)
+    }
+
+
+def run_multi(fakes: FakeAWSConfig, args) -> Dict:
+    timer = StageTimer()
+    memory_budget = None
+    if args.memory_budget_mb:
+        memory_budget = MemoryBudget(int(args.memory_budget_mb * 1024 * 1024), instrumentation=fakes.instrumentation)
+    result_sink = None
+    if args.result_sink:
+        result_sink = ResultSink(fakes.client('s3'), 'bench-output', instrumentation=fakes.instrumentation)
+    analyzer = MultiImageDamageAnalyzer(stage_concurrency=args.concurrency, instrumentation=fakes.instrumentation,
+                                        memory_budget=memory_budget, result_sink=result_sink,
+                                        text_reports=not args.result_sink,
+                                        triage=TriagePolicy() if args.triage else None, **build_services(fakes, args))
+    timer.instrument(analyzer)
+
+    s3 = fakes.client('s3')
+    writes_before = sum(s3.calls[operation] for operation in S3_WRITE_OPERATIONS)
+    start = time.perf_counter()
+    results = analyzer.process_images('bench-source', 'bench-output')
+    if result_sink is not None:
+        result_sink.close()
+    elapsed = time.perf_counter() - start
+    outcome = {
+        'images': len(results),
+        'failed': args.images - len(results),
+        'seconds': elapsed,
+        'images_per_second': len(results) / elapsed if elapsed else 0.0,
+        'stages': timer.report(),
+        's3_write_requests': sum(s3.calls[operation] for operation in S3_WRITE_OPERATIONS) - writes_before
+    }
+    if memory_budget is not None:
+        outcome['memory_budget'] = memory_budget.stats()
+    if args.triage:
+        routes = defaultdict(int)
+        for result in results:
+            routes[result['triage']['route']] += 1
+        outcome['triage_routes'] = dict(routes)
+    return outcome
+
+
+def run_single(fakes: FakeAWSConfig, args) -> Dict:
+    analyzer = DamageAnalyzer(**build_services(fakes, args))
+    keys = fakes.client('s3').keys[:args.single_images]
+    latencies = []
+    failed = 0
+
+    start = time.perf_counter()
+    for key in keys:
+        call_start = time.perf_counter()
+        try:
+            analyzer.analyze_damage('bench-source', key, 'bench-output')
+            latencies.append(time.perf_counter() - call_start)
+        except Exception:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    return {
+        'images': len(latencies),
+        'failed': failed,
+        'seconds': elapsed,
+        'images_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'stages': {'analyze_damage': percentiles(latencies)}
+    }
+
+
+def run_notify(fakes: FakeAWSConfig, args) -> Dict:
+    from services.emailnotificationservice import EmailNotificationService
+    from services.notificationorchestrator import NotificationOrchestrator
+
+    ses = fakes.client('ses')
+    orchestrator = NotificationOrchestrator(
+        fakes, 'bench-source', 'bench-output',
+        email_notification_service=EmailNotificationService(ses_client=ses, s3_client=fakes.client('s3')),
+        send_rate=args.ses_rate
+    )
+    results = [
+        {
+            'source_key': key,
+            'damage_labels': [{'Name': 'Dent', 'Confidence': 91.0}],
+            'report': 'Moderate dent on the rear door; repair complexity medium.'
+        }
+        for key in fakes.client('s3').keys[:args.notify_reports]
+    ]
+
+    timer = StageTimer()
+    orchestrator.pdf_generator.render_pdfs = timer.wrap('render', orchestrator.pdf_generator.render_pdfs)
+    orchestrator.email_service.send_report_email = timer.wrap('send', orchestrator.email_service.send_report_email)
+
+    start = time.perf_counter()
+    counts = orchestrator.notify({'adjuster@example.com': results}, upload_pdfs=False)
+    elapsed = time.perf_counter() - start
+    orchestrator.pdf_generator.close()
+    return {
+        'images': counts['sent'],
+        'failed': counts['failed'],
+        'seconds': elapsed,
+        'images_per_second': counts['sent'] / elapsed if elapsed else 0.0,
+        'stages': timer.report()
+    }
+
+
+SCENARIOS = {'multi': run_multi, 'single': run_single, 'notify': run_notify}
+
+
+def client_stats(fakes: FakeAWSConfig) -> Dict:
+    stats = {}
+    for name in ('s3', 'rekognition', 'bedrock', 'ses'):
+        client = fakes.client(name)
+        stats[name] = {
+            'calls': dict(client.calls),
+            'errors': dict(client.errors),
+            'latency': {operation: percentiles(samples) for operation, samples in client.timings.items()}
+        }
+    return stats
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def flatten(results: Dict) -> Dict[str, float]:
+    flat = {}
+    for scenario, outcome in results['scenarios'].items():
+        flat[f"{scenario}.images_per_second"] = outcome['images_per_second']
+        flat[f"{scenario}.seconds"] = outcome['seconds']
+        for stage, stats in outcome['stages'].items():
+            for name in ('p50', 'p95', 'p99'):
+                if name in stats:
+                    flat[f"{scenario}.{stage}.{name}"] = stats[name]
+    flat['peak_rss_mb'] = results['peak_rss_mb']
+    return flat
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> bool:
+    """
+    Print metric changes against a baseline run
+
+    :return: True if any metric regressed by more than threshold (a fraction)
+    """
+    current_flat, baseline_flat = flatten(current), flatten(baseline)
+    regressed = False
+    print(f"\nComparison with {baseline.get('label')} ({baseline.get('revision')}):")
+    for metric in sorted(set(current_flat) & set(baseline_flat)):
+        before, after = baseline_flat[metric], current_flat[metric]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = change > threshold if metric.endswith(LOWER_IS_BETTER) else change < -threshold
+        regressed = regressed or worse
+        print(f"  {metric:45s} {before:10.4f} -> {after:10.4f} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def parse_concurrency(values: List[str]) -> Dict[str, int]:
+    concurrency = {}
+    for value in values or []:
+        stage, workers = value.split('=')
+        concurrency[stage] = int(workers)
+    return concurrency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', choices=list(SCENARIOS) + ['all'], default='all')
+    parser.add_argument('--images', type=int, default=500, help='Images in the fake bucket (multi scenario)')
+    parser.add_argument('--single-images', type=int, default=20, help='Images analysed one by one (single scenario)')
+    parser.add_argument('--notify-reports', type=int, default=100, help='Reports emailed (notify scenario)')
+    parser.add_argument('--claims', type=int, default=50, help='Folders the images are spread over')
+    parser.add_argument('--image-size', type=int, default=512 * 1024, help='Bytes per image')
+    parser.add_argument('--s3-get-latency', default='lognormal:0.03:0.4')
+    parser.add_argument('--s3-put-latency', default='lognormal:0.02:0.4')
+    parser.add_argument('--s3-list-latency', default='lognormal:0.05:0.3')
+    parser.add_argument('--rekognition-latency', default='lognormal:0.3:0.3')
+    parser.add_argument('--bedrock-latency', default='lognormal:0.8:0.3', help='Time to first token')
+    parser.add_argument('--ses-latency', default='lognormal:0.05:0.3')
+    parser.add_argument('--output-tokens', type=int, default=250)
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--ses-rate', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limited', action='store_true', help='Wrap fakes with the shared rate limiter')
+    parser.add_argument('--instrument', action='store_true', help='Record metrics and store the snapshot with the results')
+    parser.add_argument('--memory-budget-mb', type=float, help='Cap the bytes of in-flight images (multi scenario)')
+    parser.add_argument('--triage', action='store_true', help='Route images through the triage cascade')
+    parser.add_argument('--result-sink', action='store_true',
+                        help='Write results to rolling JSON Lines files instead of one text object each')
+    parser.add_argument('--concurrency', nargs='*', metavar='STAGE=N', help='Per-stage worker overrides')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='local', help='Name stored with the results')
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--compare', help='Baseline results file to compare against')
+    parser.add_argument('--regression-threshold', type=float, default=0.10)
+    args = parser.parse_args()
+    args.concurrency = parse_concurrency(args.concurrency)
+
+    scenarios = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    results = {
+        'label': args.label,
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('compare', 'results_dir')},
+        'scenarios': {},
+        'clients': {}
+    }
+    for scenario in scenarios:
+        fakes = build_fakes(args)
+        outcome = SCENARIOS[scenario](fakes, args)
+        results['scenarios'][scenario] = outcome
+        results['clients'][scenario] = client_stats(fakes)
+        if fakes.instrumentation is not None:
+            results.setdefault('metrics', {})[scenario] = fakes.instrumentation.snapshot()
+        print(f"{scenario:7s} {outcome['images']:6d} ok {outcome['failed']:5d} failed "
+              f"{outcome['seconds']:8.2f}s {outcome['images_per_second']:8.2f} images/s")
+        for stage, stats in outcome['stages'].items():
+            if stats['count']:
+                print(f"        {stage:14s} p50 {stats['p50'] * 1000:8.1f}ms  p95 {stats['p95'] * 1000:8.1f}ms"
+                      f"  p99 {stats['p99'] * 1000:8.1f}ms")
+    results['peak_rss_mb'] = peak_rss_mb()
+    print(f"Peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{args.label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.regression_threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,127 @@
-import boto3
-from typing import Dict
-import os
-
-class AWSConfig:
-    def __init__(self, aws_access_key_id, aws_secret_access_key, region_name='us-east-1'):
-        """
-        Initialize AWS configuration with credentials and multiple services
-        
-        Args:
-            aws_access_key_id (str): AWS access key
-            aws_secret_access_key (str): AWS secret access key
-            region_name (str): AWS region name (default: 'us-east-1')
-        """
-        self.aws_access_key_id = aws_access_key_id
-        self.aws_secret_access_key = aws_secret_access_key
-        self.region_name = region_name
-        
-        # Initialize all clients to None
-        self.s3_client = None
-        self.rekognition_client = None
-        self.bedrock_runtime_client = None
-    
-    def get_client(self) -> Dict:
-        return {
-            's3': boto3.client(
-                's3',
-                aws_access_key_id=self.aws_access_key_id,
-                aws_secret_access_key=self.aws_secret_access_key,
-                region_name=self.region_name
-            ),
-            'rekognition': boto3.client(
-                'rekognition',
-                aws_access_key_id=self.aws_access_key_id,
-                aws_secret_access_key=self.aws_secret_access_key,
-                region_name=self.region_name
-            ),
-            'bedrock':  boto3.client(
-                'bedrock-runtime',
-                aws_access_key_id=self.aws_access_key_id,
-                aws_secret_access_key=self.aws_secret_access_key,
-                region_name=self.region_name
-            )
-        }
\ No newline at end of file
+import boto3
+import threading
+from botocore.config import Config
+from typing import Dict, Optional
+import os
+
+from services.rate_limiter import RetryPolicy, rate_limit_client
+from services.instrumentation import Instrumentation, instrument_client
+
+# Short names used throughout the app -> boto3 service names
+SERVICE_NAMES = {
+    's3': 's3',
+    'rekognition': 'rekognition',
+    'bedrock': 'bedrock-runtime',
+    'ses': 'ses',
+    'sqs': 'sqs'
+}
+
+class AWSConfig:
+    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, region_name='us-east-1',
+                 max_pool_connections: int = 50,
+                 connect_timeout: float = 5,
+                 read_timeout: float = 60,
+                 tcp_keepalive: bool = True,
+                 retry_mode: str = 'standard',
+                 max_attempts: int = 3,
+                 rate_limited: bool = False,
+                 rate_limits: Optional[Dict[str, Dict]] = None,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Initialize AWS configuration with credentials and a shared client registry
+
+        All clients come from one boto3 session and are created lazily on
+        first use, then reused by every service, analyzer and thread.
+
+        Args:
+            aws_access_key_id (str): AWS access key (default: standard credential chain)
+            aws_secret_access_key (str): AWS secret access key (default: standard credential chain)
+            region_name (str): AWS region name (default: 'us-east-1')
+            max_pool_connections (int): HTTP connections kept per client; size it to the pipeline concurrency
+            connect_timeout (float): Seconds to wait for a connection
+            read_timeout (float): Seconds to wait for response data
+            tcp_keepalive (bool): Keep idle pooled connections alive
+            retry_mode (str): botocore retry mode ('standard', 'adaptive' or 'legacy')
+            max_attempts (int): botocore attempts per call
+            rate_limited (bool): Wrap clients with the shared adaptive rate limiter and retry policy
+            rate_limits (dict): Per-service overrides of rate_limiter.DEFAULT_LIMITS
+            instrumentation (Instrumentation): Record calls, errors, throttles, retries and payload sizes
+        """
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+        self.region_name = region_name
+        self.rate_limited = rate_limited
+        self.rate_limits = rate_limits or {}
+        self.instrumentation = instrumentation
+
+        self.session = boto3.session.Session(
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=region_name
+        )
+        self.client_config = Config(
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            tcp_keepalive=tcp_keepalive,
+            # The rate limiter does its own backoff; don't stack botocore retries under it
+            retries={'mode': retry_mode, 'max_attempts': 1 if rate_limited else max_attempts}
+        )
+        self.retry_policy = RetryPolicy()
+
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, name: str):
+        """
+        Return the shared client for a service, creating it on first use
+
+        :param name: Short name ('s3', 'rekognition', 'bedrock', 'ses', 'sqs') or a boto3 service name
+        :return: boto3 client (rate limited if configured)
+        """
+        service_name = SERVICE_NAMES.get(name, name)
+        client = self._clients.get(service_name)
+        if client is not None:
+            return client
+
+        # boto3 sessions are not safe for concurrent client creation
+        with self._lock:
+            client = self._clients.get(service_name)
+            if client is None:
+                client = self.session.client(service_name, config=self.client_config)
+                # Instrument under the limiter so every attempt is counted
+                client = instrument_client(client, service_name, self.instrumentation)
+                if self.rate_limited:
+                    client = rate_limit_client(
+                        client, service_name, self.retry_policy, self.rate_limits.get(service_name),
+                        self.instrumentation
+                    )
+                self._clients[service_name] = client
+            return client
+
+    @property
+    def s3_client(self):
+        return self.client('s3')
+
+    @property
+    def rekognition_client(self):
+        return self.client('rekognition')
+
+    @property
+    def bedrock_runtime_client(self):
+        return self.client('bedrock')
+
+    @property
+    def ses_client(self):
+        return self.client('ses')
+
+    @property
+    def sqs_client(self):
+        return self.client('sqs')
+
+    def get_client(self) -> Dict:
+        return {
+            's3': self.client('s3'),
+            'rekognition': self.client('rekognition'),
+            'bedrock': self.client('bedrock')
+        }
@@ -0,0 +1,229 @@
+"""
+Serverless (AWS Lambda) entry point
+
+Only the standard library is imported at module load. boto3, the services
+and the analyzer are imported and built on the first invocation and kept
+in module globals, so warm invocations reuse the same clients, connection
+pools, report cache and taxonomy. The PDF and email components (and
+reportlab with them) are only built when an invocation asks for a
+notification.
+
+Accepted events:
+    {"bucket": ..., "key": ..., "etag": ..., "notify": "someone@example.com"}   direct invocation
+    {"items": [{"bucket": ..., "key": ...}, ...], "notify": ...}                direct batch
+    S3 event notifications and EventBridge 'Object Created' events
+    SQS batches of either (partial batch failures are reported per message)
+
+Configuration comes from environment variables, see the constants below.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+from typing import Dict, List
+
+# Lambda installs its own handler on the root logger, so only the level is set here
+logging.getLogger().setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+logger = logging.getLogger(__name__)
+
+OUTPUT_BUCKET = os.environ.get('OUTPUT_BUCKET')
+RESULTS_PREFIX = os.environ.get('RESULTS_PREFIX', 'results/')
+TEXT_REPORTS = os.environ.get('TEXT_REPORTS', 'false').lower() == 'true'
+TRIAGE = os.environ.get('TRIAGE', 'true').lower() == 'true'
+TAXONOMY_PATH = os.environ.get('TAXONOMY_PATH')
+MEMORY_BUDGET_MB = int(os.environ.get('MEMORY_BUDGET_MB', '512'))
+NOTIFY_RECIPIENT = os.environ.get('NOTIFY_RECIPIENT')
+NOTIFY_SENDER = os.environ.get('NOTIFY_SENDER', 'your-verified-email@example.com')
+
+# Client-side rate limiting is off unless RATE_LIMITED=true, since the limits in
+# services/rate_limiter.DEFAULT_LIMITS are placeholders; RATE_LIMITS holds per-service
+# overrides as JSON, e.g. {"bedrock-runtime": {"tokens_per_minute": 2000000}}
+RATE_LIMITED = os.environ.get('RATE_LIMITED', 'false').lower() == 'true'
+RATE_LIMITS = json.loads(os.environ.get('RATE_LIMITS', '{}'))
+
+# /tmp is the only writable path and survives warm invocations
+REPORT_CACHE_PATH = os.environ.get('REPORT_CACHE_PATH', '/tmp/report_cache.sqlite')
+
+# Lambda has no /dev/shm, so PDFs are rendered on threads instead of a process pool
+PDF_WORKERS = 2
+
+_RUNTIME = None
+_RUNTIME_LOCK = threading.Lock()
+
+
+class _Runtime:
+    """
+    Clients, services and analyzer shared by every invocation of this container
+    """
+
+    def __init__(self):
+        from config.aws_config import AWSConfig
+        from services.s3_service import S3Service
+        from services.rekognition_service import RekognitionService
+        from services.bedrock_service import BedrockService
+        from services.report_cache import ReportCache
+        from services.damage_taxonomy import DamageTaxonomy
+        from services.memory_budget import MemoryBudget
+        from services.result_sink import ResultSink
+        from services.triage import TriagePolicy
+        from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
+
+        self.aws_config = AWSConfig(region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+                                    max_pool_connections=32, rate_limited=RATE_LIMITED,
+                                    rate_limits=RATE_LIMITS)
+        s3_client = self.aws_config.client('s3')
+        report_cache = ReportCache(db_path=REPORT_CACHE_PATH)
+        taxonomy = DamageTaxonomy.from_file(TAXONOMY_PATH) if TAXONOMY_PATH else None
+
+        # Rotated at the end of every invocation instead of on a timer, since the
+        # container is frozen between invocations
+        self.result_sink = None
+        if OUTPUT_BUCKET:
+            self.result_sink = ResultSink(s3_client, OUTPUT_BUCKET, prefix=RESULTS_PREFIX, max_file_seconds=None)
+
+        self.analyzer = MultiImageDamageAnalyzer(
+            s3_service=S3Service(s3_client),
+            rekognition_service=RekognitionService(self.aws_config.client('rekognition'), cache=report_cache,
+                                                   taxonomy=taxonomy),
+            bedrock_service=BedrockService(self.aws_config.client('bedrock'), cache=report_cache),
+            memory_budget=MemoryBudget(MEMORY_BUDGET_MB * 1024 * 1024),
+            result_sink=self.result_sink,
+            text_reports=TEXT_REPORTS,
+            triage=TriagePolicy() if TRIAGE else None
+        )
+        self._notifier = None
+
+    @property
+    def notifier(self):
+        # Built, with the PDF and email components behind it, only when a notification is requested
+        if self._notifier is None:
+            from concurrent.futures import ThreadPoolExecutor
+            from services.emailnotificationservice import EmailNotificationService
+            from services.notificationorchestrator import NotificationOrchestrator
+            from services.pdfreportgenerator import PDFReportGenerator
+            self._notifier = NotificationOrchestrator(
+                self.aws_config,
+                source_bucket=None,
+                processed_bucket=OUTPUT_BUCKET,
+                email_notification_service=EmailNotificationService(
+                    ses_client=self.aws_config.client('ses'),
+                    s3_client=self.aws_config.client('s3'),
+                    sender=NOTIFY_SENDER
+                ),
+                pdf_generator=PDFReportGenerator(
+                    s3_client=self.aws_config.client('s3'),
+                    executor=ThreadPoolExecutor(max_workers=PDF_WORKERS)
+                )
+            )
+        return self._notifier
+
+
+def get_runtime() -> _Runtime:
+    """
+    The container's runtime, built on first use
+
+    Call at module level (e.g. from a wrapper) to move the build into the
+    init phase with provisioned concurrency or SnapStart.
+    """
+    global _RUNTIME
+    if _RUNTIME is None:
+        with _RUNTIME_LOCK:
+            if _RUNTIME is None:
+                _RUNTIME = _Runtime()
+    return _RUNTIME
+
+
+def _is_sqs(event: Dict) -> bool:
+    records = event.get('Records')
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
+
+
+def _parse_events(body: str):
+    from services.event_queue import parse_s3_events
+    try:
+        return parse_s3_events(body)
+    except (ValueError, KeyError, TypeError) as e:
+        # Unparseable bodies never succeed; drop them rather than retry forever
+        logger.error(f"Discarding malformed event: {e}: {body[:200]}")
+        return []
+
+
+def _image_contexts(event: Dict) -> List[Dict]:
+    """
+    Turn an invocation event into analyzer contexts, tagged with their SQS message id
+    """
+    from analyzers.multiimagedamage_analyzer import IMAGE_EXTENSIONS
+    from services.event_queue import ObjectEvent
+
+    if 'bucket' in event and 'key' in event:
+        events = [(ObjectEvent(event['bucket'], event['key'], event.get('etag'), event.get('size')), None)]
+    elif 'items' in event:
+        events = [(ObjectEvent(item['bucket'], item['key'], item.get('etag'), item.get('size')), None)
+                  for item in event['items']]
+    elif _is_sqs(event):
+        events = [(object_event, record['messageId'])
+                  for record in event['Records'] for object_event in _parse_events(record['body'])]
+    else:
+        # S3 notification or EventBridge event delivered directly
+        events = [(object_event, None) for object_event in _parse_events(json.dumps(event))]
+
+    contexts = []
+    for object_event, message_id in events:
+        if not object_event.bucket or not object_event.key or not object_event.key.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        contexts.append({'bucket': object_event.bucket, 'key': object_event.key,
+                         'object': object_event.to_object(), 'message_id': message_id})
+    return contexts
+
+
+def handler(event: Dict, context=None) -> Dict:
+    """
+    Lambda handler
+
+    :param event: Invocation event (see the module docstring)
+    :param context: Lambda context (unused)
+    :return: Results for direct invocations; for SQS, batchItemFailures listing failed messages
+    """
+    runtime = get_runtime()
+    contexts = _image_contexts(event)
+    # Whether each image's result was persisted, reported by the analyzer (with a
+    # result sink, only once the rotate below has written the file)
+    persisted = {}
+    for index, context in enumerate(contexts):
+        context['on_persisted'] = functools.partial(persisted.__setitem__, index)
+
+    results, failed, failed_messages, failed_items = [], [], set(), set()
+    for item in runtime.analyzer.iter_process_contexts(contexts, OUTPUT_BUCKET):
+        if item.ok:
+            results.append(item.value)
+        else:
+            failed_items.add(item.seq)
+            failed.append({'key': item.value['key'], 'stage': item.failed_stage, 'error': str(item.error)})
+
+    if runtime.result_sink is not None:
+        runtime.result_sink.rotate()
+
+    for index, context in enumerate(contexts):
+        if index not in failed_items and not persisted.get(index, False):
+            failed_items.add(index)
+            failed.append({'key': context['key'], 'stage': 'persist', 'error': 'Result was not persisted'})
+    for index in failed_items:
+        if contexts[index]['message_id']:
+            failed_messages.add(contexts[index]['message_id'])
+
+    recipient = event.get('notify') or NOTIFY_RECIPIENT
+    if recipient and results:
+        # The results are already persisted; a failed notification must not send them round again
+        try:
+            runtime.notifier.notify({recipient: results}, upload_pdfs=bool(OUTPUT_BUCKET))
+        except Exception as e:
+            logger.error(f"Error sending notifications to {recipient}: {e}")
+
+    logger.info(f"Processed {len(results)} images, {len(failed)} failed")
+    response = {'processed': len(results), 'failed': failed}
+    if _is_sqs(event):
+        response['batchItemFailures'] = [{'itemIdentifier': message_id} for message_id in sorted(failed_messages)]
+    else:
+        response['results'] = results
+    return response
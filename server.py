@@ -0,0 +1,212 @@
+import argparse
+import json
+import logging
+import re
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config.aws_config import AWSConfig
+from services.s3_service import S3Service
+from services.rekognition_service import RekognitionService
+from services.bedrock_service import BedrockService
+from services.report_cache import ReportCache
+from services.instrumentation import Instrumentation
+from services.memory_budget import MemoryBudget
+from services.damage_taxonomy import DamageTaxonomy
+from services.triage import TriagePolicy
+from services.rate_limiter import error_code
+from analyzers.damage_analyzer import DamageAnalyzer
+from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
+from analyzers.analysis_service import AnalysisService
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+HOST = '127.0.0.1'
+PORT = 8080
+
+# Reports are returned in the response; set to also save them as text objects
+OUTPUT_BUCKET = None
+
+# Cap on the memory held by in-flight batch images; downloads wait once it is reached
+MEMORY_BUDGET_MB = 1024
+
+# YAML damage taxonomy (terms, categories, severity weights); None uses the built-in one
+TAXONOMY_PATH = None
+
+# Client-side rate limiting and retries; off by default since the limits in
+# services/rate_limiter.DEFAULT_LIMITS are placeholders. Before enabling, set
+# RATE_LIMITS to the account's quotas, e.g. {'bedrock-runtime': {'tokens_per_minute': 2000000.0}}
+RATE_LIMITED = False
+RATE_LIMITS = {}
+
+# Synchronous /analyze requests give up waiting after this long (the analysis carries on)
+REQUEST_TIMEOUT = 120
+
+MAX_BODY_BYTES = 1024 * 1024
+
+_JOB_PATH = re.compile(r'^/jobs/([0-9a-f]{32})$')
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON endpoints over an AnalysisService
+
+    POST /analyze  {"bucket", "key", "etag"?, "output_bucket"?}   -> result
+    POST /jobs     same body                                        -> 202 {"job_id"}
+    POST /batch    {"items": [{"bucket", "key", "etag"?}], "output_bucket"?} -> 202 {"job_id"}
+    GET  /jobs/<job_id>                                             -> job status and results
+    GET  /health, GET /metrics
+    """
+    service: AnalysisService = None
+    instrumentation: Instrumentation = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'status': 'ok', 'service': self.service.stats()})
+        elif self.path == '/metrics':
+            body = self.instrumentation.to_prometheus().encode('utf-8')
+            self._send_bytes(200, body, 'text/plain; version=0.0.4')
+        else:
+            match = _JOB_PATH.match(self.path)
+            job = self.service.job(match.group(1)) if match else None
+            if job is None:
+                self._send(404, {'error': 'Not found'})
+            else:
+                self._send(200, job)
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+            if self.path == '/analyze':
+                bucket, key = self._object(body)
+                result = self.service.analyze(bucket, key, etag=body.get('etag'),
+                                              output_bucket=body.get('output_bucket'), timeout=REQUEST_TIMEOUT)
+                self._send(200, result)
+            elif self.path == '/jobs':
+                bucket, key = self._object(body)
+                job_id = self.service.submit(bucket, key, etag=body.get('etag'),
+                                             output_bucket=body.get('output_bucket'))
+                self._send(202, {'job_id': job_id})
+            elif self.path == '/batch':
+                items = body.get('items')
+                if not isinstance(items, list):
+                    raise ValueError("'items' must be a list")
+                for item in items:
+                    self._object(item)
+                job_id = self.service.submit_batch(items, output_bucket=body.get('output_bucket'))
+                self._send(202, {'job_id': job_id})
+            else:
+                self._send(404, {'error': 'Not found'})
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+        except FutureTimeoutError:
+            self._send(504, {'error': 'Analysis is still running; submit it as a job to poll for the result'})
+        except Exception as e:
+            if error_code(e) == 'PreconditionFailed':
+                self._send(412, {'error': 'The object no longer has the given ETag'})
+                return
+            logger.error(f"Error handling {self.path}: {e}")
+            self._send(500, {'error': str(e)})
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    @staticmethod
+    def _object(body) -> tuple:
+        if not isinstance(body, dict) or not body.get('bucket') or not body.get('key'):
+            raise ValueError("'bucket' and 'key' are required")
+        return body['bucket'], body['key']
+
+    def _send(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self._send_bytes(status, body, 'application/json')
+
+    def _send_bytes(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve damage analysis over HTTP")
+    parser.add_argument('--host', default=HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=16, help='Single-image analyses running at the same time')
+    args = parser.parse_args()
+
+    try:
+        instrumentation = Instrumentation()
+        aws_config = AWSConfig(
+            region_name='us-east-1',
+            max_pool_connections=64,
+            rate_limited=RATE_LIMITED,
+            rate_limits=RATE_LIMITS,
+            instrumentation=instrumentation
+        )
+
+        # Clients, pools and the cache are created once and stay warm between requests,
+        # so a request only pays for its own S3, Rekognition and Bedrock calls
+        aws_clients = aws_config.get_client()
+        report_cache = ReportCache(db_path='report_cache.sqlite', instrumentation=instrumentation)
+        s3_service = S3Service(aws_clients['s3'])
+        taxonomy = DamageTaxonomy.from_file(TAXONOMY_PATH) if TAXONOMY_PATH else None
+        rekognition_service = RekognitionService(aws_clients['rekognition'], cache=report_cache, taxonomy=taxonomy)
+        bedrock_service = BedrockService(aws_clients['bedrock'], cache=report_cache,
+                                         instrumentation=instrumentation)
+        triage = TriagePolicy()
+
+        service = AnalysisService(
+            DamageAnalyzer(s3_service, rekognition_service, bedrock_service, triage=triage),
+            batch_analyzer=MultiImageDamageAnalyzer(
+                s3_service=s3_service,
+                rekognition_service=rekognition_service,
+                bedrock_service=bedrock_service,
+                instrumentation=instrumentation,
+                memory_budget=MemoryBudget(MEMORY_BUDGET_MB * 1024 * 1024, instrumentation=instrumentation),
+                triage=triage
+            ),
+            output_bucket=OUTPUT_BUCKET,
+            max_workers=args.workers,
+            instrumentation=instrumentation
+        )
+
+        AnalysisRequestHandler.service = service
+        AnalysisRequestHandler.instrumentation = instrumentation
+        httpd = ThreadingHTTPServer((args.host, args.port), AnalysisRequestHandler)
+        httpd.daemon_threads = True
+        logger.info(f"Serving on http://{args.host}:{args.port}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            service.close()
+            logger.info(f"Service: {service.stats()}")
+            logger.info(f"Report cache: {report_cache.stats()}")
+
+    except Exception as e:
+        logger.error(f"Server error: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
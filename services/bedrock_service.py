@@ -1,59 +1,422 @@
-# services/bedrock_service.py
-import json 
-import base64 
-import logging 
-from typing import Dict 
-logger = logging.getLogger(__name__) 
-
-class BedrockService: 
-    def __init__(self, bedrock_client):  
-        self.client = bedrock_client
-        self.model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
-
-    def generate_report(self, image_bytes: bytes, damage_labels: list[Dict]) -> str: 
-        """Generate analysis report using Bedrock""" 
-        try:  
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-            prompt = f"""Analyze the following image for damage.  Detected potential damage indicators: {json.dumps(damage_labels)}  
-            Provide a detailed damage assessment including:  
-            1. Type and extent of damage  
-            2. Estimated repair complexity  
-            3. Potential repair cost range  
-            4. Recommendations for next steps  Be specific and use the detected labels as context."""
-            
-            body = json.dumps(
-                {
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 300,
-                    "temperature": 0.7,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/jpeg",
-                                        "data": base64_image
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": prompt
-                                }
-                            ]
-                        }
-                    ]
-                }
-            )
-
-            response = self.client.invoke_model(
-                modelId=self.model_id,
-                body=body,
-                contentType="application/json" 
-            ) 
-            return json.loads(response['body'].read())['content'][0]['text'] 
-        except Exception as e:  
-            logger.error(f"Bedrock error: {e}") 
-            raise
+# services/bedrock_service.py
+import json 
+import base64 
+import logging 
+import re 
+import time 
+from typing import Dict, Iterator, List, Optional 
+from services.report_cache import ReportCache, hash_image, normalize_labels 
+from services.image_preprocessor import detect_media_type 
+from services.instrumentation import Instrumentation, LATENCY_BUCKETS, TOKEN_BUCKETS
+from services.rate_limiter import error_code, is_throttling_error
+logger = logging.getLogger(__name__) 
+
+# Bump whenever the prompt text changes so cached reports are not reused
+PROMPT_VERSION = "1"
+CLAIM_PROMPT_VERSION = "1"
+
+# Limits for one multi-image Messages request
+MAX_IMAGES_PER_REQUEST = 20
+MAX_IMAGE_PAYLOAD_BYTES = 15 * 1024 * 1024
+MAX_OUTPUT_TOKENS = 4096
+
+_SECTION_PATTERN = re.compile(r'^=+\s*(IMAGE\s+(\d+)|SUMMARY)\s*=+\s*$', re.MULTILINE | re.IGNORECASE)
+
+# Stands in for base64 image data while the request JSON is serialised
+_IMAGE_PLACEHOLDER = "__image_{}__"
+
+
+def encode_request_body(payload: Dict, images: List[bytes]) -> bytes:
+    """
+    Serialise a Messages request, splicing in base64 image data as bytes
+
+    The payload carries _IMAGE_PLACEHOLDER.format(n) where image n goes.
+    Going through json.dumps with the base64 text would hold each image as
+    base64 bytes, a decoded str, the JSON str and the encoded body at once;
+    splicing leaves the base64 bytes and the final body. Base64 never needs
+    JSON escaping, so the result is identical.
+
+    :param payload: Request dict with placeholders in place of image data
+    :param images: Image bytes, in placeholder order
+    :return: UTF-8 request body
+    """
+    text = json.dumps(payload).encode('utf-8')
+    parts = []
+    position = 0
+    for index, image_bytes in enumerate(images):
+        # Matched with its quotes: the same text inside a prompt string would have them escaped
+        marker = f'"{_IMAGE_PLACEHOLDER.format(index)}"'.encode('utf-8')
+        start = text.index(marker, position) + 1
+        parts.append(text[position:start])
+        parts.append(base64.b64encode(image_bytes))
+        position = start + len(marker) - 2
+    parts.append(text[position:])
+    return b''.join(parts)
+
+
+def _stream_error(error_type: str, error) -> Exception:
+    """
+    Turn a response stream error event into the ClientError botocore raises for the
+    same error on a plain call, so throttling and retry checks see its code
+
+    :param error_type: Event name, e.g. 'throttlingException'
+    :param error: Event payload
+    :return: botocore ClientError with code e.g. 'ThrottlingException'
+    """
+    from botocore.exceptions import ClientError
+    message = error.get('message', str(error)) if isinstance(error, dict) else str(error)
+    code = error_type[:1].upper() + error_type[1:]
+    return ClientError({'Error': {'Code': code, 'Message': message}}, 'InvokeModelWithResponseStream')
+
+
+class BedrockService: 
+    def __init__(self, bedrock_client, cache: Optional[ReportCache] = None,
+                 instrumentation: Optional[Instrumentation] = None):  
+        self.client = bedrock_client
+        self.model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
+        # Cheaper, faster model for low-severity images (see services.triage)
+        self.fast_model_id = "anthropic.claude-3-haiku-20240307-v1:0"
+        self.max_tokens = 300
+        self.temperature = 0.7
+        self.cache = cache
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            self._tokens = instrumentation.histogram(
+                'bedrock_tokens', 'Bedrock token usage per request (from the response usage field)',
+                ('model', 'direction'), buckets=TOKEN_BUCKETS
+            )
+            self._time_to_first_token = instrumentation.histogram(
+                'bedrock_time_to_first_token_seconds', 'Delay before the first streamed token', ('model',),
+                buckets=LATENCY_BUCKETS
+            )
+
+    def generate_report(self, image_bytes: bytes, damage_labels: list[Dict], image_hash: Optional[str] = None,
+                        media_type: Optional[str] = None, metrics: Optional[Dict] = None,
+                        model_id: Optional[str] = None) -> str: 
+        """Generate analysis report using Bedrock, served from the report cache when possible""" 
+        return ''.join(self.generate_report_stream(
+            image_bytes, damage_labels, image_hash=image_hash, media_type=media_type, metrics=metrics,
+            model_id=model_id
+        ))
+
+    def generate_report_stream(self, image_bytes: bytes, damage_labels: list[Dict], image_hash: Optional[str] = None,
+                               media_type: Optional[str] = None, metrics: Optional[Dict] = None,
+                               model_id: Optional[str] = None) -> Iterator[str]: 
+        """
+        Generate analysis report, yielding text deltas as the model produces them
+
+        :param image_bytes: Image to assess
+        :param damage_labels: Labels from RekognitionService.detect_damage
+        :param image_hash: Content hash of the image (computed if omitted and caching is on)
+        :param media_type: Media type of image_bytes (sniffed if omitted)
+        :param metrics: Optional dict filled with model_id, time_to_first_token, total_time, input_tokens,
+                        output_tokens, tokens_per_second and cached once the stream is exhausted
+        :param model_id: Model to use instead of the default (e.g. fast_model_id)
+        :return: Iterator of report text fragments
+        """
+        model_id = model_id or self.model_id
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self._cache_key(image_hash or hash_image(image_bytes), damage_labels, model_id)
+            cached_report = self.cache.get(cache_key)
+            if cached_report is not None:
+                if metrics is not None:
+                    metrics.update({'cached': True, 'model_id': model_id, 'time_to_first_token': 0.0, 'total_time': 0.0})
+                yield cached_report
+                return
+
+        # The body is only referenced by _stream, which drops it once the first text arrives
+        body = self._build_body(image_bytes, damage_labels, media_type or detect_media_type(image_bytes))
+        stream = self._stream(body, metrics, model_id)
+        del body
+        parts = []
+        for text in stream:
+            parts.append(text)
+            yield text
+
+        if cache_key is not None:
+            self.cache.set(cache_key, ''.join(parts))
+
+    def _cache_key(self, image_hash: str, damage_labels: list[Dict], model_id: str) -> str:
+        return ReportCache.make_key(
+            'bedrock',
+            image_hash=image_hash,
+            labels=normalize_labels(damage_labels),
+            model_id=model_id,
+            prompt_version=PROMPT_VERSION,
+            params={'max_tokens': self.max_tokens, 'temperature': self.temperature}
+        )
+
+    def _build_body(self, image_bytes: bytes, damage_labels: list[Dict], media_type: str) -> bytes: 
+        prompt = f"""Analyze the following image for damage.  Detected potential damage indicators: {json.dumps(damage_labels)}  
+            Provide a detailed damage assessment including:  
+            1. Type and extent of damage  
+            2. Estimated repair complexity  
+            3. Potential repair cost range  
+            4. Recommendations for next steps  Be specific and use the detected labels as context."""
+        
+        return encode_request_body(
+            {
+                "anthropic_version": "bedrock-2023-05-31",
+                "max_tokens": self.max_tokens,
+                "temperature": self.temperature,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "image",
+                                "source": {
+                                    "type": "base64",
+                                    "media_type": media_type,
+                                    "data": _IMAGE_PLACEHOLDER.format(0)
+                                }
+                            },
+                            {
+                                "type": "text",
+                                "text": prompt
+                            }
+                        ]
+                    }
+                ]
+            },
+            [image_bytes]
+        )
+
+    def _stream(self, body: bytes, metrics: Optional[Dict], model_id: str) -> Iterator[str]: 
+        start = time.perf_counter()
+        first_token_at = None
+        usage = {'input_tokens': 0, 'output_tokens': 0}
+        # A rate limited client only sees errors raised by the call itself, not ones that
+        # arrive later in the stream, so those are reported and retried here
+        limiter = getattr(self.client, 'limiter', None)
+        retry_policy = getattr(self.client, 'retry_policy', None)
+        attempt = 0
+        while True:
+            try:  
+                response = self.client.invoke_model_with_response_stream(
+                    modelId=model_id,
+                    body=body,
+                    contentType="application/json" 
+                ) 
+                for event in response['body']:
+                    if 'chunk' not in event:
+                        # Stream errors arrive as events such as {'throttlingException': {...}}
+                        raise _stream_error(*next(iter(event.items())))
+
+                    chunk = json.loads(event['chunk']['bytes'])
+                    chunk_type = chunk.get('type')
+                    if chunk_type == 'content_block_delta':
+                        text = chunk['delta'].get('text', '')
+                        if text:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                # Nothing is retried once text has been yielded
+                                del body
+                            yield text
+                    elif chunk_type == 'message_start':
+                        usage['input_tokens'] = chunk['message'].get('usage', {}).get('input_tokens', 0)
+                    elif chunk_type == 'message_delta':
+                        usage['output_tokens'] = chunk.get('usage', {}).get('output_tokens', usage['output_tokens'])
+                break
+            except Exception as e:  
+                if first_token_at is None:
+                    if limiter is not None and is_throttling_error(e):
+                        limiter.on_throttle()
+                    if retry_policy is not None and retry_policy.should_retry(e, attempt):
+                        limiter.record('retries')
+                        delay = retry_policy.delay(attempt)
+                        logger.warning(f"Bedrock stream failed ({error_code(e)}), retrying in {delay:.2f}s")
+                        time.sleep(delay)
+                        attempt += 1
+                        continue
+                logger.error(f"Bedrock error: {e}") 
+                raise
+
+        total_time = time.perf_counter() - start
+        generation_time = total_time - ((first_token_at or start) - start)
+        report_metrics = {
+            'cached': False,
+            'model_id': model_id,
+            'time_to_first_token': (first_token_at - start) if first_token_at else total_time,
+            'total_time': total_time,
+            'input_tokens': usage['input_tokens'],
+            'output_tokens': usage['output_tokens'],
+            'tokens_per_second': usage['output_tokens'] / generation_time if generation_time > 0 else 0.0
+        }
+        logger.debug(f"Bedrock report metrics: {report_metrics}")
+        self._record_usage(usage, model_id, report_metrics['time_to_first_token'])
+        if metrics is not None:
+            metrics.update(report_metrics)
+
+    def generate_claim_report(self, images: List[Dict], model_id: Optional[str] = None) -> Dict: 
+        """
+        Assess several photos of one claim with as few invoke_model calls as possible
+
+        Images are packed into multi-image Messages requests that stay under
+        the image count, payload size and output token limits. The response
+        is split back into one report per image plus a claim-level summary.
+        Images the model skipped are reported individually via generate_report.
+
+        :param images: Dicts with 'image_bytes' and 'damage_labels', optionally 'key', 'media_type' and 'image_hash'
+        :param model_id: Model to use instead of the default
+        :return: Dictionary with 'reports' (one per input image, same order), 'summary' and 'requests'
+        """
+        model_id = model_id or self.model_id
+        reports = [None] * len(images)
+        summaries = []
+        batches = self.plan_claim_batches(images)
+
+        for batch in batches:
+            batch_reports, summary = self._generate_claim_batch([images[index] for index in batch], model_id)
+            for index, report in zip(batch, batch_reports):
+                reports[index] = report
+            if summary:
+                summaries.append(summary)
+
+        for index, report in enumerate(reports):
+            if report is None:
+                logger.warning(f"No section for image {images[index].get('key', index)} in claim response, reporting it alone")
+                image = images[index]
+                reports[index] = self.generate_report(
+                    image['image_bytes'], image['damage_labels'],
+                    image_hash=image.get('image_hash'), media_type=image.get('media_type'), model_id=model_id
+                )
+
+        if len(summaries) > 1:
+            summary = "\n\n".join(f"Part {number}:\n{text}" for number, text in enumerate(summaries, 1))
+        else:
+            summary = summaries[0] if summaries else ''
+
+        return {'reports': reports, 'summary': summary, 'requests': len(batches)}
+
+    def plan_claim_batches(self, images: List[Dict]) -> List[List[int]]: 
+        """
+        Split a claim's images into request-sized batches
+
+        :param images: Dicts with 'image_bytes'
+        :return: List of batches, each a list of indexes into images
+        """
+        # Leave room for the claim summary in the output budget
+        images_per_output = max(1, (MAX_OUTPUT_TOKENS - self.max_tokens) // self.max_tokens)
+        max_images = min(MAX_IMAGES_PER_REQUEST, images_per_output)
+
+        batches = []
+        current = []
+        current_bytes = 0
+        for index, image in enumerate(images):
+            # base64 grows the payload by a third
+            size = (len(image['image_bytes']) + 2) // 3 * 4
+            if current and (len(current) >= max_images or current_bytes + size > MAX_IMAGE_PAYLOAD_BYTES):
+                batches.append(current)
+                current = []
+                current_bytes = 0
+            current.append(index)
+            current_bytes += size
+        if current:
+            batches.append(current)
+        return batches
+
+    def _generate_claim_batch(self, images: List[Dict], model_id: str) -> tuple: 
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ReportCache.make_key(
+                'bedrock-claim',
+                images=[
+                    [image.get('image_hash') or hash_image(image['image_bytes']), normalize_labels(image['damage_labels'])]
+                    for image in images
+                ],
+                model_id=model_id,
+                prompt_version=CLAIM_PROMPT_VERSION,
+                params={'max_tokens': self.max_tokens, 'temperature': self.temperature}
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                cached = json.loads(cached)
+                return cached['reports'], cached['summary']
+
+        content = []
+        image_data = []
+        for number, image in enumerate(images, 1):
+            content.append({
+                "type": "text",
+                "text": f"Image {number}: {image.get('key', '')}  Detected potential damage indicators: {json.dumps(image['damage_labels'])}"
+            })
+            content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": image.get('media_type') or detect_media_type(image['image_bytes']),
+                    "data": _IMAGE_PLACEHOLDER.format(len(image_data))
+                }
+            })
+            image_data.append(image['image_bytes'])
+        content.append({
+            "type": "text",
+            "text": f"""The {len(images)} images above belong to the same damage claim.  
+            For each image provide a detailed damage assessment including:  
+            1. Type and extent of damage  
+            2. Estimated repair complexity  
+            3. Potential repair cost range  
+            4. Recommendations for next steps  Be specific and use the detected labels as context.  
+            Start each assessment on its own line with the header === IMAGE n === (n is the image number).  
+            Finish with a line === SUMMARY === followed by an overall assessment of the claim."""
+        })
+
+        max_tokens = min(MAX_OUTPUT_TOKENS, self.max_tokens * (len(images) + 1))
+        text = self._invoke_messages(content, max_tokens, image_data, model_id)
+        reports, summary = self._split_claim_response(text, len(images))
+
+        if cache_key is not None and all(report is not None for report in reports):
+            self.cache.set(cache_key, json.dumps({'reports': reports, 'summary': summary}))
+        return reports, summary
+
+    @staticmethod
+    def _split_claim_response(text: str, image_count: int) -> tuple: 
+        reports = [None] * image_count
+        summary = ''
+        matches = list(_SECTION_PATTERN.finditer(text))
+        for position, match in enumerate(matches):
+            end = matches[position + 1].start() if position + 1 < len(matches) else len(text)
+            section = text[match.end():end].strip()
+            if match.group(2) is None:
+                summary = section
+                continue
+            number = int(match.group(2))
+            if 1 <= number <= image_count and section:
+                reports[number - 1] = section
+        return reports, summary
+
+    def _invoke_messages(self, content: List[Dict], max_tokens: int, images: Optional[List[bytes]] = None,
+                         model_id: Optional[str] = None) -> str: 
+        model_id = model_id or self.model_id
+        try:  
+            body = encode_request_body(
+                {
+                    "anthropic_version": "bedrock-2023-05-31",
+                    "max_tokens": max_tokens,
+                    "temperature": self.temperature,
+                    "messages": [{"role": "user", "content": content}]
+                },
+                images or []
+            )
+            response = self.client.invoke_model(
+                modelId=model_id,
+                body=body,
+                contentType="application/json" 
+            ) 
+            del body
+            result = json.loads(response['body'].read())
+            self._record_usage(result.get('usage', {}), model_id)
+            return result['content'][0]['text'] 
+        except Exception as e:  
+            logger.error(f"Bedrock error: {e}") 
+            raise
+
+    def _record_usage(self, usage: Dict, model_id: str, time_to_first_token: Optional[float] = None) -> None:
+        if self.instrumentation is None:
+            return
+        self._tokens.observe(usage.get('input_tokens', 0), model=model_id, direction='input')
+        self._tokens.observe(usage.get('output_tokens', 0), model=model_id, direction='output')
+        if time_to_first_token is not None:
+            self._time_to_first_token.observe(time_to_first_token, model=model_id)
@@ -0,0 +1,211 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATUS_IN_PROGRESS = 'in_progress'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# SQLite caps bound parameters per statement; keep IN (...) lookups well below it
+_LOOKUP_BATCH_SIZE = 500
+
+
+class CheckpointManifest:
+    def __init__(self, db_path: str = 'manifest.sqlite'):
+        """
+        Durable record of which source objects have been processed
+
+        One row per (bucket, key) holding the ETag, size and last-modified
+        time the object had when it was processed, the report it produced and
+        a status. Objects whose row is 'done' with a matching ETag and size are
+        skipped on the next run; 'in_progress' and 'failed' rows are retried,
+        which is what lets an interrupted run resume.
+
+        :param db_path: Local SQLite file backing the manifest
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            "bucket TEXT NOT NULL, key TEXT NOT NULL, etag TEXT, size INTEGER, "
+            "last_modified TEXT, report_key TEXT, status TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (bucket, key)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS manifest_status ON manifest (bucket, status)")
+        self._db.commit()
+
+    def filter_pending(self, bucket: str, objects: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Drop objects that were already processed in their current version
+
+        Objects are looked up in batches, so this keeps pace with a streaming
+        listing even on manifests with hundreds of thousands of rows.
+
+        :param bucket: Bucket the objects were listed from
+        :param objects: list_objects_v2 entries (Key, ETag, Size, LastModified)
+        :return: Iterator of objects that are new, modified or not finished
+        """
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= _LOOKUP_BATCH_SIZE:
+                yield from self._pending_in_batch(bucket, batch)
+                batch = []
+        if batch:
+            yield from self._pending_in_batch(bucket, batch)
+
+    def needs_processing(self, bucket: str, obj: Dict) -> bool:
+        """
+        Check a single object against the manifest
+
+        :param bucket: Bucket holding the object
+        :param obj: list_objects_v2 entry (Key, ETag, Size)
+        :return: True if the object is new, modified or not finished
+        """
+        return bool(list(self._pending_in_batch(bucket, [obj])))
+
+    def mark_started(self, bucket: str, obj: Dict) -> None:
+        """
+        Record that processing of an object version has begun
+        """
+        self._write(bucket, obj['Key'], STATUS_IN_PROGRESS, obj=obj)
+
+    def mark_done(self, bucket: str, key: str, report_key: Optional[str] = None) -> None:
+        """
+        Record that an object was fully processed and its report persisted
+        """
+        self._write(bucket, key, STATUS_DONE, report_key=report_key)
+
+    def mark_failed(self, bucket: str, key: str) -> None:
+        """
+        Record that processing failed; the object is retried on the next run
+        """
+        self._write(bucket, key, STATUS_FAILED)
+
+    def get(self, bucket: str, key: str) -> Optional[Dict]:
+        """
+        Return the manifest row for an object, or None if it was never seen
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, size, last_modified, report_key, status, updated_at "
+                "FROM manifest WHERE bucket = ? AND key = ?", (bucket, key)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, size, last_modified, report_key, status, updated_at = row
+        return {
+            'bucket': bucket,
+            'key': key,
+            'etag': etag,
+            'size': size,
+            'last_modified': last_modified,
+            'report_key': report_key,
+            'status': status,
+            'updated_at': updated_at
+        }
+
+    def counts(self, bucket: str) -> Dict[str, int]:
+        """
+        Return the number of manifest rows per status for a bucket
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM manifest WHERE bucket = ? GROUP BY status", (bucket,)
+            ).fetchall()
+        return dict(rows)
+
+    def sync_to_s3(self, s3_client, bucket: str, key: str) -> bool:
+        """
+        Upload a consistent snapshot of the manifest to S3
+
+        :param s3_client: boto3 S3 client
+        :param bucket: Destination bucket
+        :param key: Destination key
+        :return: Boolean indicating upload success
+        """
+        fd, snapshot_path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            snapshot = sqlite3.connect(snapshot_path)
+            with self._lock:
+                self._db.commit()
+                self._db.backup(snapshot)
+            snapshot.close()
+            s3_client.upload_file(snapshot_path, bucket, key)
+            logger.info(f"Manifest synced to {bucket}/{key}")
+            return True
+        except Exception as e:
+            logger.error(f"Error syncing manifest to {bucket}/{key}: {e}")
+            return False
+        finally:
+            os.remove(snapshot_path)
+
+    @classmethod
+    def load_from_s3(cls, s3_client, bucket: str, key: str, db_path: str = 'manifest.sqlite') -> 'CheckpointManifest':
+        """
+        Restore a manifest snapshot from S3, starting empty if none exists yet
+
+        :param s3_client: boto3 S3 client
+        :param bucket: Bucket holding the snapshot
+        :param key: Key of the snapshot
+        :param db_path: Local SQLite file to restore into
+        :return: CheckpointManifest backed by db_path
+        """
+        try:
+            s3_client.download_file(bucket, key, db_path)
+            logger.info(f"Manifest restored from {bucket}/{key}")
+        except Exception as e:
+            logger.warning(f"No manifest restored from {bucket}/{key}: {e}")
+        return cls(db_path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def _pending_in_batch(self, bucket: str, batch: List[Dict]) -> List[Dict]:
+        placeholders = ','.join('?' * len(batch))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT key, etag, size FROM manifest WHERE bucket = ? AND status = ? "
+                f"AND key IN ({placeholders})",
+                [bucket, STATUS_DONE] + [obj['Key'] for obj in batch]
+            ).fetchall()
+        done = {key: (etag, size) for key, etag, size in rows}
+        # Without an ETag a changed object can't be told from the processed one, so it is
+        # always pending rather than skipped forever
+        return [
+            obj for obj in batch
+            if not obj.get('ETag') or done.get(obj['Key']) != (obj.get('ETag'), obj.get('Size'))
+        ]
+
+    def _write(self, bucket: str, key: str, status: str,
+               obj: Optional[Dict] = None, report_key: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            if obj is not None:
+                last_modified = obj.get('LastModified')
+                self._db.execute(
+                    "INSERT OR REPLACE INTO manifest "
+                    "(bucket, key, etag, size, last_modified, report_key, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, NULL, ?, ?)",
+                    (bucket, key, obj.get('ETag'), obj.get('Size'),
+                     str(last_modified) if last_modified is not None else None, status, now)
+                )
+            else:
+                self._db.execute(
+                    "UPDATE manifest SET status = ?, report_key = COALESCE(?, report_key), updated_at = ? "
+                    "WHERE bucket = ? AND key = ?",
+                    (status, report_key, now, bucket, key)
+                )
+            self._db.commit()
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Built-in taxonomy; a YAML file with the same layout can replace it (see DamageTaxonomy.from_file)
+DEFAULT_TAXONOMY = {
+    'version': '2024.1',
+    'categories': {
+        'physical': {
+            'severity': 0.5,
+            'terms': [
+                'damage', 'crack', {'term': 'scratch', 'severity': 0.2}, 'dent', 'broken',
+                {'term': 'chip', 'severity': 0.3}, 'split', 'tear', {'term': 'puncture', 'severity': 0.6},
+                'gouge', {'term': 'rupture', 'severity': 0.9}, 'fissure', {'term': 'fracture', 'severity': 0.8},
+                {'term': 'destroyed', 'severity': 1.0}
+            ]
+        },
+        'surface': {
+            'severity': 0.3,
+            'terms': [
+                {'term': 'rust', 'severity': 0.4}, {'term': 'corrosion', 'severity': 0.4},
+                {'term': 'wear', 'severity': 0.2}, 'deterioration', 'degradation', 'erosion',
+                {'term': 'stain', 'severity': 0.2}, {'term': 'discoloration', 'severity': 0.2},
+                'peeling', 'chipped paint', 'surface damage'
+            ]
+        },
+        'structural': {
+            'severity': 0.7,
+            'terms': [
+                'deformation', {'term': 'warped', 'severity': 0.6}, {'term': 'bent', 'severity': 0.6},
+                {'term': 'misaligned', 'severity': 0.6}, {'term': 'collapsed', 'severity': 1.0},
+                {'term': 'buckled', 'severity': 0.9}, 'twisted', {'term': 'structural failure', 'severity': 1.0},
+                'compromised'
+            ]
+        },
+        'material': {
+            'severity': 0.7,
+            'terms': [
+                {'term': 'shattered', 'severity': 0.9}, 'cracked glass', 'metal fatigue', 'material failure',
+                'structural weakness', {'term': 'fragmented', 'severity': 0.8}
+            ]
+        },
+        'contextual': {
+            'severity': 0.6,
+            'terms': [
+                'impact', {'term': 'collision', 'severity': 0.8}, {'term': 'accident', 'severity': 0.8},
+                {'term': 'trauma', 'severity': 0.7}, {'term': 'stress', 'severity': 0.4},
+                {'term': 'strain', 'severity': 0.4}, 'mechanical failure', 'structural compromise'
+            ]
+        }
+    }
+}
+
+# Label names seen per taxonomy; Rekognition's vocabulary is a few thousand names, so this rarely fills
+MAX_CACHED_NAMES = 100000
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+# Inflections stripped before comparing words, so 'dent' matches 'Dented' but not 'Accident' or 'Dentist'
+_SUFFIXES = ('ies', 'ing', 'es', 'ed', 's', 'd', 'y')
+
+
+def _words(text: str) -> List[str]:
+    return _NON_WORD.sub(' ', text.lower()).split()
+
+
+@lru_cache(maxsize=65536)
+def _word_forms(word: str) -> FrozenSet[str]:
+    """
+    The word plus the stems it may be an inflection of ('chipped' -> chipped, chipp, chip, chippe)
+    """
+    forms = {word}
+    for suffix in _SUFFIXES:
+        if not word.endswith(suffix) or len(word) - len(suffix) < 3:
+            continue
+        stem = word[:-len(suffix)]
+        forms.add(stem)
+        if suffix == 'ies':
+            forms.add(stem + 'y')
+        elif suffix in ('ing', 'ed'):
+            forms.add(stem + 'e')
+        if len(stem) > 3 and stem[-1] == stem[-2] and stem[-1] not in 'aeiou':
+            forms.add(stem[:-1])
+    return frozenset(forms)
+
+
+class DamageTaxonomy:
+    def __init__(self, taxonomy: Optional[Dict] = None):
+        """
+        Versioned damage vocabulary with severity weights and a compiled matcher
+
+        Terms match whole words of a label name, parent or category, allowing
+        for inflections ('dent' matches 'Dented Door' but not 'Accident').
+        Terms are indexed by the stems of their first word, so matching a
+        name costs a few dictionary lookups per word however many terms the
+        taxonomy holds, and the outcome for every name is cached, so labels
+        Rekognition returns again and again are matched once.
+
+        :param taxonomy: Dict with 'version' and 'categories' (default: DEFAULT_TAXONOMY);
+                         each category has a 'severity' in [0, 1] and 'terms', given as
+                         strings or {'term', 'severity'} dicts overriding the category's severity
+        """
+        taxonomy = taxonomy or DEFAULT_TAXONOMY
+        self.version = str(taxonomy.get('version', 'unversioned'))
+        self.terms: Dict[str, Dict] = {}
+        self._index: Dict[str, List[Tuple[Tuple[str, ...], Dict]]] = {}
+
+        categories = taxonomy.get('categories')
+        if not categories:
+            raise ValueError("Taxonomy has no categories")
+        for category, spec in categories.items():
+            default_severity = spec.get('severity', 0.5)
+            for entry in spec.get('terms', []):
+                term, severity = (entry, default_severity) if isinstance(entry, str) else \
+                    (entry['term'], entry.get('severity', default_severity))
+                self._add_term(term, category, severity)
+        if not self.terms:
+            raise ValueError("Taxonomy has no terms")
+
+        self.fingerprint = hashlib.sha256(
+            json.dumps([self.version, self.terms], sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
+        self._cache: Dict[str, Optional[Dict]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'cache_hits': 0}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'DamageTaxonomy':
+        """
+        Load a taxonomy from a YAML (or JSON) file
+
+        version: "2024.1"
+        categories:
+          structural:
+            severity: 0.7
+            terms:
+              - bent
+              - {term: collapsed, severity: 1.0}
+
+        :param path: Path of the file
+        :return: DamageTaxonomy
+        """
+        # Imported here: only deployments with a custom taxonomy need PyYAML loaded
+        import yaml
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                taxonomy = yaml.safe_load(f)
+        except Exception as e:
+            logger.error(f"Error loading damage taxonomy {path}: {e}")
+            raise
+        loaded = cls(taxonomy)
+        logger.info(f"Loaded damage taxonomy {loaded.version} ({len(loaded.terms)} terms) from {path}")
+        return loaded
+
+    def match(self, text: str) -> Optional[Dict]:
+        """
+        Most specific term found in a label name, parent or category
+
+        Longer phrases win ('surface damage' over 'damage'), then higher severity.
+
+        :param text: Text to match
+        :return: {'term', 'category', 'severity'} or None
+        """
+        self._stats['lookups'] += 1
+        cached = self._cache.get(text, False)
+        if cached is not False:
+            self._stats['cache_hits'] += 1
+            return cached
+
+        best = None
+        words = _words(text)
+        for position, word in enumerate(words):
+            for form in _word_forms(word):
+                for tokens, info in self._index.get(form, ()):
+                    if best is not None and (len(tokens), info['severity']) <= (len(best[1]), best[0]['severity']):
+                        continue
+                    following = words[position + 1:position + len(tokens)]
+                    if len(following) == len(tokens) - 1 and all(
+                            _word_forms(token) & _word_forms(other) for token, other in zip(tokens[1:], following)):
+                        best = (info, tokens)
+
+        result = dict(best[0]) if best is not None else None
+        with self._lock:
+            if len(self._cache) >= MAX_CACHED_NAMES:
+                self._cache.clear()
+            self._cache[text] = result
+        return result
+
+    def match_label(self, label: Dict) -> Optional[Dict]:
+        """
+        Match one Rekognition label on its name, else its parents, else its categories
+
+        :param label: Label from detect_labels
+        :return: Damage annotation with 'term', 'category', 'severity', 'matched_on', 'score'
+                 (severity weighted by confidence) and 'instances', or None
+        """
+        best = None
+        for matched_on, texts in (('name', [label['Name']]),
+                                  ('parent', [parent['Name'] for parent in label.get('Parents', [])]),
+                                  ('category', [category['Name'] for category in label.get('Categories', [])])):
+            for text in texts:
+                found = self.match(text)
+                if found is not None and (best is None or found['severity'] > best['severity']):
+                    best = dict(found, matched_on=matched_on)
+            if best is not None:
+                break
+        if best is None:
+            return None
+
+        best['score'] = round(best['severity'] * label.get('Confidence', 0.0) / 100.0, 4)
+        instances = label.get('Instances') or []
+        best['instances'] = len(instances)
+        if instances:
+            area = sum(instance['BoundingBox']['Width'] * instance['BoundingBox']['Height']
+                       for instance in instances if 'BoundingBox' in instance)
+            best['coverage'] = round(min(area, 1.0), 4)
+        return best
+
+    def filter_labels(self, labels: List[Dict]) -> List[Dict]:
+        """
+        Keep the damage labels of one detect_labels response
+
+        :param labels: response['Labels']
+        :return: Copies of the matching labels with their annotation under 'Damage'
+        """
+        damage_labels = []
+        for label in labels:
+            damage = self.match_label(label)
+            if damage is not None:
+                damage_labels.append(dict(label, Damage=damage))
+        return damage_labels
+
+    def classify(self, responses: Iterable[Union[Dict, List[Dict]]]) -> List[Dict]:
+        """
+        Classify a batch of detect_labels responses
+
+        Every distinct name, parent and category in the batch is matched once
+        up front; the per-image results are then assembled from those matches.
+
+        :param responses: detect_labels responses (or their 'Labels' lists)
+        :return: One dict per response with 'labels' (annotated damage labels),
+                 'severity' (highest label score), 'score' (labels combined as
+                 1 - prod(1 - score)) and 'categories' (damage labels per category)
+        """
+        label_lists = [response['Labels'] if isinstance(response, dict) else response for response in responses]
+        texts = set()
+        for labels in label_lists:
+            for label in labels:
+                texts.add(label['Name'])
+                texts.update(parent['Name'] for parent in label.get('Parents', []))
+                texts.update(category['Name'] for category in label.get('Categories', []))
+        for text in texts:
+            self.match(text)
+
+        results = []
+        for labels in label_lists:
+            damage_labels = self.filter_labels(labels)
+            remaining = 1.0
+            categories = {}
+            for label in damage_labels:
+                remaining *= 1.0 - label['Damage']['score']
+                category = label['Damage']['category']
+                categories[category] = categories.get(category, 0) + 1
+            results.append({
+                'labels': damage_labels,
+                'severity': max((label['Damage']['score'] for label in damage_labels), default=0.0),
+                'score': round(1.0 - remaining, 4),
+                'categories': categories
+            })
+        return results
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats.update({'version': self.version, 'terms': len(self.terms), 'cached_names': len(self._cache)})
+        return stats
+
+    def _add_term(self, term: str, category: str, severity: float) -> None:
+        tokens = tuple(_words(term))
+        if not tokens:
+            raise ValueError(f"Empty term in category {category}")
+        if not 0.0 <= severity <= 1.0:
+            raise ValueError(f"Severity of '{term}' must be between 0 and 1")
+        key = ' '.join(tokens)
+        if key in self.terms:
+            raise ValueError(f"Term '{key}' appears in both {self.terms[key]['category']} and {category}")
+        info = {'term': key, 'category': category, 'severity': float(severity)}
+        self.terms[key] = info
+        for form in _word_forms(tokens[0]):
+            self._index.setdefault(form, []).append((tokens, info))
@@ -1,88 +1,210 @@
-import boto3
-import logging
-from typing import Dict, List
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-
-class EmailNotificationService:
-    def __init__(self, ses_client=None):
-        """
-        Initialize SES client for sending emails
-        
-        :param ses_client: Optional pre-configured SES client
-        """
-        self.ses_client = ses_client or boto3.client('ses')
-        self.logger = logging.getLogger(__name__)
-    
-    def _create_email_body(self, report_details: Dict) -> str:
-        """
-        Create HTML email body from report details
-        
-        :param report_details: Dictionary containing report information
-        :return: HTML formatted email body
-        """
-        return f"""
-        <html>
-        <body>
-            <h2>Damage Report</h2>
-            <p><strong>Image:</strong> {report_details.get('moved_image_key', 'N/A')}</p>
-            <p><strong>Damage Labels:</strong> {', '.join(report_details.get('damage_labels', []))}</p>
-            <h3>Detailed Report</h3>
-            <p>{report_details.get('report', 'No detailed report available')}</p>
-        </body>
-        </html>
-        """
-    
-    def send_report_email(self, 
-                           recipient: str, 
-                           report_details: Dict, 
-                           s3_client=None, 
-                           processed_bucket: str = None) -> bool:
-        """
-        Send email with damage report and attached PDF
-        
-        :param recipient: Email address of recipient
-        :param report_details: Dictionary containing report details
-        :param s3_client: Optional S3 client for retrieving report
-        :param processed_bucket: Bucket containing processed reports
-        :return: Boolean indicating email sending success
-        """
-        s3_client = s3_client or boto3.client('s3')
-        
-        try:
-            # Create multipart message
-            msg = MIMEMultipart()
-            msg['Subject'] = f"Damage Report for {report_details.get('moved_image_key')}"
-            msg['From'] = "your-verified-email@example.com"  # Replace with verified SES email
-            msg['To'] = recipient
-            
-            # Attach HTML body
-            msg.attach(MIMEText(self._create_email_body(report_details), 'html'))
-            
-            # Attempt to attach PDF report if exists
-            try:
-                report_key = report_details.get('report_key')
-                if report_key and processed_bucket:
-                    report_obj = s3_client.get_object(Bucket=processed_bucket, Key=report_key)
-                    report_content = report_obj['Body'].read()
-                    
-                    pdf_part = MIMEApplication(report_content, _subtype='pdf')
-                    pdf_part.add_header('Content-Disposition', 'attachment', filename=report_key.split('/')[-1])
-                    msg.attach(pdf_part)
-            except Exception as pdf_error:
-                self.logger.warning(f"Could not attach PDF: {pdf_error}")
-            
-            # Send email
-            response = self.ses_client.send_raw_email(
-                Source=msg['From'],
-                Destinations=[recipient],
-                RawMessage={'Data': msg.as_string()}
-            )
-            
-            self.logger.info(f"Email sent successfully to {recipient}")
-            return True
-        
-        except Exception as e:
-            self.logger.error(f"Failed to send email: {e}")
-            return False
\ No newline at end of file
+import html
+import logging
+from typing import Dict, List, Optional, Tuple
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.application import MIMEApplication
+
+# SES rejects raw messages above 10 MB (after MIME encoding)
+MAX_RAW_MESSAGE_BYTES = 10 * 1024 * 1024
+
+# Room left for headers and the HTML body of a digest
+_DIGEST_OVERHEAD_BYTES = 512 * 1024
+
+def _image_name(report_details: Dict) -> str:
+    return report_details.get('moved_image_key') or report_details.get('source_key') or 'N/A'
+
+def _label_names(report_details: Dict) -> str:
+    labels = report_details.get('damage_labels') or []
+    return ', '.join(label['Name'] if isinstance(label, dict) else str(label) for label in labels)
+
+class EmailNotificationService:
+    def __init__(self, ses_client=None, s3_client=None, sender: str = "your-verified-email@example.com"):
+        """
+        Initialize SES client for sending emails
+
+        :param ses_client: Optional pre-configured SES client (e.g. AWSConfig.client('ses'))
+        :param s3_client: Optional pre-configured S3 client for retrieving reports
+        :param sender: Verified SES sender address
+        """
+        self._ses_client = ses_client
+        self.s3_client = s3_client
+        self.sender = sender
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def ses_client(self):
+        # The fallback client is only created when the first email is sent
+        if self._ses_client is None:
+            import boto3
+            self._ses_client = boto3.client('ses')
+        return self._ses_client
+
+    def _create_email_body(self, report_details: Dict) -> str:
+        """
+        Create HTML email body from report details
+
+        :param report_details: Dictionary containing report information
+        :return: HTML formatted email body
+        """
+        return f"""
+        <html>
+        <body>
+            <h2>Damage Report</h2>
+            <p><strong>Image:</strong> {html.escape(_image_name(report_details))}</p>
+            <p><strong>Damage Labels:</strong> {html.escape(_label_names(report_details))}</p>
+            <h3>Detailed Report</h3>
+            <p>{html.escape(report_details.get('report', 'No detailed report available'))}</p>
+        </body>
+        </html>
+        """
+
+    def _create_digest_body(self, results: List[Dict], part: int = 1, parts: int = 1) -> str:
+        """
+        Create HTML body summarising several reports in one email
+
+        :param results: Report dictionaries included in this email
+        :param part: Number of this email when a digest is split
+        :param parts: Total number of emails in the digest
+        :return: HTML formatted email body
+        """
+        sections = "".join(
+            f"""
+            <h3>{html.escape(_image_name(result))}</h3>
+            <p><strong>Damage Labels:</strong> {html.escape(_label_names(result))}</p>
+            <p>{html.escape(result.get('report', 'No detailed report available'))}</p>
+            """
+            for result in results
+        )
+        part_text = f" (part {part} of {parts})" if parts > 1 else ""
+        return f"""
+        <html>
+        <body>
+            <h2>Damage Report Digest{part_text}</h2>
+            <p>{len(results)} image(s) analysed.</p>
+            {sections}
+        </body>
+        </html>
+        """
+
+    def send_report_email(self,
+                           recipient: str,
+                           report_details: Dict,
+                           s3_client=None,
+                           processed_bucket: str = None,
+                           pdf_bytes: Optional[bytes] = None,
+                           pdf_filename: Optional[str] = None) -> bool:
+        """
+        Send email with damage report and attached PDF
+
+        :param recipient: Email address of recipient
+        :param report_details: Dictionary containing report details
+        :param s3_client: Optional S3 client for retrieving report
+        :param processed_bucket: Bucket containing processed reports
+        :param pdf_bytes: Already rendered PDF; attached directly instead of downloading it from S3
+        :param pdf_filename: Attachment name for pdf_bytes
+        :return: Boolean indicating email sending success
+        """
+        try:
+            # Create multipart message
+            msg = MIMEMultipart()
+            msg['Subject'] = f"Damage Report for {_image_name(report_details)}"
+            msg['From'] = self.sender
+            msg['To'] = recipient
+
+            # Attach HTML body
+            msg.attach(MIMEText(self._create_email_body(report_details), 'html'))
+
+            # Attempt to attach PDF report if exists
+            try:
+                report_key = report_details.get('report_key')
+                if pdf_bytes is not None:
+                    filename = pdf_filename or (report_key or f"{_image_name(report_details)}.pdf").split('/')[-1]
+                    self._attach_pdf(msg, pdf_bytes, filename)
+                elif report_key and processed_bucket:
+                    report_obj = self._get_s3_client(s3_client).get_object(Bucket=processed_bucket, Key=report_key)
+                    report_content = report_obj['Body'].read()
+                    self._attach_pdf(msg, report_content, report_key.split('/')[-1])
+            except Exception as pdf_error:
+                self.logger.warning(f"Could not attach PDF: {pdf_error}")
+
+            # Send email
+            self._send(msg, recipient)
+
+            self.logger.info(f"Email sent successfully to {recipient}")
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Failed to send email: {e}")
+            return False
+
+    def send_digest_email(self,
+                          recipient: str,
+                          results: List[Dict],
+                          attachments: Optional[List[Tuple[str, bytes]]] = None) -> bool:
+        """
+        Send several reports to one recipient as a digest
+
+        Attachments are packed greedily; if they would push the message past
+        the SES size limit, the digest is split over several emails.
+
+        :param recipient: Email address of recipient
+        :param results: Report dictionaries to include
+        :param attachments: Optional (filename, PDF bytes) pairs, one per result
+        :return: Boolean indicating all emails were sent
+        """
+        attachments = attachments or [None] * len(results)
+        batches = []
+        current = []
+        current_size = 0
+        for result, attachment in zip(results, attachments):
+            # base64 grows attachments by a third
+            size = len(attachment[1]) * 4 // 3 if attachment else 0
+            if current and current_size + size > MAX_RAW_MESSAGE_BYTES - _DIGEST_OVERHEAD_BYTES:
+                batches.append(current)
+                current = []
+                current_size = 0
+            current.append((result, attachment))
+            current_size += size
+        if current:
+            batches.append(current)
+
+        success = True
+        for part, batch in enumerate(batches, 1):
+            try:
+                msg = MIMEMultipart()
+                part_text = f" ({part}/{len(batches)})" if len(batches) > 1 else ""
+                msg['Subject'] = f"Damage Report Digest: {len(results)} image(s){part_text}"
+                msg['From'] = self.sender
+                msg['To'] = recipient
+                msg.attach(MIMEText(self._create_digest_body([result for result, _ in batch], part, len(batches)), 'html'))
+                for _, attachment in batch:
+                    if attachment:
+                        self._attach_pdf(msg, attachment[1], attachment[0])
+                self._send(msg, recipient)
+                self.logger.info(f"Digest email {part}/{len(batches)} sent successfully to {recipient}")
+            except Exception as e:
+                self.logger.error(f"Failed to send digest email to {recipient}: {e}")
+                success = False
+        return success
+
+    def _attach_pdf(self, msg: MIMEMultipart, pdf_bytes: bytes, filename: str) -> None:
+        pdf_part = MIMEApplication(pdf_bytes, _subtype='pdf')
+        pdf_part.add_header('Content-Disposition', 'attachment', filename=filename)
+        msg.attach(pdf_part)
+
+    def _send(self, msg: MIMEMultipart, recipient: str) -> None:
+        self.ses_client.send_raw_email(
+            Source=msg['From'],
+            Destinations=[recipient],
+            RawMessage={'Data': msg.as_string()}
+        )
+
+    def _get_s3_client(self, s3_client=None):
+        if s3_client is not None:
+            return s3_client
+        # Create the fallback client once, not once per email
+        if self.s3_client is None:
+            import boto3
+            self.s3_client = boto3.client('s3')
+        return self.s3_client
@@ -0,0 +1,374 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from urllib.parse import quote_plus, unquote_plus
+
+logger = logging.getLogger(__name__)
+
+# SQS hard limits
+MAX_RECEIVE_MESSAGES = 10
+MAX_WAIT_SECONDS = 20
+
+
+class QueueMessage:
+    """
+    One message received from an EventQueue
+
+    :param body: Raw message body
+    :param handle: Queue-specific handle used to ack/nack the message
+    :param receive_count: Times the message has been delivered (1 on first delivery)
+    """
+    __slots__ = ('body', 'handle', 'receive_count', 'received_at')
+
+    def __init__(self, body: str, handle, receive_count: int = 1):
+        self.body = body
+        self.handle = handle
+        self.receive_count = receive_count
+        self.received_at = time.time()
+
+
+class EventQueue(ABC):
+    """
+    Interface of the queues the event worker consumes from
+
+    Delivery is at-least-once: a received message stays invisible until it
+    is acknowledged, and comes back if it is nacked or its visibility
+    timeout runs out.
+    """
+
+    @abstractmethod
+    def receive(self, max_messages: int = MAX_RECEIVE_MESSAGES, wait_seconds: float = MAX_WAIT_SECONDS) -> List[QueueMessage]:
+        """
+        Wait up to wait_seconds for messages
+
+        :param max_messages: Max messages returned by one call
+        :param wait_seconds: Long-poll time
+        :return: Possibly empty list of messages
+        """
+
+    @abstractmethod
+    def ack(self, message: QueueMessage) -> None:
+        """
+        Delete a message that was fully processed
+        """
+
+    @abstractmethod
+    def nack(self, message: QueueMessage, delay_seconds: int = 0) -> None:
+        """
+        Make a message visible again so it is redelivered after delay_seconds
+        """
+
+    def extend(self, message: QueueMessage, visibility_timeout: int) -> None:
+        """
+        Keep a message that is still being processed invisible for visibility_timeout more seconds
+        """
+
+    @abstractmethod
+    def send(self, body: str) -> None:
+        """
+        Enqueue a message; used to feed the local stand-ins
+        """
+
+
+class SQSEventQueue(EventQueue):
+    def __init__(self, sqs_client, queue_url: str, visibility_timeout: Optional[int] = None):
+        """
+        EventQueue backed by an SQS queue receiving S3 notifications
+
+        :param sqs_client: boto3 SQS client (e.g. AWSConfig.client('sqs'))
+        :param queue_url: URL of the queue
+        :param visibility_timeout: Optional per-receive visibility timeout (default: the queue's setting)
+        """
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+
+    def receive(self, max_messages: int = MAX_RECEIVE_MESSAGES, wait_seconds: float = MAX_WAIT_SECONDS) -> List[QueueMessage]:
+        params = {
+            'QueueUrl': self.queue_url,
+            'MaxNumberOfMessages': max(1, min(MAX_RECEIVE_MESSAGES, max_messages)),
+            'WaitTimeSeconds': int(max(0, min(MAX_WAIT_SECONDS, wait_seconds))),
+            'AttributeNames': ['ApproximateReceiveCount']
+        }
+        if self.visibility_timeout is not None:
+            params['VisibilityTimeout'] = self.visibility_timeout
+        response = self.sqs_client.receive_message(**params)
+        return [
+            QueueMessage(
+                message['Body'],
+                message['ReceiptHandle'],
+                int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1))
+            )
+            for message in response.get('Messages', [])
+        ]
+
+    def ack(self, message: QueueMessage) -> None:
+        self.sqs_client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message.handle)
+
+    def nack(self, message: QueueMessage, delay_seconds: int = 0) -> None:
+        self.sqs_client.change_message_visibility(
+            QueueUrl=self.queue_url, ReceiptHandle=message.handle, VisibilityTimeout=int(delay_seconds)
+        )
+
+    def extend(self, message: QueueMessage, visibility_timeout: int) -> None:
+        self.sqs_client.change_message_visibility(
+            QueueUrl=self.queue_url, ReceiptHandle=message.handle, VisibilityTimeout=int(visibility_timeout)
+        )
+
+    def send(self, body: str) -> None:
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=body)
+
+
+class InMemoryEventQueue(EventQueue):
+    def __init__(self, visibility_timeout: float = 300.0):
+        """
+        Process-local EventQueue for tests and local runs
+
+        :param visibility_timeout: Seconds before an unacknowledged message is redelivered
+        """
+        self.visibility_timeout = visibility_timeout
+        self._ready = queue.Queue()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def send(self, body: str, receive_count: int = 0) -> None:
+        self._ready.put((body, receive_count))
+
+    def receive(self, max_messages: int = MAX_RECEIVE_MESSAGES, wait_seconds: float = MAX_WAIT_SECONDS) -> List[QueueMessage]:
+        self._requeue_expired()
+        messages = []
+        deadline = time.monotonic() + wait_seconds
+        while len(messages) < max_messages:
+            # Block for the first message only, then take whatever is ready
+            timeout = max(0.0, deadline - time.monotonic()) if not messages else 0
+            try:
+                body, receive_count = self._ready.get(timeout=timeout) if timeout else self._ready.get_nowait()
+            except queue.Empty:
+                break
+            message = QueueMessage(body, uuid.uuid4().hex, receive_count + 1)
+            with self._lock:
+                self._in_flight[message.handle] = (message, time.monotonic() + self.visibility_timeout)
+            messages.append(message)
+        return messages
+
+    def ack(self, message: QueueMessage) -> None:
+        with self._lock:
+            self._in_flight.pop(message.handle, None)
+
+    def nack(self, message: QueueMessage, delay_seconds: int = 0) -> None:
+        with self._lock:
+            entry = self._in_flight.get(message.handle)
+            if entry is not None:
+                # Let _requeue_expired pick it up once the delay has passed
+                self._in_flight[message.handle] = (entry[0], time.monotonic() + delay_seconds)
+        if not delay_seconds:
+            self._requeue_expired()
+
+    def extend(self, message: QueueMessage, visibility_timeout: int) -> None:
+        with self._lock:
+            if message.handle in self._in_flight:
+                self._in_flight[message.handle] = (message, time.monotonic() + visibility_timeout)
+
+    def _requeue_expired(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [handle for handle, (_, visible_at) in self._in_flight.items() if visible_at <= now]
+            for handle in expired:
+                message, _ = self._in_flight.pop(handle)
+                self._ready.put((message.body, message.receive_count))
+
+
+class FileEventQueue(EventQueue):
+    def __init__(self, directory: str, poll_interval: float = 0.5):
+        """
+        EventQueue stored as one JSON file per message in a spool directory
+
+        Lets notifications be dropped in by hand or by another process while
+        developing. A received message is moved into an 'in-flight'
+        subdirectory; acking deletes it and nacking moves it back.
+        Messages left in flight by a crashed worker are recovered on start.
+
+        :param directory: Spool directory (created if missing)
+        :param poll_interval: Seconds between directory scans while long-polling
+        """
+        self.directory = directory
+        self.in_flight_directory = os.path.join(directory, 'in-flight')
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        os.makedirs(self.in_flight_directory, exist_ok=True)
+        for name in os.listdir(self.in_flight_directory):
+            os.replace(os.path.join(self.in_flight_directory, name), os.path.join(directory, name))
+
+    def send(self, body: str) -> None:
+        name = f"{time.time():.6f}-{uuid.uuid4().hex}.json"
+        temporary = os.path.join(self.directory, f".{name}.tmp")
+        with open(temporary, 'w') as f:
+            f.write(body)
+        # Rename so a concurrent receive never sees a half-written file
+        os.replace(temporary, os.path.join(self.directory, name))
+
+    def receive(self, max_messages: int = MAX_RECEIVE_MESSAGES, wait_seconds: float = MAX_WAIT_SECONDS) -> List[QueueMessage]:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            messages = self._claim(max_messages)
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def _claim(self, max_messages: int) -> List[QueueMessage]:
+        messages = []
+        with self._lock:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+            for name in names[:max_messages]:
+                claimed = os.path.join(self.in_flight_directory, name)
+                try:
+                    os.replace(os.path.join(self.directory, name), claimed)
+                except FileNotFoundError:
+                    # Claimed by another worker sharing the directory
+                    continue
+                with open(claimed) as f:
+                    messages.append(QueueMessage(f.read(), name))
+        return messages
+
+    def ack(self, message: QueueMessage) -> None:
+        try:
+            os.remove(os.path.join(self.in_flight_directory, message.handle))
+        except FileNotFoundError:
+            pass
+
+    def nack(self, message: QueueMessage, delay_seconds: int = 0) -> None:
+        # Delays are not supported by the spool; the message is simply put back
+        try:
+            os.replace(os.path.join(self.in_flight_directory, message.handle),
+                       os.path.join(self.directory, message.handle))
+        except FileNotFoundError:
+            pass
+
+
+class ObjectEvent:
+    """
+    An object-created notification for one S3 object
+
+    :param bucket: Bucket holding the object
+    :param key: Object key (URL-decoded)
+    :param etag: Quoted ETag, in the same form list_objects_v2 returns
+    :param size: Object size in bytes
+    :param event_time: Upload time reported by S3, as a Unix timestamp
+    """
+    __slots__ = ('bucket', 'key', 'etag', 'size', 'event_time')
+
+    def __init__(self, bucket: str, key: str, etag: Optional[str] = None,
+                 size: Optional[int] = None, event_time: Optional[float] = None):
+        self.bucket = bucket
+        self.key = key
+        self.etag = etag
+        self.size = size
+        self.event_time = event_time
+
+    def to_object(self) -> Dict:
+        """
+        The event as a list_objects_v2-style entry, as used by the analyzer and manifest
+        """
+        obj = {'Key': self.key}
+        if self.etag:
+            obj['ETag'] = self.etag
+        if self.size is not None:
+            obj['Size'] = self.size
+        return obj
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _quote_etag(etag: Optional[str]) -> Optional[str]:
+    if not etag:
+        return None
+    return etag if etag.startswith('"') else f'"{etag}"'
+
+
+def parse_s3_events(body: str) -> List[ObjectEvent]:
+    """
+    Extract object-created events from a queue message body
+
+    Understands S3 event notifications delivered directly, wrapped in an SNS
+    envelope, or as EventBridge 'Object Created' events. Test events and
+    other event types yield an empty list.
+
+    :param body: Message body
+    :return: List of ObjectEvents
+    :raises ValueError: If the body is not JSON
+    """
+    payload = json.loads(body)
+
+    # SNS -> SQS fan-out wraps the notification in a 'Message' string
+    if isinstance(payload, dict) and payload.get('Type') == 'Notification' and 'Message' in payload:
+        payload = json.loads(payload['Message'])
+
+    if not isinstance(payload, dict):
+        return []
+
+    # EventBridge
+    if payload.get('source') == 'aws.s3':
+        if payload.get('detail-type') != 'Object Created':
+            return []
+        detail = payload.get('detail', {})
+        obj = detail.get('object', {})
+        return [ObjectEvent(
+            detail.get('bucket', {}).get('name'),
+            obj.get('key'),
+            _quote_etag(obj.get('etag')),
+            obj.get('size'),
+            _parse_time(payload.get('time'))
+        )]
+
+    events = []
+    for record in payload.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated'):
+            continue
+        s3 = record.get('s3', {})
+        obj = s3.get('object', {})
+        events.append(ObjectEvent(
+            s3.get('bucket', {}).get('name'),
+            # Keys arrive URL-encoded, with spaces as '+'
+            unquote_plus(obj.get('key', '')),
+            _quote_etag(obj.get('eTag')),
+            obj.get('size'),
+            _parse_time(record.get('eventTime'))
+        ))
+    return events
+
+
+def make_s3_event(bucket: str, key: str, etag: Optional[str] = None, size: Optional[int] = None) -> str:
+    """
+    Build an S3 ObjectCreated:Put notification body, e.g. to feed a local queue
+
+    :param bucket: Bucket name
+    :param key: Object key
+    :param etag: Optional unquoted ETag
+    :param size: Optional object size
+    :return: JSON message body
+    """
+    obj = {'key': quote_plus(key, safe='/')}
+    if etag:
+        obj['eTag'] = etag.strip('"')
+    if size is not None:
+        obj['size'] = size
+    return json.dumps({'Records': [{
+        'eventSource': 'aws:s3',
+        'eventName': 'ObjectCreated:Put',
+        'eventTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        's3': {'bucket': {'name': bucket}, 'object': obj}
+    }]})
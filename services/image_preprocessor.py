@@ -0,0 +1,151 @@
+import io
+import logging
+import threading
+from concurrent.futures import Executor
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are sent unchanged
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Claude downsizes anything with a longer edge than this anyway
+DEFAULT_MAX_EDGE = 1568
+DEFAULT_QUALITY = 85
+
+_MAGIC_NUMBERS = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif')
+]
+
+
+def detect_media_type(image_bytes: bytes, default: str = 'image/jpeg') -> str:
+    """
+    Detect the media type of an image from its leading bytes
+
+    :param image_bytes: Raw image bytes
+    :param default: Media type to assume when the format is not recognised
+    :return: MIME type such as 'image/jpeg' or 'image/png'
+    """
+    header = bytes(image_bytes[:12])
+    for magic, media_type in _MAGIC_NUMBERS:
+        if header.startswith(magic):
+            return media_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return default
+
+
+def preprocess_image(image_bytes: bytes, max_edge: int = DEFAULT_MAX_EDGE,
+                     quality: int = DEFAULT_QUALITY) -> Tuple[bytes, str]:
+    """
+    Downsize, re-encode as JPEG and drop metadata
+
+    Module-level so it can run in a worker process. EXIF orientation is
+    applied to the pixels before the metadata is dropped. If re-encoding
+    would not make the image smaller, the original bytes are returned.
+
+    :param image_bytes: Raw image bytes
+    :param max_edge: Longest edge of the output, in pixels
+    :param quality: JPEG quality of the output (1-95)
+    :return: Tuple of (image bytes, media type)
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > max_edge
+        if resized:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        # No exif= argument, so nothing from the source metadata is written
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+
+    processed = output.getvalue()
+    if not resized and len(processed) >= len(image_bytes):
+        return image_bytes, detect_media_type(image_bytes)
+    return processed, 'image/jpeg'
+
+
+class ImagePreprocessor:
+    def __init__(self,
+                 max_edge: int = DEFAULT_MAX_EDGE,
+                 quality: int = DEFAULT_QUALITY,
+                 max_workers: Optional[int] = None,
+                 executor: Optional[Executor] = None):
+        """
+        Shrink images before they are sent to Bedrock
+
+        Decoding and re-encoding is CPU-bound, so it runs on a process pool
+        and does not hold the GIL while other images are in flight.
+
+        :param max_edge: Longest edge of the output, in pixels
+        :param quality: JPEG quality of the output (1-95)
+        :param max_workers: Process pool size (default: CPU count)
+        :param executor: Optional pre-built executor to use instead of a private pool
+        """
+        self.max_edge = max_edge
+        self.quality = quality
+        self.enabled = Image is not None
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._max_workers = max_workers
+        self._executor_lock = threading.Lock()
+
+        if not self.enabled:
+            logger.warning("Pillow is not installed; images will be sent to Bedrock unchanged")
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Short description of the settings, used to keep cache entries apart
+        """
+        if not self.enabled:
+            return 'original'
+        return f"jpeg-{self.max_edge}-q{self.quality}"
+
+    def settings(self) -> Dict:
+        return {'max_edge': self.max_edge, 'quality': self.quality, 'enabled': self.enabled}
+
+    def preprocess(self, image_bytes: bytes) -> Tuple[bytes, str]:
+        """
+        Pre-process an image on the process pool
+
+        Images that cannot be decoded are passed through unchanged.
+
+        :param image_bytes: Raw image bytes
+        :return: Tuple of (image bytes, media type)
+        """
+        if not self.enabled:
+            return image_bytes, detect_media_type(image_bytes)
+        try:
+            future = self._get_executor().submit(preprocess_image, image_bytes, self.max_edge, self.quality)
+            return future.result()
+        except Exception as e:
+            logger.warning(f"Image pre-processing failed, sending original: {e}")
+            return image_bytes, detect_media_type(image_bytes)
+
+    def close(self) -> None:
+        with self._executor_lock:
+            if self._owns_executor and self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _get_executor(self) -> Executor:
+        with self._executor_lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # The pool is created lazily from whichever thread asks first; forking a process
+                # with other threads running can copy held locks into the children, so start
+                # workers from a clean server process (spawn where forkserver is unavailable)
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self._max_workers, mp_context=context)
+            return self._executor
@@ -0,0 +1,345 @@
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from services.rate_limiter import error_code, is_throttling_error
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 512 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2,
+                10 * 1024 ** 2, 20 * 1024 ** 2)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[Dict, object]]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> List[Tuple[Dict, object]]:
+        with self._lock:
+            items = [(key, ([*state[0]], state[1], state[2])) for key, state in self._values.items()]
+        return [(dict(zip(self.labelnames, key)), state) for key, state in items]
+
+
+class _Span:
+    __slots__ = ('instrumentation', 'name', 'attributes', 'start', 'tracers')
+
+    def __init__(self, instrumentation: 'Instrumentation', name: str, attributes: Dict):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.attributes = attributes
+        self.tracers = None
+
+    def __enter__(self):
+        instrumentation = self.instrumentation
+        instrumentation.spans_in_flight.inc(span=self.name)
+        if instrumentation.tracers:
+            self.tracers = ExitStack()
+            for tracer in instrumentation.tracers:
+                try:
+                    context = tracer(self.name, self.attributes)
+                    if context is not None:
+                        self.tracers.enter_context(context)
+                except Exception as e:
+                    logger.warning(f"Tracer failed to start span {self.name}: {e}")
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        instrumentation = self.instrumentation
+        instrumentation.span_seconds.observe(time.perf_counter() - self.start, span=self.name)
+        instrumentation.spans_in_flight.dec(span=self.name)
+        if exc is not None:
+            instrumentation.span_errors.inc(span=self.name)
+        if self.tracers is not None:
+            try:
+                self.tracers.__exit__(exc_type, exc, traceback)
+            except Exception as e:
+                logger.warning(f"Tracer failed to end span {self.name}: {e}")
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation:
+    def __init__(self, namespace: str = 'damage_analyzer', enabled: bool = True):
+        """
+        Process-wide metrics registry with timing spans and tracer hooks
+
+        Counters, gauges and histograms are plain dicts behind a lock, cheap
+        enough to leave on in production. Spans time a block of work, feed the
+        span_* metrics and are forwarded to any attached tracers.
+
+        :param namespace: Prefix for exported metric names
+        :param enabled: False turns spans into no-ops (metrics still count)
+        """
+        self.namespace = namespace
+        self.enabled = enabled
+        self.tracers = []
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+        self.span_seconds = self.histogram('span_duration_seconds', 'Duration of timed spans', ('span',))
+        self.span_errors = self.counter('span_errors_total', 'Spans that ended with an exception', ('span',))
+        self.spans_in_flight = self.gauge('spans_in_flight', 'Spans currently running', ('span',))
+
+    def counter(self, name: str, help_text: str = '', labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str = '', labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str = '', labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def _register(self, metric_type, name, help_text, labelnames, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = metric_type(name, help_text, labelnames, **kwargs)
+        if not isinstance(metric, metric_type) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"Metric '{name}' already registered with a different type or labels")
+        return metric
+
+    def add_tracer(self, tracer: Callable[[str, Dict], object]) -> None:
+        """
+        Attach a tracer that receives every span
+
+        :param tracer: Callable (name, attributes) returning a context manager (or None) that
+                       wraps the span, e.g. lambda name, attrs: otel_tracer.start_as_current_span(name, attributes=attrs)
+        """
+        self.tracers.append(tracer)
+
+    def remove_tracer(self, tracer: Callable[[str, Dict], object]) -> None:
+        self.tracers.remove(tracer)
+
+    def span(self, name: str, **attributes):
+        """
+        Time a block of work
+
+        :param name: Span name, e.g. 'pipeline.detect' or 'aws.s3.get_object'; used as the metric label
+        :param attributes: Extra details (image key, ...) passed to tracers only
+        :return: Context manager
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, attributes)
+
+    def snapshot(self) -> Dict:
+        """
+        Current value of every metric as JSON-serialisable data
+        """
+        snapshot = {'timestamp': time.time(), 'metrics': {}}
+        for metric in list(self._metrics.values()):
+            samples = []
+            for labels, value in metric.samples():
+                if metric.kind == 'histogram':
+                    counts, total, count = value
+                    value = {
+                        'buckets': dict(zip([*map(str, metric.buckets), '+Inf'], counts)),
+                        'sum': total,
+                        'count': count
+                    }
+                samples.append({'labels': labels, 'value': value})
+            snapshot['metrics'][metric.name] = {'type': metric.kind, 'help': metric.help, 'samples': samples}
+        return snapshot
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            name = f"{self.namespace}_{metric.name}" if self.namespace else metric.name
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in metric.samples():
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip([*metric.buckets, '+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """
+        Write a snapshot to disk, Prometheus format for .prom files and JSON otherwise
+
+        :param path: Output file path
+        """
+        content = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+def _format_labels(labels: Dict, **extra) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _payload_size(kwargs: Dict) -> Optional[int]:
+    for container, field in (('Image', 'Bytes'), ('RawMessage', 'Data')):
+        if container in kwargs and isinstance(kwargs[container], dict):
+            data = kwargs[container].get(field)
+            return len(data) if data is not None else None
+    body = kwargs.get('Body', kwargs.get('body'))
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return None
+
+
+class InstrumentedClient:
+    def __init__(self, client, service_name: str, instrumentation: Instrumentation):
+        """
+        Count, time and size every API call made through a boto3 client
+
+        Wrap the raw client (under any RateLimitedClient) so each attempt is
+        seen, including the throttled ones the rate limiter retries.
+
+        :param client: boto3 client to wrap
+        :param service_name: boto3 service name used as the metric label
+        :param instrumentation: Registry to record into
+        """
+        self._client = client
+        self._service_name = service_name
+        self._instrumentation = instrumentation
+        self._calls = instrumentation.counter(
+            'aws_calls_total', 'AWS API calls', ('service', 'operation'))
+        self._errors = instrumentation.counter(
+            'aws_errors_total', 'AWS API calls that raised', ('service', 'operation', 'code'))
+        self._throttles = instrumentation.counter(
+            'aws_throttles_total', 'AWS API calls rejected by throttling', ('service', 'operation'))
+        self._request_bytes = instrumentation.histogram(
+            'aws_request_bytes', 'AWS request payload size', ('service', 'operation'), buckets=SIZE_BUCKETS)
+        self._response_bytes = instrumentation.histogram(
+            'aws_response_bytes', 'AWS response payload size', ('service', 'operation'), buckets=SIZE_BUCKETS)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith(('get_paginator', 'get_waiter', 'can_paginate')):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            return self._call(name, attribute, args, kwargs)
+        return call
+
+    def _call(self, name, method, args, kwargs):
+        service = self._service_name
+        self._calls.inc(service=service, operation=name)
+        size = _payload_size(kwargs)
+        if size is not None:
+            self._request_bytes.observe(size, service=service, operation=name)
+        try:
+            with self._instrumentation.span(f"aws.{service}.{name}", service=service, operation=name):
+                result = method(*args, **kwargs)
+        except Exception as e:
+            self._errors.inc(service=service, operation=name, code=error_code(e) or type(e).__name__)
+            if is_throttling_error(e):
+                self._throttles.inc(service=service, operation=name)
+            raise
+        if isinstance(result, dict) and 'ContentLength' in result:
+            self._response_bytes.observe(result['ContentLength'], service=service, operation=name)
+        return result
+
+
+def instrument_client(client, service_name: str, instrumentation: Optional[Instrumentation]):
+    """
+    Wrap a client with InstrumentedClient, or return it unchanged when instrumentation is off
+    """
+    if instrumentation is None:
+        return client
+    return InstrumentedClient(client, service_name, instrumentation)
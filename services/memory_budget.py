@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from services.instrumentation import Instrumentation, LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Resident bytes per image byte while it is being reported: the raw object,
+# plus the base64 copy and the request body spliced from it
+IMAGE_MEMORY_FACTOR = 3.0
+
+# Reserved for objects whose size is not known before they are fetched
+DEFAULT_IMAGE_SIZE = 8 * 1024 * 1024
+
+
+def estimate_image_memory(size: Optional[int]) -> int:
+    """
+    Bytes to reserve for an image of the given object size
+
+    :param size: Object size in bytes (None if unknown)
+    :return: Reservation in bytes
+    """
+    return int((size if size else DEFAULT_IMAGE_SIZE) * IMAGE_MEMORY_FACTOR)
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes: int, instrumentation: Optional[Instrumentation] = None):
+        """
+        Process-wide cap on the bytes held by in-flight images
+
+        Images reserve their estimated footprint before they are downloaded
+        and give it back once their buffers are released. When the budget is
+        used up, reserve() blocks, which stalls the downloads and lets the
+        pipeline's bounded queues push back further up. Peak memory therefore
+        follows the budget, not the batch size.
+
+        A single reservation larger than the whole budget is granted once
+        nothing else is held, so an oversized image is processed alone
+        instead of waiting forever.
+
+        :param limit_bytes: Max bytes reserved at the same time
+        :param instrumentation: Optional metrics registry
+        """
+        if limit_bytes <= 0:
+            raise ValueError("Memory budget must be positive")
+        self.limit_bytes = limit_bytes
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._peak = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            self._in_use_metric = instrumentation.gauge(
+                'memory_budget_in_use_bytes', 'Bytes reserved by in-flight images')
+            instrumentation.gauge('memory_budget_limit_bytes', 'Configured memory budget').set(limit_bytes)
+            self._wait_metric = instrumentation.histogram(
+                'memory_budget_wait_seconds', 'Time downloads waited for memory', buckets=LATENCY_BUCKETS)
+
+    def reserve(self, size: int) -> int:
+        """
+        Block until size bytes fit in the budget, then take them
+
+        :param size: Bytes to reserve
+        :return: The reserved amount, to pass back to release()
+        """
+        size = max(0, int(size))
+        with self._condition:
+            if not self._fits(size):
+                start = time.perf_counter()
+                self._waits += 1
+                while not self._fits(size):
+                    self._condition.wait()
+                waited = time.perf_counter() - start
+                self._wait_seconds += waited
+                if self.instrumentation is not None:
+                    self._wait_metric.observe(waited)
+            self._take(size)
+        return size
+
+    def resize(self, reserved: int, size: int) -> int:
+        """
+        Correct a reservation once the real size is known; never blocks
+
+        The image is already in memory, so growing past the limit is allowed
+        and simply delays the next reservations.
+
+        :param reserved: Amount currently reserved
+        :param size: Amount that should be reserved
+        :return: The new reservation
+        """
+        size = max(0, int(size))
+        with self._condition:
+            self._in_use -= reserved
+            self._take(size)
+            if size < reserved:
+                self._condition.notify_all()
+        return size
+
+    def release(self, size: int) -> None:
+        if not size:
+            return
+        with self._condition:
+            self._in_use -= size
+            self._update_metric()
+            self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'limit_bytes': self.limit_bytes,
+                'in_use_bytes': self._in_use,
+                'peak_bytes': self._peak,
+                'waits': self._waits,
+                'wait_seconds': round(self._wait_seconds, 3)
+            }
+
+    def _fits(self, size: int) -> bool:
+        return self._in_use + size <= self.limit_bytes or self._in_use == 0
+
+    def _take(self, size: int) -> None:
+        self._in_use += size
+        self._peak = max(self._peak, self._in_use)
+        self._update_metric()
+
+    def _update_metric(self) -> None:
+        if self.instrumentation is not None:
+            self._in_use_metric.set(self._in_use)
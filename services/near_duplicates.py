@@ -0,0 +1,252 @@
+import io
+import logging
+import math
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it near-duplicate detection is disabled
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Max Hamming distance (out of 64 bits) for two photos to count as the same shot
+DEFAULT_THRESHOLD = 6
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_COSINES = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+
+def _grayscale(image_bytes: bytes, size: Tuple[int, int]) -> List[int]:
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # JPEG draft mode decodes at 1/2..1/8 scale, which is most of the speed-up
+        image.draft('L', (size[0] * 4, size[1] * 4))
+        image = ImageOps.exif_transpose(image).convert('L').resize(size, Image.BILINEAR)
+        return list(image.getdata())
+
+
+def dhash(image_bytes: bytes) -> int:
+    """
+    64-bit difference hash: sign of the horizontal gradient on a 9x8 thumbnail
+
+    Cheap and robust to scaling, re-compression and small exposure changes.
+    """
+    pixels = _grayscale(image_bytes, (9, 8))
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for column in range(8):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def phash(image_bytes: bytes) -> int:
+    """
+    64-bit perceptual hash: low-frequency DCT coefficients of a 32x32 thumbnail vs. their median
+
+    Slower than dhash but more tolerant of small crops and framing changes.
+    """
+    pixels = _grayscale(image_bytes, (_DCT_SIZE, _DCT_SIZE))
+    rows = [pixels[offset:offset + _DCT_SIZE] for offset in range(0, _DCT_SIZE * _DCT_SIZE, _DCT_SIZE)]
+    # Separable 2D DCT, keeping only the top-left 8x8 coefficients
+    row_dct = [[sum(c * p for c, p in zip(cosines, row)) for cosines in _DCT_COSINES] for row in rows]
+    coefficients = [
+        sum(c * row_dct[x][v] for x, c in enumerate(_DCT_COSINES[u]))
+        for u in range(_DCT_KEEP) for v in range(_DCT_KEEP)
+    ]
+    # The DC term only reflects overall brightness
+    median = sorted(coefficients[1:])[len(coefficients) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+HASH_FUNCTIONS = {'dhash': dhash, 'phash': phash}
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class MultiIndexHash:
+    def __init__(self, max_distance: int = DEFAULT_THRESHOLD, bits: int = 64, chunks: int = 4):
+        """
+        Index of 64-bit hashes answering Hamming-distance range queries
+
+        Multi-index hashing: each hash is split into chunks and every chunk
+        is indexed in its own table. If two hashes are within max_distance,
+        by pigeonhole at least one chunk differs in at most
+        max_distance // chunks bits, so a lookup probes only those few chunk
+        variants and verifies the candidates it finds. With 16-bit chunks the
+        buckets stay small at millions of entries, where a BK-tree degrades
+        towards a linear scan because random 64-bit hashes are all ~32 bits
+        apart.
+
+        :param max_distance: Largest distance that will be searched for
+        :param bits: Hash width
+        :param chunks: Number of chunks (and tables)
+        """
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._probes = self._flip_masks(self.chunk_bits, max_distance // chunks)
+        self._tables = [{} for _ in range(chunks)]
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _flip_masks(width: int, radius: int) -> List[int]:
+        masks = [0]
+        frontier = [(0, -1)]
+        for _ in range(radius):
+            frontier = [(mask | (1 << bit), bit) for mask, last in frontier for bit in range(last + 1, width)]
+            masks.extend(mask for mask, _ in frontier)
+        return masks
+
+    def _chunk_values(self, hash_value: int) -> List[int]:
+        return [(hash_value >> (index * self.chunk_bits)) & self._chunk_mask for index in range(self.chunks)]
+
+    def add(self, hash_value: int, value) -> list:
+        """
+        Insert an entry
+
+        :return: The entry; pass it to remove() to retire it
+        """
+        entry = [hash_value, value]
+        for table, chunk in zip(self._tables, self._chunk_values(hash_value)):
+            table.setdefault(chunk, []).append(entry)
+        self._size += 1
+        return entry
+
+    def remove(self, entry: list) -> None:
+        for table, chunk in zip(self._tables, self._chunk_values(entry[0])):
+            bucket = table.get(chunk, [])
+            # Entries are compared by identity: two images may share a hash
+            for position, candidate in enumerate(bucket):
+                if candidate is entry:
+                    del bucket[position]
+                    break
+            if not bucket:
+                table.pop(chunk, None)
+        self._size -= 1
+
+    def search(self, hash_value: int, max_distance: Optional[int] = None) -> List[Tuple[int, object]]:
+        """
+        All entries within max_distance (at most the index's max_distance) of hash_value
+
+        :return: List of (distance, value), closest first
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        seen = set()
+        matches = []
+        for table, chunk in zip(self._tables, self._chunk_values(hash_value)):
+            for mask in self._probes:
+                for entry in table.get(chunk ^ mask, ()):
+                    if id(entry) in seen:
+                        continue
+                    seen.add(id(entry))
+                    distance = hamming(hash_value, entry[0])
+                    if distance <= max_distance:
+                        matches.append((distance, entry[1]))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def nearest(self, hash_value: int, max_distance: Optional[int] = None) -> Optional[Tuple[int, object]]:
+        matches = self.search(hash_value, max_distance)
+        return matches[0] if matches else None
+
+
+class NearDuplicateDetector:
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD, method: str = 'dhash',
+                 group_by: Optional[Callable[[str], Hashable]] = None):
+        """
+        Finds photos that are near-duplicates of one already seen
+
+        The first image of a group of look-alikes becomes its representative;
+        later ones within threshold bits of it are linked to it instead of
+        being analysed again.
+
+        :param threshold: Max Hamming distance (0-64) to count as a duplicate; lower is stricter
+        :param method: 'dhash' or 'phash'
+        :param group_by: Optional function mapping a key to its scope (e.g. claim_id_from_key), so
+                         only images of the same claim are compared; default compares the whole batch
+        """
+        if method not in HASH_FUNCTIONS:
+            raise ValueError(f"Unknown perceptual hash '{method}'")
+        self.threshold = threshold
+        self.method = method
+        self.hash_function = HASH_FUNCTIONS[method]
+        self.group_by = group_by
+        self.available = Image is not None
+        if not self.available:
+            logger.warning("Pillow is not installed; near-duplicate detection is disabled")
+
+    def new_session(self) -> 'DuplicateSession':
+        """
+        Fresh index for one batch
+        """
+        return DuplicateSession(self)
+
+
+class DuplicateSession:
+    def __init__(self, detector: NearDuplicateDetector):
+        """
+        Index of the representatives seen in one batch, safe to share between threads
+        """
+        self.detector = detector
+        self._indexes: Dict[Hashable, MultiIndexHash] = {}
+        self._representatives: Dict[str, Tuple[MultiIndexHash, list]] = {}
+        self._lock = threading.Lock()
+
+    def check(self, key: str, image_bytes: bytes) -> Optional[Tuple[str, int]]:
+        """
+        Look an image up, registering it as a representative if nothing close is indexed
+
+        :param key: Object key of the image
+        :param image_bytes: Image bytes to hash
+        :return: (representative key, distance) if the image is a near-duplicate, otherwise None
+        """
+        detector = self.detector
+        if not detector.available:
+            return None
+        try:
+            hash_value = detector.hash_function(image_bytes)
+        except Exception as e:
+            # Undecodable images are simply analysed on their own
+            logger.debug(f"Could not hash {key}: {e}")
+            return None
+
+        group = detector.group_by(key) if detector.group_by else None
+        with self._lock:
+            index = self._indexes.get(group)
+            if index is None:
+                index = self._indexes[group] = MultiIndexHash(detector.threshold)
+            match = index.nearest(hash_value)
+            if match is None:
+                self._representatives[key] = (index, index.add(hash_value, key))
+                return None
+        distance, representative = match
+        return representative, distance
+
+    def is_representative(self, key: str) -> bool:
+        with self._lock:
+            return key in self._representatives
+
+    def forget(self, key: str) -> None:
+        """
+        Stop matching new images against a representative (its result is no longer kept)
+        """
+        with self._lock:
+            entry = self._representatives.pop(key, None)
+            if entry is not None:
+                entry[0].remove(entry[1])
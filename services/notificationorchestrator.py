@@ -1,47 +1,206 @@
-class NotificationOrchestrator:
-    def __init__(self, 
-                 aws_config,
-                 source_bucket: str, 
-                 processed_bucket: str,
-                 email_notification_service: EmailNotificationService = None):
-        """
-        Orchestrate image processing and notification workflow
-        
-        :param aws_config: AWS configuration object
-        :param source_bucket: Source bucket for images
-        :param processed_bucket: Processed bucket for reports
-        :param email_notification_service: Optional email notification service
-        """
-        self.multi_image_analyzer = MultiImageDamageAnalyzer(aws_config)
-        self.processed_bucket = processed_bucket
-        
-        # Use provided or create new email notification service
-        self.email_service = email_notification_service or EmailNotificationService()
-    
-    def process_and_notify(self, 
-                            customer_email: str, 
-                            source_bucket: str = None) -> List[Dict]:
-        """
-        Process images and send notifications
-        
-        :param customer_email: Email address to send notifications
-        :param source_bucket: Optional source bucket (uses class-level if not provided)
-        :return: List of processing results
-        """
-        source_bucket = source_bucket or self.multi_image_analyzer.source_bucket
-        
-        # Process images
-        results = self.multi_image_analyzer.process_images(
-            source_bucket, 
-            self.processed_bucket
-        )
-        
-        # Send notifications for each processed image
-        for result in results:
-            self.email_service.send_report_email(
-                recipient=customer_email, 
-                report_details=result,
-                processed_bucket=self.processed_bucket
-            )
-        
-        return results
\ No newline at end of file
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+from config.aws_config import AWSConfig
+from services.s3_service import S3Service
+from services.rekognition_service import RekognitionService
+from services.bedrock_service import BedrockService
+from services.emailnotificationservice import EmailNotificationService, MAX_RAW_MESSAGE_BYTES
+from services.pdfreportgenerator import PDFReportGenerator
+from services.rate_limiter import TokenBucket
+from services.instrumentation import Instrumentation, SIZE_BUCKETS
+from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
+
+logger = logging.getLogger(__name__)
+
+class NotificationOrchestrator:
+    def __init__(self, 
+                 aws_config: AWSConfig,
+                 source_bucket: str, 
+                 processed_bucket: str,
+                 email_notification_service: EmailNotificationService = None,
+                 pdf_generator: PDFReportGenerator = None,
+                 send_rate: float = 14.0,
+                 send_workers: int = 16,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Orchestrate image processing and notification workflow
+        
+        :param aws_config: AWS configuration object
+        :param source_bucket: Source bucket for images
+        :param processed_bucket: Processed bucket for reports
+        :param email_notification_service: Optional email notification service
+        :param pdf_generator: Optional PDF generator used to render attachments in memory
+        :param send_rate: SES maximum send rate (emails per second) of the account
+        :param send_workers: Emails in flight at the same time
+        :param instrumentation: Optional metrics registry (default: the one aws_config records into)
+        """
+        self.aws_config = aws_config
+        self.instrumentation = instrumentation or aws_config.instrumentation
+        self.source_bucket = source_bucket
+        self.processed_bucket = processed_bucket
+
+        # Components (and the clients they need) are built on first use, so a
+        # process that only analyses or only notifies never pays for the other
+        self._multi_image_analyzer = None
+        self._email_service = email_notification_service
+        self._pdf_generator = pdf_generator
+        self._components_lock = threading.Lock()
+        self.send_limiter = TokenBucket(send_rate)
+        self.send_workers = send_workers
+        if self.instrumentation is not None:
+            self._pdf_bytes = self.instrumentation.histogram(
+                'pdf_bytes', 'Size of rendered PDF reports', buckets=SIZE_BUCKETS
+            )
+            self._notifications = self.instrumentation.counter(
+                'notifications_total', 'Notification emails by kind and outcome', ('kind', 'result')
+            )
+    
+    @property
+    def multi_image_analyzer(self) -> MultiImageDamageAnalyzer:
+        if self._multi_image_analyzer is None:
+            with self._components_lock:
+                if self._multi_image_analyzer is None:
+                    # All services share the clients (and connection pools) of aws_config
+                    self._multi_image_analyzer = MultiImageDamageAnalyzer(
+                        s3_service=S3Service(self.aws_config.client('s3')),
+                        rekognition_service=RekognitionService(self.aws_config.client('rekognition')),
+                        bedrock_service=BedrockService(self.aws_config.client('bedrock'),
+                                                       instrumentation=self.instrumentation),
+                        instrumentation=self.instrumentation
+                    )
+        return self._multi_image_analyzer
+
+    @property
+    def email_service(self) -> EmailNotificationService:
+        if self._email_service is None:
+            with self._components_lock:
+                if self._email_service is None:
+                    self._email_service = EmailNotificationService(
+                        ses_client=self.aws_config.client('ses'),
+                        s3_client=self.aws_config.client('s3')
+                    )
+        return self._email_service
+
+    @property
+    def pdf_generator(self) -> PDFReportGenerator:
+        if self._pdf_generator is None:
+            with self._components_lock:
+                if self._pdf_generator is None:
+                    self._pdf_generator = PDFReportGenerator(s3_client=self.aws_config.client('s3'))
+        return self._pdf_generator
+
+    def process_and_notify(self, 
+                            customer_email: str, 
+                            source_bucket: str = None,
+                            digest: bool = False,
+                            upload_pdfs: bool = True) -> List[Dict]:
+        """
+        Process images and send notifications
+        
+        :param customer_email: Email address to send notifications
+        :param source_bucket: Optional source bucket (uses class-level if not provided)
+        :param digest: Send one digest email instead of one email per image
+        :param upload_pdfs: Also store the rendered PDFs in the processed bucket
+        :return: List of processing results
+        """
+        source_bucket = source_bucket or self.source_bucket
+        
+        # Process images
+        results = self.multi_image_analyzer.process_images(
+            source_bucket, 
+            self.processed_bucket
+        )
+
+        self.notify({customer_email: results}, digest=digest, upload_pdfs=upload_pdfs)
+        return results
+
+    def notify(self,
+               results_by_recipient: Dict[str, List[Dict]],
+               digest: bool = False,
+               upload_pdfs: bool = True) -> Dict[str, int]:
+        """
+        Render PDFs once and deliver them, concurrently and within the SES send rate
+
+        PDFs are attached from memory, so nothing is read back from S3. A PDF
+        that fails to upload is still attached; if rendering fails, that
+        recipient's emails go out without attachments rather than not at all.
+
+        :param results_by_recipient: Mapping of email address to the results it should receive
+        :param digest: Send one digest per recipient instead of one email per result
+        :param upload_pdfs: Also store the rendered PDFs in the processed bucket
+        :return: Dictionary with 'sent' and 'failed' email counts
+        """
+        jobs = []
+        for recipient, results in results_by_recipient.items():
+            if not results:
+                continue
+            try:
+                with self._span('notify.render', recipient=recipient, reports=len(results)):
+                    documents = self.pdf_generator.generate_damage_report_pdfs(
+                        results, self.processed_bucket if upload_pdfs else None
+                    )
+            except Exception as e:
+                logger.error(f"Error rendering PDFs for {recipient}, sending without attachments: {e}")
+                documents = None
+            if documents is None:
+                attachments = [None] * len(results)
+            else:
+                if self.instrumentation is not None:
+                    for document in documents:
+                        self._pdf_bytes.observe(len(document['pdf_bytes']))
+                attachments = [(self._pdf_filename(document), document['pdf_bytes']) for document in documents]
+            if digest:
+                jobs.append((self._send_digest, recipient, results, attachments))
+            else:
+                jobs.extend(
+                    (self._send_single, recipient, result, attachment)
+                    for result, attachment in zip(results, attachments)
+                )
+
+        with ThreadPoolExecutor(max_workers=self.send_workers, thread_name_prefix='notify') as executor:
+            outcomes = list(executor.map(lambda job: job[0](*job[1:]), jobs))
+
+        counts = {'sent': outcomes.count(True), 'failed': outcomes.count(False)}
+        logger.info(f"Notifications: {counts}")
+        return counts
+
+    def _send_single(self, recipient: str, result: Dict, attachment) -> bool:
+        self.send_limiter.acquire()
+        with self._span('notify.send', recipient=recipient, kind='single'):
+            sent = self.email_service.send_report_email(
+                recipient=recipient,
+                report_details=result,
+                pdf_bytes=attachment[1] if attachment else None,
+                pdf_filename=attachment[0] if attachment else None
+            )
+        self._record_notification('single', sent)
+        return sent
+
+    def _send_digest(self, recipient: str, results: List[Dict], attachments) -> bool:
+        # A digest may be split into several emails; charge the limiter for each
+        attached = sum(len(attachment[1]) for attachment in attachments if attachment)
+        emails = attached * 4 // 3 // MAX_RAW_MESSAGE_BYTES + 1
+        self.send_limiter.acquire(emails)
+        with self._span('notify.send', recipient=recipient, kind='digest'):
+            sent = self.email_service.send_digest_email(recipient, results, attachments)
+        self._record_notification('digest', sent)
+        return sent
+
+    def _span(self, name: str, **attributes):
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.span(name, **attributes)
+
+    def _record_notification(self, kind: str, sent: bool) -> None:
+        if self.instrumentation is not None:
+            self._notifications.inc(kind=kind, result='sent' if sent else 'failed')
+
+    @staticmethod
+    def _pdf_filename(document: Dict) -> str:
+        if document['report_key']:
+            return document['report_key'].split('/')[-1]
+        source_key = document['report'].get('source_key') or document['report'].get('moved_image_key', 'report')
+        return f"{source_key.split('/')[-1]}.pdf"
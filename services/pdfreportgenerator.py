@@ -1,67 +1,305 @@
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-import boto3
-
-class PDFReportGenerator:
-    def __init__(self, s3_client=None):
-        """
-        Initialize PDF Report Generator
-        
-        :param s3_client: Optional S3 client for report storage
-        """
-        self.s3_client = s3_client or boto3.client('s3')
-        self.styles = getSampleStyleSheet()
-    
-    def generate_damage_report_pdf(self, 
-                                    report_details: dict, 
-                                    output_bucket: str = None) -> str:
-        """
-        Generate a PDF report from damage analysis details
-        
-        :param report_details: Dictionary containing damage report information
-        :param output_bucket: Optional S3 bucket to store the PDF
-        :return: PDF file key or local file path
-        """
-        # Create an in-memory PDF buffer
-        buffer = io.BytesIO()
-        
-        # Create PDF document
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        story = []
-        
-        # Add title
-        title = Paragraph(f"Damage Analysis Report: {report_details.get('moved_image_key', 'Unnamed Image')}", 
-                          self.styles['Title'])
-        story.append(title)
-        story.append(Spacer(1, 12))
-        
-        # Add damage labels
-        labels_text = "Damage Labels: " + ", ".join(report_details.get('damage_labels', ['No labels detected']))
-        story.append(Paragraph(labels_text, self.styles['Heading2']))
-        story.append(Spacer(1, 12))
-        
-        # Add detailed report
-        report_content = report_details.get('report', 'No detailed report available')
-        story.append(Paragraph(report_content, self.styles['Normal']))
-        
-        # Build PDF
-        doc.build(story)
-        
-        # Reset buffer position
-        buffer.seek(0)
-        
-        # Optional S3 upload
-        if output_bucket:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            file_key = f"reports/{report_details.get('moved_image_key', 'report')}_{timestamp}.pdf"
-            
-            self.s3_client.put_object(
-                Bucket=output_bucket,
-                Key=file_key,
-                Body=buffer.getvalue()
-            )
-            return file_key
-        
-        return buffer
\ No newline at end of file
+import io
+import logging
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# reportlab (and boto3 for the fallback client) are imported on first use, so importing
+# this module stays cheap for processes that never render a PDF
+
+# Built once per process and reused for every PDF rendered there
+_STYLES = None
+_STYLES_LOCK = threading.Lock()
+
+# Page margins shared by every document
+_MARGINS = {
+    'leftMargin': 72,
+    'rightMargin': 72,
+    'topMargin': 72,
+    'bottomMargin': 72
+}
+
+
+def _get_styles():
+    global _STYLES
+    if _STYLES is None:
+        with _STYLES_LOCK:
+            if _STYLES is None:
+                from reportlab.lib.styles import getSampleStyleSheet
+                _STYLES = getSampleStyleSheet()
+    return _STYLES
+
+
+def _document(buffer):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate
+    return SimpleDocTemplate(buffer, pagesize=letter, **_MARGINS)
+
+
+def _image_name(report_details: dict) -> str:
+    return report_details.get('moved_image_key') or report_details.get('source_key') or 'Unnamed Image'
+
+
+def _label_names(damage_labels) -> List[str]:
+    # Analyzer results carry Rekognition label dicts; older callers pass plain names
+    return [label['Name'] if isinstance(label, dict) else str(label) for label in damage_labels]
+
+
+def _paragraph_text(text: str) -> str:
+    # Paragraph parses its input as markup, so model output must be escaped
+    return escape(text).replace('\n', '<br/>')
+
+
+def _report_story(report_details: dict, styles) -> list:
+    from reportlab.platypus import Paragraph, Spacer
+    story = []
+
+    # Add title
+    title = Paragraph(_paragraph_text(f"Damage Analysis Report: {_image_name(report_details)}"),
+                      styles['Title'])
+    story.append(title)
+    story.append(Spacer(1, 12))
+
+    # Add damage labels
+    label_names = _label_names(report_details.get('damage_labels') or []) or ['No labels detected']
+    labels_text = "Damage Labels: " + ", ".join(label_names)
+    story.append(Paragraph(_paragraph_text(labels_text), styles['Heading2']))
+    story.append(Spacer(1, 12))
+
+    # Add detailed report
+    report_content = report_details.get('report', 'No detailed report available')
+    story.append(Paragraph(_paragraph_text(report_content), styles['Normal']))
+    return story
+
+
+def render_report_pdf(report_details: dict) -> bytes:
+    """
+    Render a single damage report to PDF bytes
+
+    Module-level so it can run in a worker process.
+
+    :param report_details: Dictionary containing damage report information
+    :return: PDF bytes
+    """
+    buffer = io.BytesIO()
+    _document(buffer).build(_report_story(report_details, _get_styles()))
+    return buffer.getvalue()
+
+
+def render_claim_pdf(claim_id: str, reports: List[dict], summary: Optional[str] = None) -> bytes:
+    """
+    Render one consolidated PDF for all images of a claim
+
+    :param claim_id: Claim identifier shown on the cover page
+    :param reports: Per-image report dictionaries, one section each
+    :param summary: Optional claim-level summary
+    :return: PDF bytes
+    """
+    from reportlab.platypus import Paragraph, Spacer, PageBreak
+    styles = _get_styles()
+    story = [
+        Paragraph(_paragraph_text(f"Claim Damage Report: {claim_id or 'Unnamed Claim'}"), styles['Title']),
+        Spacer(1, 12),
+        Paragraph(_paragraph_text(f"Images: {len(reports)}"), styles['Heading2'])
+    ]
+    if summary:
+        story.append(Spacer(1, 12))
+        story.append(Paragraph(_paragraph_text(summary), styles['Normal']))
+
+    for report_details in reports:
+        story.append(PageBreak())
+        story.extend(_report_story(report_details, styles))
+
+    buffer = io.BytesIO()
+    _document(buffer).build(story)
+    return buffer.getvalue()
+
+
+def _render_claim_args(args) -> bytes:
+    return render_claim_pdf(*args)
+
+
+class PDFReportGenerator:
+    def __init__(self, s3_client=None, max_workers: Optional[int] = None,
+                 upload_workers: int = 16, executor: Optional[Executor] = None):
+        """
+        Initialize PDF Report Generator
+
+        :param s3_client: Optional S3 client for report storage (e.g. AWSConfig.client('s3'))
+        :param max_workers: Process pool size for batch rendering (default: CPU count)
+        :param upload_workers: Threads uploading finished PDFs
+        :param executor: Optional pre-built executor to render on instead of a private process pool
+        """
+        self._s3_client = s3_client
+        self.upload_workers = upload_workers
+        self._max_workers = max_workers
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._executor_lock = threading.Lock()
+        self._client_lock = threading.Lock()
+
+    @property
+    def s3_client(self):
+        # The fallback client is only created when a PDF is actually uploaded
+        if self._s3_client is None:
+            with self._client_lock:
+                if self._s3_client is None:
+                    import boto3
+                    self._s3_client = boto3.client('s3')
+        return self._s3_client
+
+    @property
+    def styles(self):
+        return _get_styles()
+
+    def generate_damage_report_pdf(self,
+                                    report_details: dict,
+                                    output_bucket: str = None) -> str:
+        """
+        Generate a PDF report from damage analysis details
+
+        :param report_details: Dictionary containing damage report information
+        :param output_bucket: Optional S3 bucket to store the PDF
+        :return: PDF file key or local file path
+        """
+        # Create an in-memory PDF buffer
+        buffer = io.BytesIO()
+
+        # Build PDF
+        _document(buffer).build(_report_story(report_details, self.styles))
+
+        # Reset buffer position
+        buffer.seek(0)
+
+        # Optional S3 upload
+        if output_bucket:
+            file_key = self._report_key(report_details)
+
+            # Bytes, not the buffer: a retried request would resend from the stream's
+            # current position and could upload a truncated or empty PDF
+            self.s3_client.put_object(
+                Bucket=output_bucket,
+                Key=file_key,
+                Body=buffer.getvalue()
+            )
+            return file_key
+
+        return buffer
+
+    def render_pdfs(self, reports: List[dict]) -> List[bytes]:
+        """
+        Render many reports in parallel on the process pool
+
+        :param reports: Report dictionaries
+        :return: PDF bytes, in the same order as reports
+        """
+        if not reports:
+            return []
+        chunksize = max(1, len(reports) // ((self._max_workers or 4) * 4))
+        return list(self._get_executor().map(render_report_pdf, reports, chunksize=chunksize))
+
+    def generate_damage_report_pdfs(self,
+                                    reports: List[dict],
+                                    output_bucket: str = None,
+                                    consolidate_by: Optional[Callable[[dict], str]] = None) -> List[Dict]:
+        """
+        Batch variant of generate_damage_report_pdf
+
+        Rendering runs on the process pool; finished PDFs go straight to the
+        upload threads as the bytes returned by the worker, without another copy.
+
+        :param reports: Report dictionaries (e.g. analyzer results)
+        :param output_bucket: Optional S3 bucket to store the PDFs
+        :param consolidate_by: Optional function mapping a report to its claim id; produces
+                               one multi-image PDF per claim instead of one PDF per image
+        :return: One dict per PDF with 'pdf_bytes', 'report_key' (None if not uploaded or the
+                 upload failed) and
+                 either 'report' (the source report) or 'claim_id' and 'reports'
+        """
+        if consolidate_by is None:
+            documents = [{'report': report} for report in reports]
+            pdfs = self.render_pdfs(reports)
+        else:
+            claims = {}
+            for report in reports:
+                claims.setdefault(consolidate_by(report), []).append(report)
+            documents = [{'claim_id': claim_id, 'reports': claim_reports} for claim_id, claim_reports in claims.items()]
+            pdfs = list(self._get_executor().map(
+                _render_claim_args, [(claim_id, claim_reports, None) for claim_id, claim_reports in claims.items()]
+            ))
+
+        for document, pdf_bytes in zip(documents, pdfs):
+            document['pdf_bytes'] = pdf_bytes
+            document['report_key'] = None
+
+        if output_bucket:
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as uploader:
+                list(uploader.map(lambda document: self._upload(document, output_bucket), documents))
+
+        return documents
+
+    def generate_claim_report_pdf(self, claim_id: str, reports: List[dict],
+                                  output_bucket: str = None, summary: Optional[str] = None):
+        """
+        Generate one consolidated PDF covering every image of a claim
+
+        :param claim_id: Claim identifier
+        :param reports: Per-image report dictionaries
+        :param output_bucket: Optional S3 bucket to store the PDF
+        :param summary: Optional claim-level summary for the cover page
+        :return: PDF file key if uploaded (None if the upload failed), otherwise the PDF bytes
+        """
+        pdf_bytes = render_claim_pdf(claim_id, reports, summary)
+        if output_bucket:
+            document = {'claim_id': claim_id, 'pdf_bytes': pdf_bytes}
+            self._upload(document, output_bucket)
+            return document['report_key']
+        return pdf_bytes
+
+    def close(self) -> None:
+        with self._executor_lock:
+            if self._owns_executor and self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _upload(self, document: Dict, output_bucket: str) -> None:
+        if 'claim_id' in document:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            file_key = f"reports/claims/{(document['claim_id'] or 'root').replace('/', '_')}_{timestamp}.pdf"
+        else:
+            file_key = self._report_key(document['report'])
+        # A failed upload only affects its own document; the PDF bytes are still returned
+        try:
+            self.s3_client.put_object(
+                Bucket=output_bucket,
+                Key=file_key,
+                Body=document['pdf_bytes'],
+                ContentType='application/pdf'
+            )
+        except Exception as e:
+            logger.error(f"Error uploading PDF report {output_bucket}/{file_key}: {e}")
+            document['report_key'] = None
+            return
+        document['report_key'] = file_key
+
+    @staticmethod
+    def _report_key(report_details: dict) -> str:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return f"reports/{report_details.get('moved_image_key') or report_details.get('source_key', 'report')}_{timestamp}.pdf"
+
+    def _get_executor(self) -> Executor:
+        with self._executor_lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # The pool is created lazily from whichever thread asks first; forking a process
+                # with other threads running can copy held locks into the children, so start
+                # workers from a clean server process (spawn where forkserver is unavailable)
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self._max_workers, mp_context=context)
+            return self._executor
@@ -0,0 +1,450 @@
+import functools
+import logging
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'SlowDown',
+    'RequestThrottled',
+    'Throttled'
+}
+
+TRANSIENT_ERROR_CODES = {
+    'InternalError',
+    'InternalFailure',
+    'InternalServerError',
+    'InternalServerException',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+    'RequestTimeout',
+    'RequestTimeoutException'
+}
+
+# Connection-level failures from botocore/urllib3, matched by name to avoid importing botocore
+TRANSIENT_EXCEPTION_NAMES = {
+    'EndpointConnectionError',
+    'ConnectionClosedError',
+    'ReadTimeoutError',
+    'ConnectTimeoutError'
+}
+
+# Requests/sec per client, plus tokens/min for Bedrock. These are placeholders, not
+# AWS defaults: the Bedrock tokens/min entry in particular allows only ~1.5 image
+# reports per second. Pass the account's quotas as AWSConfig(rate_limits=...) overrides.
+DEFAULT_LIMITS = {
+    's3': {'requests_per_second': 3000.0},
+    'rekognition': {'requests_per_second': 50.0},
+    'bedrock-runtime': {'requests_per_second': 8.0, 'tokens_per_minute': 200000.0},
+    'ses': {'requests_per_second': 14.0},
+    'sqs': {'requests_per_second': 300.0}
+}
+
+# Rough Bedrock token costs used to charge the tokens/min bucket before a call
+IMAGE_TOKEN_ESTIMATE = 1600
+PROMPT_TOKEN_ESTIMATE = 400
+
+_MAX_TOKENS_PATTERN = re.compile(rb'"max_tokens":\s*(\d+)')
+
+
+def error_code(error: Exception) -> Optional[str]:
+    """
+    Extract the AWS error code from a botocore ClientError (or anything shaped like one)
+    """
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error: Exception) -> bool:
+    return (
+        is_throttling_error(error)
+        or error_code(error) in TRANSIENT_ERROR_CODES
+        or type(error).__name__ in TRANSIENT_EXCEPTION_NAMES
+    )
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Thread-safe token bucket
+
+        Callers reserve tokens under the lock and then sleep outside it, so
+        the same bucket can be shared by threads and asyncio tasks.
+
+        :param rate: Tokens added per second
+        :param capacity: Max burst size (default: one second worth of tokens)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        Take tokens, going into debt if needed
+
+        :param amount: Tokens to take
+        :return: Seconds the caller must wait before proceeding
+        """
+        with self._lock:
+            self._refill()
+            # A single request larger than the bucket must still be able to run
+            amount = min(amount, self.capacity)
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, amount: float = 1.0) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, amount: float = 1.0) -> None:
+        # Imported here so synchronous processes don't load asyncio at startup
+        import asyncio
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class AdaptiveRateLimiter:
+    def __init__(self,
+                 requests_per_second: float,
+                 tokens_per_minute: Optional[float] = None,
+                 min_rate: Optional[float] = None,
+                 increase_per_second: Optional[float] = None,
+                 decrease_factor: float = 0.5,
+                 cooldown_seconds: float = 1.0):
+        """
+        Per-service limiter that adapts its request rate AIMD-style
+
+        Every success adds a little to the rate (up to the configured quota);
+        a throttling response halves it. Decreases are spaced by a cooldown so
+        a burst of throttles from concurrent workers only counts once.
+
+        :param requests_per_second: Quota ceiling for requests
+        :param tokens_per_minute: Optional model token quota (Bedrock)
+        :param min_rate: Floor for the adapted rate (default: 5% of the ceiling)
+        :param increase_per_second: Additive increase per second of successes (default: 5% of the ceiling)
+        :param decrease_factor: Multiplier applied on throttling
+        :param cooldown_seconds: Minimum time between two decreases
+        """
+        self.max_rate = float(requests_per_second)
+        self.min_rate = float(min_rate if min_rate is not None else max(self.max_rate * 0.05, 0.1))
+        self.increase_per_second = float(increase_per_second if increase_per_second is not None else self.max_rate * 0.05)
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.requests = TokenBucket(self.max_rate)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, capacity=tokens_per_minute) if tokens_per_minute else None
+        self._rate = self.max_rate
+        self._last_decrease = 0.0
+        self._last_increase = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'throttles': 0, 'retries': 0, 'errors': 0}
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def acquire(self, tokens: float = 0.0) -> None:
+        self.requests.acquire()
+        if self.tokens is not None and tokens:
+            self.tokens.acquire(tokens)
+
+    async def acquire_async(self, tokens: float = 0.0) -> None:
+        await self.requests.acquire_async()
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire_async(tokens)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._stats['calls'] += 1
+            now = time.monotonic()
+            if self._rate < self.max_rate:
+                self._rate = min(self.max_rate, self._rate + (now - self._last_increase) * self.increase_per_second)
+                self.requests.set_rate(self._rate)
+            self._last_increase = now
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._stats['throttles'] += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown_seconds:
+                return
+            self._last_decrease = now
+            self._last_increase = now
+            self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+            self.requests.set_rate(self._rate)
+            logger.info(f"Throttled; lowering request rate to {self._rate:.2f}/s")
+
+    def record(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['rate'] = self._rate
+            return stats
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, capacity: float = 100.0):
+        """
+        Global cap on retries, shared by every wrapped client
+
+        Each successful call earns `ratio` retry credits and each retry spends
+        one, so under a sustained outage retries stay a small fraction of
+        traffic instead of multiplying it.
+
+        :param ratio: Retry credits earned per successful call
+        :param min_per_second: Credits earned per second regardless of traffic
+        :param capacity: Max credits that can be banked
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._credits = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._credits = min(self.capacity, self._credits + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._credits = min(self.capacity, self._credits + (now - self._updated) * self.min_per_second)
+            self._updated = now
+            if self._credits < 1.0:
+                return False
+            self._credits -= 1.0
+            return True
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.2, max_delay: float = 20.0,
+                 budget: Optional[RetryBudget] = None):
+        """
+        Jittered exponential backoff
+
+        :param max_attempts: Total attempts per call, including the first
+        :param base_delay: Backoff ceiling for the first retry, in seconds
+        :param max_delay: Largest backoff ceiling, in seconds
+        :param budget: Shared retry budget (default: a new one)
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+
+    def delay(self, attempt: int) -> float:
+        # "Full jitter": uniform between zero and the exponential ceiling
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        return (
+            attempt + 1 < self.max_attempts
+            and is_retryable_error(error)
+            and self.budget.withdraw()
+        )
+
+
+def estimate_bedrock_tokens(kwargs: Dict) -> float:
+    """
+    Estimate the model tokens an invoke_model call will consume
+
+    :param kwargs: Keyword arguments of the invoke_model call
+    :return: Estimated input plus maximum output tokens
+    """
+    body = kwargs.get('body', b'')
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    # Scanned as bytes: decoding would copy a request body that can be megabytes of base64
+    match = _MAX_TOKENS_PATTERN.search(body)
+    max_tokens = int(match.group(1)) if match else 0
+    images = body.count(b'"type": "image"')
+    return IMAGE_TOKEN_ESTIMATE * images + PROMPT_TOKEN_ESTIMATE + max_tokens
+
+
+class RateLimitedClient:
+    def __init__(self, client, limiter: AdaptiveRateLimiter, retry_policy: RetryPolicy,
+                 token_cost: Optional[Callable[[str, Dict], float]] = None, instrumentation=None):
+        """
+        Drop-in wrapper around a boto3 client
+
+        Every API call first waits on the service limiter, then retries
+        throttling and transient errors with jittered backoff while the shared
+        retry budget allows. Non-callable attributes pass straight through.
+
+        :param client: boto3 client to wrap
+        :param limiter: Limiter for this service
+        :param retry_policy: Backoff policy (its budget may be shared across clients)
+        :param token_cost: Optional function (operation, kwargs) -> model tokens to charge
+        :param instrumentation: Optional Instrumentation registry that counts retries
+        """
+        self._client = client
+        self._limiter = limiter
+        self._retry_policy = retry_policy
+        self._token_cost = token_cost
+        self._retries = None
+        if instrumentation is not None:
+            self._retries = instrumentation.counter('aws_retries_total', 'AWS API calls retried', ('service', 'operation'))
+            self._service_name = client.meta.service_model.service_name if hasattr(client, 'meta') else ''
+
+    @property
+    def limiter(self) -> AdaptiveRateLimiter:
+        return self._limiter
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self._retry_policy
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        # Paginators/waiters make their own calls; only plain API methods are wrapped
+        if not callable(attribute) or name.startswith(('get_paginator', 'get_waiter', 'can_paginate')):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            return self._call(name, attribute, args, kwargs)
+        return call
+
+    def _call(self, name, method, args, kwargs):
+        tokens = self._token_cost(name, kwargs) if self._token_cost else 0.0
+        attempt = 0
+        while True:
+            self._limiter.acquire(tokens)
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                if is_throttling_error(e):
+                    self._limiter.on_throttle()
+                if not self._retry_policy.should_retry(e, attempt):
+                    self._limiter.record('errors')
+                    raise
+                self._record_retry(name)
+                delay = self._retry_policy.delay(attempt)
+                logger.warning(f"{name} failed ({error_code(e) or type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._limiter.on_success()
+            self._retry_policy.budget.deposit()
+            return result
+
+    def _record_retry(self, name: str) -> None:
+        self._limiter.record('retries')
+        if self._retries is not None:
+            self._retries.inc(service=self._service_name, operation=name)
+
+    async def call_async(self, name: str, **kwargs):
+        """
+        Call an API method from asyncio code without blocking the event loop
+
+        Waiting on the limiter and backoff happens on the loop; the blocking
+        boto3 call itself runs in the default executor.
+        """
+        import asyncio
+        method = getattr(self._client, name)
+        tokens = self._token_cost(name, kwargs) if self._token_cost else 0.0
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            await self._limiter.acquire_async(tokens)
+            try:
+                result = await loop.run_in_executor(None, functools.partial(method, **kwargs))
+            except Exception as e:
+                if is_throttling_error(e):
+                    self._limiter.on_throttle()
+                if not self._retry_policy.should_retry(e, attempt):
+                    self._limiter.record('errors')
+                    raise
+                self._record_retry(name)
+                await asyncio.sleep(self._retry_policy.delay(attempt))
+                attempt += 1
+                continue
+            self._limiter.on_success()
+            self._retry_policy.budget.deposit()
+            return result
+
+
+def _bedrock_token_cost(name: str, kwargs: Dict) -> float:
+    if name in ('invoke_model', 'invoke_model_with_response_stream'):
+        return estimate_bedrock_tokens(kwargs)
+    return 0.0
+
+
+def rate_limit_client(client, service_name: str, retry_policy: RetryPolicy,
+                      limits: Optional[Dict] = None, instrumentation=None) -> RateLimitedClient:
+    """
+    Wrap one boto3 client with a limiter sized for its service
+
+    :param client: boto3 client to wrap
+    :param service_name: boto3 service name, e.g. 'bedrock-runtime'
+    :param retry_policy: Retry policy shared with the other clients
+    :param limits: Optional overrides of DEFAULT_LIMITS for this service
+    :param instrumentation: Optional Instrumentation registry that counts retries
+    :return: RateLimitedClient
+    """
+    service_limits = dict(DEFAULT_LIMITS.get(service_name, {'requests_per_second': 50.0}))
+    service_limits.update(limits or {})
+    return RateLimitedClient(
+        client,
+        AdaptiveRateLimiter(**service_limits),
+        retry_policy,
+        token_cost=_bedrock_token_cost if service_name == 'bedrock-runtime' else None,
+        instrumentation=instrumentation
+    )
+
+
+def wrap_clients(clients: Dict, limits: Optional[Dict[str, Dict]] = None,
+                 retry_policy: Optional[RetryPolicy] = None, instrumentation=None) -> Dict:
+    """
+    Wrap a dict of boto3 clients with per-service limiters and one shared retry policy
+
+    :param clients: Mapping such as the one returned by AWSConfig.get_client()
+    :param limits: Optional per-service overrides of DEFAULT_LIMITS, keyed by boto3 service name
+    :param retry_policy: Optional retry policy (its budget is shared by all clients)
+    :param instrumentation: Optional Instrumentation registry that counts retries
+    :return: Mapping with the same keys and wrapped clients
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    wrapped = {}
+    for name, client in clients.items():
+        service_name = client.meta.service_model.service_name if hasattr(client, 'meta') else name
+        wrapped[name] = rate_limit_client(
+            client, service_name, retry_policy, (limits or {}).get(service_name), instrumentation
+        )
+    return wrapped
@@ -1,51 +1,72 @@
-from typing import List,Dict,Union 
-import logging 
-from datetime import datetime 
-logger = logging.getLogger(__name__) 
-
-class RekognitionService: 
-    def __init__(self, rekognition_client):  
-        self.client = rekognition_client  
-        self.damage_keywords = [
-                                    # Physical damage
-                                    'damage', 'crack', 'scratch', 'dent', 'broken', 'chip', 'split', 'tear', 
-                                    'puncture', 'gouge', 'rupture', 'fissure', 'fracture', 'destroyed',
-                                    
-                                    # Surface-specific damage
-                                    'rust', 'corrosion', 'wear', 'deterioration', 'degradation', 'erosion', 
-                                    'stain', 'discoloration', 'peeling', 'chipped paint', 'surface damage',
-                                    
-                                    # Structural damage
-                                    'deformation', 'warped', 'bent', 'misaligned', 'collapsed', 'buckled', 
-                                    'twisted', 'structural failure', 'compromised',
-                                    
-                                    # Material-specific damage
-                                    'shattered', 'cracked glass', 'metal fatigue', 'material failure', 
-                                    'structural weakness', 'fragmented',
-                                    
-                                    # Contextual damage indicators
-                                    'impact', 'collision', 'accident', 'trauma', 'stress', 'strain', 
-                                    'mechanical failure', 'structural compromise'
-        ]
-
-    def detect_damage(self, image: Union[Dict, bytes], source_type: str = 's3') -> List[Dict]: 
-        """  Detect damage using Rekognition  :param image: Image source (S3 object reference or image bytes)  :param source_type: 's3' or 'bytes'  :return: List of damage-related labels  """ 
-        try: # Prepare image reference based on source type 
-            if source_type == 's3':  
-                image_reference = {'S3Object': image} 
-            elif source_type == 'bytes':  
-                image_reference = {'Bytes': image} 
-            else: 
-                raise ValueError("Invalid source type. Use 's3' or 'bytes'.")  
-            
-            response = self.client.detect_labels(  
-                Image=image_reference,  MaxLabels=10,  MinConfidence=70.0 
-            ) 
-            
-            return [  
-                label for label in response['Labels'] 
-                if any(keyword in label['Name'].lower() for keyword in self.damage_keywords) 
-            ] 
-        except Exception as e:
-            logger.error(f"Rekognition error: {e}") 
+from typing import List,Dict,Union,Optional 
+import json 
+import logging 
+from datetime import datetime 
+from services.report_cache import ReportCache, hash_image 
+from services.damage_taxonomy import DamageTaxonomy 
+logger = logging.getLogger(__name__) 
+
+# detect_labels rejects inline image bytes above 5 MB; larger images must go by S3 reference
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+class RekognitionService: 
+    def __init__(self, rekognition_client, cache: Optional[ReportCache] = None, 
+                 taxonomy: Optional[DamageTaxonomy] = None, max_labels: int = 10, min_confidence: float = 70.0):  
+        """  Initialize RekognitionService  :param cache: Optional label cache  :param taxonomy: Damage vocabulary deciding which labels are kept (default: the built-in one)  :param max_labels: MaxLabels sent to detect_labels  :param min_confidence: MinConfidence sent to detect_labels  """ 
+        self.client = rekognition_client  
+        self.cache = cache
+        self.max_labels = max_labels
+        self.min_confidence = min_confidence
+        self.taxonomy = taxonomy or DamageTaxonomy()
+
+    def detect_damage(self, image: Union[Dict, bytes], source_type: str = 's3', image_hash: Optional[str] = None) -> List[Dict]: 
+        """  Detect damage using Rekognition  :param image: Image source (S3 object reference or image bytes)  :param source_type: 's3' or 'bytes'  :param image_hash: Content hash of the image, enables the label cache  :return: List of damage-related labels  """ 
+        cache_key = None
+        if self.cache is not None and image_hash is None and source_type == 'bytes':
+            image_hash = hash_image(image)
+        if self.cache is not None and image_hash:
+            cache_key = ReportCache.make_key(
+                'rekognition',
+                image_hash=image_hash,
+                taxonomy=self.taxonomy.fingerprint,
+                max_labels=self.max_labels,
+                min_confidence=self.min_confidence
+            )
+            cached_labels = self.cache.get(cache_key)
+            if cached_labels is not None:
+                return json.loads(cached_labels)
+
+        damage_labels = self._detect(image, source_type)
+        if cache_key is not None:
+            self.cache.set(cache_key, json.dumps(damage_labels))
+        return damage_labels
+
+    def detect_damage_for_object(self, bucket: str, key: str, image_bytes: Optional[bytes] = None, 
+                                 image_hash: Optional[str] = None) -> List[Dict]: 
+        """  Detect damage for an S3 object, reusing already-downloaded bytes when Rekognition accepts them  :param bucket: Bucket holding the image  :param key: Key of the image  :param image_bytes: Bytes already fetched from S3, if any  :param image_hash: Content hash of the image, enables the label cache  :return: List of damage-related labels  """ 
+        if image_bytes is not None and len(image_bytes) <= MAX_IMAGE_BYTES: 
+            return self.detect_damage(image_bytes, source_type='bytes', image_hash=image_hash) 
+        # Too large to send inline (or not fetched): let Rekognition read it from S3 
+        return self.detect_damage({'Bucket': bucket, 'Name': key}, source_type='s3', image_hash=image_hash) 
+
+    def classify_responses(self, responses: List[Dict]) -> List[Dict]: 
+        """  Classify a batch of detect_labels responses in one pass  :param responses: detect_labels responses (or their 'Labels' lists)  :return: Per-response damage labels and severity scores, see DamageTaxonomy.classify  """ 
+        return self.taxonomy.classify(responses) 
+
+    def _detect(self, image: Union[Dict, bytes], source_type: str) -> List[Dict]: 
+        try: # Prepare image reference based on source type 
+            if source_type == 's3':  
+                image_reference = {'S3Object': image} 
+            elif source_type == 'bytes':  
+                image_reference = {'Bytes': image} 
+            else: 
+                raise ValueError("Invalid source type. Use 's3' or 'bytes'.")  
+            
+            response = self.client.detect_labels(  
+                Image=image_reference,  MaxLabels=self.max_labels,  MinConfidence=self.min_confidence 
+            ) 
+            
+            return self.taxonomy.filter_labels(response['Labels']) 
+        except Exception as e:
+            logger.error(f"Rekognition error: {e}") 
             raise
\ No newline at end of file
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def hash_image(image_bytes: bytes) -> str:
+    """
+    Content hash used to address cached results for an image
+
+    :param image_bytes: Raw image bytes
+    :return: Hex SHA-256 digest
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def normalize_labels(damage_labels: List[Dict]) -> List[str]:
+    """
+    Reduce Rekognition labels to a stable form for cache keys
+
+    Confidence scores wobble between otherwise identical calls, so only the
+    sorted, lower-cased label names take part in the key.
+
+    :param damage_labels: Labels as returned by RekognitionService.detect_damage
+    :return: Sorted list of label names
+    """
+    return sorted({label['Name'].strip().lower() for label in damage_labels})
+
+
+class ReportCache:
+    def __init__(self,
+                 db_path: Optional[str] = 'report_cache.sqlite',
+                 max_memory_entries: int = 1024,
+                 max_disk_entries: int = 100000,
+                 ttl_seconds: Optional[float] = 7 * 24 * 3600,
+                 instrumentation=None):
+        """
+        Two-tier cache for Rekognition labels and Bedrock reports
+
+        A bounded in-memory LRU sits in front of a persistent SQLite table.
+        Both tiers honour the same TTL; the disk tier is trimmed to
+        max_disk_entries by least-recent access.
+
+        :param db_path: SQLite file for the persistent tier (None for memory only)
+        :param max_memory_entries: Max entries kept in the in-memory LRU
+        :param max_disk_entries: Max entries kept in the SQLite tier
+        :param ttl_seconds: Entry lifetime in seconds (None to never expire)
+        :param instrumentation: Optional Instrumentation registry counting lookups per namespace and tier
+        """
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+        self._lookups = None
+        if instrumentation is not None:
+            self._lookups = instrumentation.counter(
+                'cache_lookups_total', 'Report cache lookups by result (memory, disk, miss)', ('namespace', 'result')
+            )
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'evictions': 0
+        }
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(namespace: str, **parts) -> str:
+        """
+        Build a cache key from arbitrary JSON-serialisable parts
+
+        :param namespace: Key namespace, e.g. 'bedrock' or 'rekognition'
+        :return: Namespaced hex digest
+        """
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached value, promoting disk hits into memory
+
+        :param key: Cache key from make_key
+        :return: Cached value or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._stats['hits'] += 1
+                    self._stats['memory_hits'] += 1
+                    self._record_lookup(key, 'memory')
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at, now):
+                        self._write("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._remember(key, value, created_at)
+                        self._stats['hits'] += 1
+                        self._stats['disk_hits'] += 1
+                        self._record_lookup(key, 'disk')
+                        return value
+                    self._write("DELETE FROM cache WHERE key = ?", (key,))
+
+            self._stats['misses'] += 1
+            self._record_lookup(key, 'miss')
+            return None
+
+    def _write(self, statement: str, parameters: tuple) -> None:
+        # Committed straight away: an open transaction would hold the WAL write lock
+        # and block every other writer of the cache file
+        try:
+            self._db.execute(statement, parameters)
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update cache entry: {e}")
+
+    def _record_lookup(self, key: str, result: str) -> None:
+        if self._lookups is not None:
+            self._lookups.inc(namespace=key.partition(':')[0], result=result)
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Store a value in both tiers
+
+        :param key: Cache key from make_key
+        :param value: String value to cache
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._writes_since_trim += 1
+                # Trimming needs a COUNT(*), so only do it every so often
+                if self._writes_since_trim >= 100:
+                    self._trim_disk(now)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist cache entry: {e}")
+
+    def stats(self) -> Dict:
+        """
+        Return hit/miss counters and current tier sizes
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            total = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / total if total else 0.0
+            return stats
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, value: str, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _trim_disk(self, now: float) -> None:
+        self._writes_since_trim = 0
+        if self.ttl_seconds is not None:
+            self._db.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (excess,)
+            )
+            self._stats['evictions'] += excess
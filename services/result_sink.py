@@ -0,0 +1,331 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from services.instrumentation import Instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Multipart part size; S3 requires at least 5 MB for every part but the last
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+# A file is closed and a new one started at whichever limit is reached first
+DEFAULT_MAX_FILE_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_FILE_SECONDS = 900
+
+
+def compact_labels(damage_labels: List[Dict]) -> List[Dict]:
+    """
+    Keep only the name and confidence of Rekognition labels
+
+    :param damage_labels: Labels as returned by RekognitionService.detect_damage
+    :return: List of {'name', 'confidence'} dicts
+    """
+    return [{'name': label['Name'], 'confidence': round(label.get('Confidence', 0.0), 2)}
+            for label in damage_labels]
+
+
+class _RollingFile:
+    """
+    One result file being written, uploaded part by part as it fills
+    """
+
+    def __init__(self, key: str, compress: bool):
+        self.key = key
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self.buffer = bytearray()
+        # Bytes moved out of the buffer into numbered parts; part numbers are taken under the sink's lock
+        self.flushed_bytes = 0
+        self.next_part = 1
+        # Guards the upload state below, which is updated by the threads sending parts
+        self.upload_lock = threading.Condition()
+        self.upload_id = None
+        self.parts = {}
+        self.retry_parts = {}
+        self.in_flight = 0
+        self.records = 0
+        self.opened_at = time.monotonic()
+        self.callbacks = []
+
+    @property
+    def size(self) -> int:
+        return self.flushed_bytes + len(self.buffer)
+
+    def take_part(self) -> Tuple[int, bytes]:
+        part = (self.next_part, bytes(self.buffer))
+        self.next_part += 1
+        self.flushed_bytes += len(self.buffer)
+        self.buffer.clear()
+        return part
+
+
+class ResultSink:
+    def __init__(self,
+                 s3_client,
+                 bucket: str,
+                 prefix: str = 'results/',
+                 max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                 max_file_seconds: Optional[float] = DEFAULT_MAX_FILE_SECONDS,
+                 part_size: int = DEFAULT_PART_SIZE,
+                 compress: bool = True,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        Stream result records into rolling JSON Lines files on S3
+
+        Records are appended to the current file and shipped with a
+        multipart upload whenever part_size bytes have accumulated, so
+        thousands of results cost a handful of requests instead of one
+        put_object each. Files rotate at max_file_bytes or max_file_seconds
+        and are laid out as <prefix>dt=YYYY-MM-DD/<file>.jsonl[.gz], which
+        Athena or any JSON Lines reader can query directly.
+
+        A record only becomes visible once its file is closed, so call
+        close() (or use the sink as a context manager) when done.
+
+        Writers only hold the sink's lock to append to the buffer and take a
+        part number; the writer that fills a part uploads it outside the lock,
+        so a slow upload does not hold up the threads writing records.
+
+        :param s3_client: S3 client
+        :param bucket: Bucket receiving the files
+        :param prefix: Key prefix of the files
+        :param max_file_bytes: Rotate once a file reaches this many (compressed) bytes
+        :param max_file_seconds: Rotate files open this long, even when idle (None disables)
+        :param part_size: Bytes per multipart part (at least 5 MB)
+        :param compress: gzip the files
+        :param instrumentation: Optional metrics registry
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.part_size = part_size
+        self.compress = compress
+        self.instrumentation = instrumentation
+
+        # Unique per sink, so several workers can write under the same prefix
+        self._writer_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._lock = threading.Lock()
+        self._file = None
+        self._sequence = 0
+        self._closed = threading.Event()
+        self._stats = {'records': 0, 'files': 0, 'failed_files': 0, 'bytes': 0, 'requests': 0}
+
+        if instrumentation is not None:
+            self._records_metric = instrumentation.counter('result_sink_records_total', 'Result records written')
+            self._files_metric = instrumentation.counter(
+                'result_sink_files_total', 'Result files closed per outcome', ('result',))
+
+        self._rotator = None
+        if max_file_seconds:
+            self._rotator = threading.Thread(target=self._rotate_loop, name='result-sink-rotate', daemon=True)
+            self._rotator.start()
+
+    def __enter__(self) -> 'ResultSink':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def write(self, record: Dict, callback: Optional[Callable[[Optional[str]], None]] = None) -> str:
+        """
+        Append one record
+
+        A failed part upload is logged and retried with the next part; if
+        the file still cannot be written when it is closed, its records are
+        lost and their callbacks receive None.
+
+        The record is only durable once its file is closed, so anything
+        that must wait for that (acknowledging a message, marking a
+        manifest row done) should do it from callback.
+
+        :param record: JSON-serialisable result record
+        :param callback: Optional function called with the file key once the file is
+                         written, or with None if the file could not be written
+        :return: Key of the file the record goes into
+        """
+        line = json.dumps(record, separators=(',', ':'), default=str).encode('utf-8') + b'\n'
+        closing = part = None
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError("Result sink is closed")
+            current = self._file
+            if current is None:
+                current = self._file = self._open()
+            current.buffer += current.compressor.compress(line) if current.compressor else line
+            current.records += 1
+            if callback is not None:
+                current.callbacks.append(callback)
+            self._stats['records'] += 1
+            if self.instrumentation is not None:
+                self._records_metric.inc()
+
+            if current.size >= self.max_file_bytes:
+                closing = self._detach()
+            elif len(current.buffer) >= self.part_size:
+                part = current.take_part()
+                with current.upload_lock:
+                    current.in_flight += 1
+
+        if closing is not None:
+            self._finish(closing)
+        elif part is not None:
+            self._send_part(current, *part)
+        return current.key
+
+    def rotate(self) -> Optional[str]:
+        """
+        Close the current file now
+
+        :return: Key of the closed file, or None if nothing was open or it could not be written
+        """
+        with self._lock:
+            closing = self._detach()
+        return self._finish(closing) if closing is not None else None
+
+    def close(self) -> None:
+        """
+        Close the current file and stop the rotation thread
+        """
+        self._closed.set()
+        if self._rotator is not None:
+            self._rotator.join()
+        self.rotate()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _open(self) -> _RollingFile:
+        now = datetime.now(timezone.utc)
+        self._sequence += 1
+        extension = '.jsonl.gz' if self.compress else '.jsonl'
+        key = (f"{self.prefix}dt={now:%Y-%m-%d}/"
+               f"results-{now:%Y%m%dT%H%M%SZ}-{self._writer_id}-{self._sequence:05d}{extension}")
+        return _RollingFile(key, self.compress)
+
+    def _detach(self) -> Optional[_RollingFile]:
+        # Called with the lock held: later writes start a new file
+        current = self._file
+        if current is None:
+            return None
+        self._file = None
+        if current.compressor is not None:
+            current.buffer += current.compressor.flush()
+        return current
+
+    def _send_part(self, current: _RollingFile, part_number: int, body: bytes) -> None:
+        try:
+            self._upload_part(current, part_number, body)
+        except Exception as e:
+            # Sent again when the file is closed; the records in it are not lost yet
+            logger.warning(f"Error uploading part {part_number} of {self.bucket}/{current.key}, will retry: {e}")
+            with current.upload_lock:
+                current.retry_parts[part_number] = body
+        finally:
+            with current.upload_lock:
+                current.in_flight -= 1
+                current.upload_lock.notify_all()
+
+    def _finish(self, current: _RollingFile) -> Optional[str]:
+        # Called without the lock held, once the file is detached and nothing more can be added to it
+        with current.upload_lock:
+            while current.in_flight:
+                current.upload_lock.wait()
+        try:
+            if current.upload_id is None and current.next_part == 1:
+                # Small file: a single request
+                body = bytes(current.buffer)
+                self.s3_client.put_object(
+                    Bucket=self.bucket, Key=current.key, Body=body, ContentType=self._content_type()
+                )
+                self._count_request()
+            else:
+                for part_number in sorted(current.retry_parts):
+                    self._upload_part(current, part_number, current.retry_parts.pop(part_number))
+                if current.buffer:
+                    self._upload_part(current, *current.take_part())
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=current.key, UploadId=current.upload_id,
+                    MultipartUpload={'Parts': [{'ETag': etag, 'PartNumber': number}
+                                               for number, etag in sorted(current.parts.items())]}
+                )
+                self._count_request()
+            key = current.key
+        except Exception as e:
+            logger.error(f"Error writing result file {self.bucket}/{current.key}, "
+                         f"{current.records} records lost: {e}")
+            self._abort(current)
+            key = None
+
+        with self._lock:
+            if key is None:
+                self._stats['failed_files'] += 1
+            else:
+                self._stats['files'] += 1
+                self._stats['bytes'] += current.size
+        if self.instrumentation is not None:
+            self._files_metric.inc(result='written' if key is not None else 'failed')
+        if key is not None:
+            logger.info(f"Wrote {current.records} results to {self.bucket}/{current.key}")
+
+        for callback in current.callbacks:
+            try:
+                callback(key)
+            except Exception as e:
+                logger.error(f"Result file callback failed for {current.key}: {e}")
+        return key
+
+    def _upload_part(self, current: _RollingFile, part_number: int, body: bytes) -> None:
+        created = False
+        with current.upload_lock:
+            # Created by the first part; the others wait for it rather than start their own
+            if current.upload_id is None:
+                current.upload_id = self.s3_client.create_multipart_upload(
+                    Bucket=self.bucket, Key=current.key, ContentType=self._content_type()
+                )['UploadId']
+                created = True
+            upload_id = current.upload_id
+        if created:
+            # The sink's lock is taken before a file's upload lock, never while holding it
+            self._count_request()
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket, Key=current.key, UploadId=upload_id, PartNumber=part_number, Body=body
+        )
+        with current.upload_lock:
+            current.parts[part_number] = response['ETag']
+        self._count_request()
+
+    def _count_request(self) -> None:
+        with self._lock:
+            self._stats['requests'] += 1
+
+    def _abort(self, current: _RollingFile) -> None:
+        if current.upload_id is None:
+            return
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=current.key, UploadId=current.upload_id)
+        except Exception as e:
+            logger.warning(f"Could not abort multipart upload {current.upload_id}: {e}")
+
+    def _content_type(self) -> str:
+        return 'application/gzip' if self.compress else 'application/x-ndjson'
+
+    def _rotate_loop(self) -> None:
+        interval = min(5.0, self.max_file_seconds / 4)
+        while not self._closed.wait(interval):
+            with self._lock:
+                current = self._file
+                closing = None
+                if current is not None and time.monotonic() - current.opened_at >= self.max_file_seconds:
+                    closing = self._detach()
+            if closing is not None:
+                self._finish(closing)
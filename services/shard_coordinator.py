@@ -0,0 +1,237 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SHARD_PENDING = 'pending'
+SHARD_LEASED = 'leased'
+SHARD_DONE = 'done'
+
+
+def jump_hash(key: str, num_buckets: int) -> int:
+    """
+    Jump consistent hash of a key into one of num_buckets
+
+    Growing num_buckets from n to n+1 moves only ~1/(n+1) of the keys,
+    so re-sharding a bucket keeps most assignments (and cache hits) stable.
+
+    :param key: Object key
+    :param num_buckets: Number of shards
+    :return: Shard index in [0, num_buckets)
+    """
+    value = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+    bucket, candidate = -1, 0
+    while candidate < num_buckets:
+        bucket = candidate
+        value = (value * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((value >> 33) + 1)))
+    return bucket
+
+
+def plan_hash_shards(num_shards: int, prefix: str = '') -> List[Dict]:
+    """
+    Split the keys under a prefix into num_shards by consistent hashing
+
+    Every shard lists the whole prefix and keeps the keys that hash to it.
+
+    :param num_shards: Number of shards
+    :param prefix: Key prefix to cover
+    :return: Shard descriptors for LeaseBackend.register_shards
+    """
+    return [
+        {'shard_id': f"hash:{prefix}:{index:04d}-of-{num_shards:04d}", 'prefix': prefix,
+         'hash_index': index, 'hash_count': num_shards}
+        for index in range(num_shards)
+    ]
+
+
+def plan_prefix_shards(prefixes: List[str]) -> List[Dict]:
+    """
+    One shard per key prefix (e.g. one per claim folder)
+
+    :param prefixes: Disjoint key prefixes
+    :return: Shard descriptors for LeaseBackend.register_shards
+    """
+    return [{'shard_id': f"prefix:{prefix}", 'prefix': prefix, 'hash_index': None, 'hash_count': None}
+            for prefix in prefixes]
+
+
+class LeaseBackend(ABC):
+    """
+    Coordination store handing out shards to workers under expiring leases
+
+    A shard is owned by at most one worker at a time. A worker must renew
+    its lease before it expires; once it lapses (the worker died or hung)
+    any worker may claim the shard and resume from its last checkpoint.
+    """
+
+    @abstractmethod
+    def register_shards(self, run_id: str, shards: List[Dict]) -> None:
+        """
+        Create the shards of a run; shards that already exist are left untouched
+        """
+
+    @abstractmethod
+    def acquire(self, run_id: str, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        """
+        Lease one pending or expired shard
+
+        :return: Shard row (with 'checkpoint_key' to resume after), or None if nothing is claimable
+        """
+
+    @abstractmethod
+    def renew(self, run_id: str, shard_id: str, worker_id: str, lease_seconds: float,
+              checkpoint_key: Optional[str] = None, processed: int = 0, failed: int = 0) -> bool:
+        """
+        Extend a lease and record progress
+
+        :param checkpoint_key: Key up to which (inclusive) the shard is finished
+        :param processed: Images processed since the previous renew
+        :param failed: Images failed since the previous renew
+        :return: False if the lease was lost to another worker
+        """
+
+    @abstractmethod
+    def complete(self, run_id: str, shard_id: str, worker_id: str) -> bool:
+        """
+        Mark a shard done
+
+        :return: False if the lease was lost to another worker
+        """
+
+    @abstractmethod
+    def release(self, run_id: str, shard_id: str, worker_id: str) -> None:
+        """
+        Give a shard back unfinished (e.g. on shutdown) so another worker can take it at once
+        """
+
+    @abstractmethod
+    def status(self, run_id: str) -> List[Dict]:
+        """
+        Progress of every shard of a run
+        """
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    def __init__(self, db_path: str = 'shards.sqlite', timeout: float = 30.0):
+        """
+        LeaseBackend on a SQLite file
+
+        Suitable for several worker processes on one host, or hosts sharing a
+        file system with working locks. Claims run in IMMEDIATE transactions,
+        so two workers can never lease the same shard.
+
+        :param db_path: SQLite file shared by all workers
+        :param timeout: Seconds to wait for the database lock
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS shards ("
+            "run_id TEXT NOT NULL, shard_id TEXT NOT NULL, prefix TEXT NOT NULL, "
+            "hash_index INTEGER, hash_count INTEGER, state TEXT NOT NULL, owner TEXT, "
+            "lease_expires REAL, checkpoint_key TEXT, processed INTEGER NOT NULL DEFAULT 0, "
+            "failed INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (run_id, shard_id)) WITHOUT ROWID"
+        )
+
+    def register_shards(self, run_id: str, shards: List[Dict]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO shards "
+                    "(run_id, shard_id, prefix, hash_index, hash_count, state, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(run_id, shard['shard_id'], shard['prefix'], shard.get('hash_index'),
+                      shard.get('hash_count'), SHARD_PENDING, now) for shard in shards]
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def acquire(self, run_id: str, worker_id: str, lease_seconds: float) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT shard_id FROM shards WHERE run_id = ? AND "
+                    "(state = ? OR (state = ? AND lease_expires < ?)) "
+                    "ORDER BY state = ?, shard_id LIMIT 1",
+                    (run_id, SHARD_PENDING, SHARD_LEASED, now, SHARD_LEASED)
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE shards SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE run_id = ? AND shard_id = ?",
+                    (SHARD_LEASED, worker_id, now + lease_seconds, now, run_id, row[0])
+                )
+                shard = self._row(run_id, row[0])
+                self._db.execute("COMMIT")
+                return shard
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def renew(self, run_id: str, shard_id: str, worker_id: str, lease_seconds: float,
+              checkpoint_key: Optional[str] = None, processed: int = 0, failed: int = 0) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE shards SET lease_expires = ?, checkpoint_key = COALESCE(?, checkpoint_key), "
+                "processed = processed + ?, failed = failed + ?, updated_at = ? "
+                "WHERE run_id = ? AND shard_id = ? AND owner = ? AND state = ?",
+                (now + lease_seconds, checkpoint_key, processed, failed, now, run_id, shard_id, worker_id, SHARD_LEASED)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, run_id: str, shard_id: str, worker_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE shards SET state = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE run_id = ? AND shard_id = ? AND owner = ? AND state = ?",
+                (SHARD_DONE, time.time(), run_id, shard_id, worker_id, SHARD_LEASED)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, run_id: str, shard_id: str, worker_id: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE shards SET state = ?, owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE run_id = ? AND shard_id = ? AND owner = ? AND state = ?",
+                (SHARD_PENDING, time.time(), run_id, shard_id, worker_id, SHARD_LEASED)
+            )
+
+    def status(self, run_id: str) -> List[Dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT shard_id FROM shards WHERE run_id = ? ORDER BY shard_id", (run_id,)
+            ).fetchall()
+            return [self._row(run_id, shard_id) for (shard_id,) in rows]
+
+    def _row(self, run_id: str, shard_id: str) -> Dict:
+        row = self._db.execute(
+            "SELECT shard_id, prefix, hash_index, hash_count, state, owner, lease_expires, "
+            "checkpoint_key, processed, failed, attempts, updated_at "
+            "FROM shards WHERE run_id = ? AND shard_id = ?",
+            (run_id, shard_id)
+        ).fetchone()
+        columns = ('shard_id', 'prefix', 'hash_index', 'hash_count', 'state', 'owner', 'lease_expires',
+                   'checkpoint_key', 'processed', 'failed', 'attempts', 'updated_at')
+        return dict(zip(columns, row))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,122 @@
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from services.damage_taxonomy import _word_forms, _words
+
+logger = logging.getLogger(__name__)
+
+ROUTE_SKIP = 'skip'
+ROUTE_FAST = 'fast'
+ROUTE_FULL = 'full'
+
+# Matched as whole words (allowing inflections) against label names, parents and categories;
+# any hit escalates to the full model
+SEVERE_KEYWORDS = (
+    'destroyed', 'collapsed', 'structural failure', 'structural compromise', 'structural weakness',
+    'shattered', 'rupture', 'fracture', 'buckled', 'collision', 'accident', 'wreck', 'fire', 'flood'
+)
+
+NO_DAMAGE_REPORT = """No damage indicators were detected in this image.
+1. Type and extent of damage: none identified by automated detection.
+2. Estimated repair complexity: not applicable.
+3. Potential repair cost range: not applicable.
+4. Recommendations for next steps: no action needed; request a manual review if damage is visible in the photo."""
+
+
+def route_model(route: str, bedrock_service) -> Optional[str]:
+    """
+    Bedrock model serving a triage route
+
+    :param route: ROUTE_SKIP, ROUTE_FAST or ROUTE_FULL
+    :param bedrock_service: BedrockService whose model ids to use
+    :return: Model id, or None for skipped images
+    """
+    if route == ROUTE_SKIP:
+        return None
+    return bedrock_service.fast_model_id if route == ROUTE_FAST else bedrock_service.model_id
+
+
+def _label_terms(label: Dict) -> List[str]:
+    terms = [label['Name'].lower()]
+    terms += [parent['Name'].lower() for parent in label.get('Parents', [])]
+    terms += [category['Name'].lower() for category in label.get('Categories', [])]
+    return terms
+
+
+class TriagePolicy:
+    def __init__(self,
+                 confident_threshold: float = 90.0,
+                 fast_max_matches: int = 2,
+                 severe_keywords: Sequence[str] = SEVERE_KEYWORDS,
+                 severe_severity: float = 0.8,
+                 skip_report: str = NO_DAMAGE_REPORT):
+        """
+        Decide how much model an image needs from its Rekognition labels
+
+        - skip: Rekognition returned no damage label at all; a templated report is used
+        - full: a label's taxonomy severity reaches severe_severity, a label (or its
+          parents/categories) names a severe keyword, a label sits in the
+          ambiguous band below confident_threshold, or more than fast_max_matches
+          damage labels were found
+        - fast: a few confident, low-severity labels
+
+        Rekognition's MinConfidence already filters the labels, so every label
+        passed in counts; a weak damage label is sent to the full model rather
+        than skipped.
+
+        :param confident_threshold: Labels below this confidence are ambiguous
+        :param fast_max_matches: Max damage labels the fast model handles
+        :param severe_keywords: Terms that always escalate to the full model
+        :param severe_severity: Taxonomy severity (see DamageTaxonomy) that escalates to the full model
+        :param skip_report: Report text used for skipped images
+        """
+        self.confident_threshold = confident_threshold
+        self.fast_max_matches = fast_max_matches
+        self.severe_keywords = tuple(tuple(_words(keyword)) for keyword in severe_keywords)
+        self.severe_severity = severe_severity
+        self.skip_report = skip_report
+
+    def decide(self, damage_labels: List[Dict]) -> Dict:
+        """
+        Route one image
+
+        :param damage_labels: Labels from RekognitionService.detect_damage
+        :return: Dictionary with 'route' (skip/fast/full), 'reason', 'matches' and 'max_confidence'
+        """
+        max_confidence = max((label.get('Confidence', 0.0) for label in damage_labels), default=0.0)
+        decision = {'matches': len(damage_labels), 'max_confidence': round(max_confidence, 2)}
+
+        if not damage_labels:
+            return dict(decision, route=ROUTE_SKIP, reason='no damage labels')
+
+        severe = self._severe_term(damage_labels)
+        if severe is not None:
+            return dict(decision, route=ROUTE_FULL, reason=f"severe: {severe}")
+
+        uncertain = [label['Name'] for label in damage_labels
+                     if label.get('Confidence', 0.0) < self.confident_threshold]
+        if uncertain:
+            return dict(decision, route=ROUTE_FULL, reason=f"ambiguous: {', '.join(uncertain)}")
+
+        if len(damage_labels) > self.fast_max_matches:
+            return dict(decision, route=ROUTE_FULL, reason=f"{len(damage_labels)} damage labels")
+
+        return dict(decision, route=ROUTE_FAST, reason='minor damage')
+
+    def _severe_term(self, labels: List[Dict]) -> Optional[str]:
+        for label in labels:
+            damage = label.get('Damage')
+            if damage is not None and damage['severity'] >= self.severe_severity:
+                return damage['term']
+            for term in _label_terms(label):
+                if any(self._contains(_words(term), keyword) for keyword in self.severe_keywords):
+                    return term
+        return None
+
+    @staticmethod
+    def _contains(words: List[str], keyword: Tuple[str, ...]) -> bool:
+        # 'fire' matches 'Fire' and 'Fires' but not 'Fireplace'
+        for start in range(len(words) - len(keyword) + 1):
+            if all(_word_forms(word) & _word_forms(token) for word, token in zip(words[start:], keyword)):
+                return True
+        return False
@@ -0,0 +1,16 @@
+import pytest
+
+from benchmarks.fake_aws import FakeAWSConfig, FakeBedrock, FakeRekognition, FakeS3, FakeSES
+
+
+@pytest.fixture
+def fake_s3():
+    return FakeS3(num_objects=20, object_size=20000)
+
+
+@pytest.fixture
+def fake_aws(fake_s3):
+    """
+    Fake S3, Rekognition, Bedrock and SES behind an AWSConfig-like object
+    """
+    return FakeAWSConfig(fake_s3, FakeRekognition(), FakeBedrock(tokens_per_second=100000), FakeSES())
@@ -0,0 +1,58 @@
+import pytest
+
+from benchmarks.fake_aws import FakeBedrock
+from services.bedrock_service import BedrockService
+from services.rate_limiter import RetryPolicy, error_code, rate_limit_client
+
+LABELS = [{'Name': 'Dent', 'Confidence': 95.0}]
+IMAGE = b'\xff\xd8\xff' + b'\x00' * 100
+
+
+class _ThrottledStream(FakeBedrock):
+    """
+    FakeBedrock whose first responses end in a throttlingException event
+    """
+
+    def __init__(self, failures: int, after_events: int = 0):
+        super().__init__(tokens_per_second=100000)
+        self.failures = failures
+        self.after_events = after_events
+
+    def invoke_model_with_response_stream(self, modelId: str, body, **kwargs):
+        response = super().invoke_model_with_response_stream(modelId, body, **kwargs)
+        if self.failures > 0:
+            self.failures -= 1
+            events = list(response['body'])[:self.after_events]
+            response = dict(response, body=events + [{'throttlingException': {'message': 'Too many tokens'}}])
+        return response
+
+
+def test_stream_error_is_raised_as_a_client_error():
+    service = BedrockService(_ThrottledStream(failures=1))
+
+    with pytest.raises(Exception) as raised:
+        service.generate_report(IMAGE, LABELS)
+
+    assert error_code(raised.value) == 'ThrottlingException'
+
+
+def test_throttled_stream_is_retried_by_a_rate_limited_client():
+    bedrock = _ThrottledStream(failures=2)
+    client = rate_limit_client(bedrock, 'bedrock-runtime', RetryPolicy(base_delay=0.01))
+
+    report = BedrockService(client).generate_report(IMAGE, LABELS)
+
+    assert report
+    assert bedrock.calls['invoke_model_with_response_stream'] == 3
+    assert client.limiter.stats()['throttles'] == 2
+
+
+def test_stream_is_not_retried_once_text_was_yielded():
+    bedrock = _ThrottledStream(failures=1, after_events=3)
+    client = rate_limit_client(bedrock, 'bedrock-runtime', RetryPolicy(base_delay=0.01))
+
+    with pytest.raises(Exception) as raised:
+        BedrockService(client).generate_report(IMAGE, LABELS)
+
+    assert error_code(raised.value) == 'ThrottlingException'
+    assert bedrock.calls['invoke_model_with_response_stream'] == 1
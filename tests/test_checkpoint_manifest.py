@@ -0,0 +1,76 @@
+import pytest
+
+from services.checkpoint_manifest import CheckpointManifest
+
+
+def _object(key: str, etag: str = '"v1"', size: int = 100):
+    return {'Key': key, 'ETag': etag, 'Size': size, 'LastModified': '2024-01-01T00:00:00Z'}
+
+
+def _done(manifest: CheckpointManifest, bucket: str, obj: dict) -> None:
+    manifest.mark_started(bucket, obj)
+    manifest.mark_done(bucket, obj['Key'], report_key=f"reports/{obj['Key']}.txt")
+
+
+def _pending_keys(manifest: CheckpointManifest, bucket: str, objects):
+    return [obj['Key'] for obj in manifest.filter_pending(bucket, objects)]
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = CheckpointManifest(db_path=str(tmp_path / 'manifest.sqlite'))
+    yield manifest
+    manifest.close()
+
+
+def test_unseen_objects_are_pending(manifest):
+    assert _pending_keys(manifest, 'src', [_object('a.jpg'), _object('b.jpg')]) == ['a.jpg', 'b.jpg']
+
+
+def test_done_object_with_same_version_is_skipped(manifest):
+    _done(manifest, 'src', _object('a.jpg'))
+
+    assert _pending_keys(manifest, 'src', [_object('a.jpg'), _object('b.jpg')]) == ['b.jpg']
+    assert manifest.get('src', 'a.jpg')['report_key'] == 'reports/a.jpg.txt'
+
+
+def test_modified_object_is_pending_again(manifest):
+    _done(manifest, 'src', _object('a.jpg'))
+    _done(manifest, 'src', _object('b.jpg'))
+
+    pending = _pending_keys(manifest, 'src', [_object('a.jpg', etag='"v2"'), _object('b.jpg', size=101)])
+
+    assert pending == ['a.jpg', 'b.jpg']
+
+
+def test_unfinished_and_failed_objects_are_pending(manifest):
+    manifest.mark_started('src', _object('started.jpg'))
+    _done(manifest, 'src', _object('failed.jpg'))
+    manifest.mark_failed('src', 'failed.jpg')
+
+    assert _pending_keys(manifest, 'src', [_object('started.jpg'), _object('failed.jpg')]) == \
+        ['started.jpg', 'failed.jpg']
+
+
+def test_object_without_etag_is_always_pending(manifest):
+    _done(manifest, 'src', {'Key': 'a.jpg'})
+
+    assert _pending_keys(manifest, 'src', [{'Key': 'a.jpg'}]) == ['a.jpg']
+    assert manifest.needs_processing('src', {'Key': 'a.jpg'})
+
+
+def test_buckets_are_tracked_separately(manifest):
+    _done(manifest, 'src', _object('a.jpg'))
+
+    assert _pending_keys(manifest, 'other', [_object('a.jpg')]) == ['a.jpg']
+
+
+def test_listing_larger_than_a_lookup_batch(manifest):
+    objects = [_object(f"{index:05d}.jpg") for index in range(1200)]
+    for obj in objects[::3]:
+        _done(manifest, 'src', obj)
+
+    pending = _pending_keys(manifest, 'src', iter(objects))
+
+    assert pending == [obj['Key'] for index, obj in enumerate(objects) if index % 3]
+    assert manifest.counts('src') == {'done': 400}
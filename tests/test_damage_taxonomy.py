@@ -0,0 +1,103 @@
+import pytest
+
+from services.damage_taxonomy import DamageTaxonomy
+
+
+@pytest.fixture
+def taxonomy():
+    return DamageTaxonomy()
+
+
+def _label(name: str, confidence: float = 90.0, parents=(), categories=(), instances=()):
+    return {
+        'Name': name,
+        'Confidence': confidence,
+        'Parents': [{'Name': parent} for parent in parents],
+        'Categories': [{'Name': category} for category in categories],
+        'Instances': list(instances)
+    }
+
+
+@pytest.mark.parametrize('text, term', [
+    ('Dent', 'dent'),
+    ('Dented Door', 'dent'),
+    ('Scratches', 'scratch'),
+    ('Chipped Paint', 'chipped paint'),
+    ('Rusty Pipe', 'rust'),
+    ('Car Accident', 'accident'),
+])
+def test_terms_match_whole_words_and_inflections(taxonomy, text, term):
+    assert taxonomy.match(text)['term'] == term
+
+
+@pytest.mark.parametrize('text', ['Dentist', 'Trustee', 'Person', 'Car'])
+def test_words_containing_a_term_do_not_match(taxonomy, text):
+    assert taxonomy.match(text) is None
+
+
+def test_longer_phrase_wins_over_its_parts(taxonomy):
+    found = taxonomy.match('Surface Damage')
+
+    assert found == {'term': 'surface damage', 'category': 'surface', 'severity': 0.3}
+
+
+def test_repeated_names_are_served_from_the_cache(taxonomy):
+    taxonomy.match('Dent')
+    taxonomy.match('Dent')
+
+    assert taxonomy.stats()['cache_hits'] == 1
+
+
+def test_label_falls_back_to_parents_then_categories(taxonomy):
+    by_parent = taxonomy.match_label(_label('Windshield', parents=['Shattered Glass']))
+    by_category = taxonomy.match_label(_label('Wall', categories=['Surface Damage']))
+
+    assert (by_parent['term'], by_parent['matched_on']) == ('shattered', 'parent')
+    assert (by_category['term'], by_category['matched_on']) == ('surface damage', 'category')
+    assert taxonomy.match_label(_label('Car', parents=['Vehicle'])) is None
+
+
+def test_label_annotation_scores_and_coverage(taxonomy):
+    instances = [{'BoundingBox': {'Width': 0.5, 'Height': 0.2}}, {'BoundingBox': {'Width': 0.1, 'Height': 0.1}}]
+
+    damage = taxonomy.match_label(_label('Crack', confidence=80.0, instances=instances))
+
+    assert damage['score'] == round(0.5 * 0.8, 4)
+    assert damage['instances'] == 2
+    assert damage['coverage'] == 0.11
+
+
+def test_filter_labels_keeps_damage_labels_only(taxonomy):
+    labels = taxonomy.filter_labels([_label('Car'), _label('Dent'), _label('Person')])
+
+    assert [label['Name'] for label in labels] == ['Dent']
+    assert labels[0]['Damage']['category'] == 'physical'
+
+
+def test_custom_taxonomy_from_file(tmp_path):
+    path = tmp_path / 'taxonomy.yaml'
+    path.write_text(
+        'version: "test.1"\n'
+        'categories:\n'
+        '  water:\n'
+        '    severity: 0.6\n'
+        '    terms:\n'
+        '      - leak\n'
+        '      - {term: flood, severity: 1.0}\n',
+        encoding='utf-8'
+    )
+
+    taxonomy = DamageTaxonomy.from_file(str(path))
+
+    assert taxonomy.version == 'test.1'
+    assert taxonomy.match('Leaking Roof') == {'term': 'leak', 'category': 'water', 'severity': 0.6}
+    assert taxonomy.match('Flooded Basement')['severity'] == 1.0
+    assert taxonomy.match('Dent') is None
+    assert taxonomy.fingerprint != DamageTaxonomy().fingerprint
+
+
+def test_taxonomy_without_terms_is_rejected():
+    with pytest.raises(ValueError):
+        DamageTaxonomy({'version': '1', 'categories': {}})
+    with pytest.raises(ValueError):
+        DamageTaxonomy({'version': '1', 'categories': {'empty': {'terms': []}}})
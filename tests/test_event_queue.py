@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from services.event_queue import EventQueue, InMemoryEventQueue, make_s3_event, parse_s3_events
+
+
+def _eventbridge(obj: dict, detail_type: str = 'Object Created') -> str:
+    return json.dumps({
+        'source': 'aws.s3',
+        'detail-type': detail_type,
+        'time': '2024-05-01T12:00:00Z',
+        'detail': {'bucket': {'name': 'src'}, 'object': obj}
+    })
+
+
+def test_s3_notification():
+    events = parse_s3_events(make_s3_event('src', 'claims/photo 1+2.jpg', etag='abc', size=1234))
+
+    assert len(events) == 1
+    event = events[0]
+    assert (event.bucket, event.key, event.etag, event.size) == ('src', 'claims/photo 1+2.jpg', '"abc"', 1234)
+    assert event.event_time is not None
+    assert event.to_object() == {'Key': 'claims/photo 1+2.jpg', 'ETag': '"abc"', 'Size': 1234}
+
+
+def test_notification_wrapped_in_sns():
+    body = json.dumps({'Type': 'Notification', 'Message': make_s3_event('src', 'a.jpg')})
+
+    assert [event.key for event in parse_s3_events(body)] == ['a.jpg']
+
+
+def test_eventbridge_event():
+    events = parse_s3_events(_eventbridge({'key': 'a.jpg', 'etag': 'abc', 'size': 10}))
+
+    assert [(event.bucket, event.key, event.etag, event.size) for event in events] == [('src', 'a.jpg', '"abc"', 10)]
+
+
+def test_eventbridge_event_without_key():
+    events = parse_s3_events(_eventbridge({}))
+
+    assert events[0].key is None
+    assert events[0].to_object() == {'Key': None}
+
+
+def test_other_events_are_ignored():
+    removed = json.loads(make_s3_event('src', 'a.jpg'))
+    removed['Records'][0]['eventName'] = 'ObjectRemoved:Delete'
+
+    assert parse_s3_events(json.dumps(removed)) == []
+    assert parse_s3_events(json.dumps({'Event': 's3:TestEvent'})) == []
+    assert parse_s3_events(_eventbridge({'key': 'a.jpg'}, detail_type='Object Deleted')) == []
+    assert parse_s3_events('[]') == []
+
+
+def test_malformed_body_raises():
+    with pytest.raises(ValueError):
+        parse_s3_events('not json')
+
+
+def test_in_memory_queue_redelivers_nacked_messages():
+    events = InMemoryEventQueue()
+    events.send('first')
+    events.send('second')
+
+    first, second = events.receive(wait_seconds=0.1)
+    events.ack(first)
+    events.nack(second)
+
+    redelivered = events.receive(wait_seconds=0.1)
+    assert [(message.body, message.receive_count) for message in redelivered] == [('second', 2)]
+
+
+def test_event_queue_is_abstract():
+    with pytest.raises(TypeError):
+        EventQueue()
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+import config.aws_config
+import handler
+from services.event_queue import make_s3_event
+
+
+def _sqs(*bodies):
+    return {'Records': [{'eventSource': 'aws:sqs', 'messageId': f"m{index}", 'body': body}
+                        for index, body in enumerate(bodies)]}
+
+
+@pytest.fixture
+def runtime(monkeypatch, tmp_path, fake_aws):
+    monkeypatch.setattr(config.aws_config, 'AWSConfig', lambda **kwargs: fake_aws)
+    monkeypatch.setattr(handler, 'OUTPUT_BUCKET', 'out')
+    monkeypatch.setattr(handler, 'REPORT_CACHE_PATH', str(tmp_path / 'report_cache.sqlite'))
+    monkeypatch.setattr(handler, 'NOTIFY_RECIPIENT', None)
+    monkeypatch.setattr(handler, '_RUNTIME', None)
+    return handler.get_runtime()
+
+
+def test_direct_invocation_returns_results(runtime, fake_s3):
+    response = handler.handler({'bucket': 'src', 'key': fake_s3.keys[0]})
+
+    assert response['processed'] == 1
+    assert response['failed'] == []
+    assert response['results'][0]['source_key'] == fake_s3.keys[0]
+    assert 'batchItemFailures' not in response
+    json.dumps(response)
+
+
+def test_sqs_batch_reports_only_failed_messages(runtime, fake_s3):
+    event = _sqs(make_s3_event('src', fake_s3.keys[0]),
+                 make_s3_event('src', 'images/missing.jpg'),
+                 make_s3_event('src', 'notes.txt'),
+                 'not json',
+                 make_s3_event('src', fake_s3.keys[1]))
+
+    response = handler.handler(event)
+
+    assert response['processed'] == 2
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'm1'}]
+    assert [failure['key'] for failure in response['failed']] == ['images/missing.jpg']
+
+
+def test_sqs_batch_fails_messages_whose_results_were_not_persisted(runtime, fake_s3):
+    put_object = fake_s3.put_object
+
+    def put(**kwargs):
+        if kwargs['Key'].startswith('results/'):
+            raise RuntimeError('results bucket unavailable')
+        return put_object(**kwargs)
+
+    fake_s3.put_object = put
+    response = handler.handler(_sqs(make_s3_event('src', fake_s3.keys[2]), make_s3_event('src', fake_s3.keys[3])))
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'm0'}, {'itemIdentifier': 'm1'}]
+    assert {failure['stage'] for failure in response['failed']} == {'persist'}
+
+
+def test_events_without_an_image_key_are_ignored(runtime):
+    eventbridge = {'source': 'aws.s3', 'detail-type': 'Object Created',
+                   'detail': {'bucket': {'name': 'src'}, 'object': {}}}
+
+    response = handler.handler(_sqs(json.dumps(eventbridge)))
+
+    assert response == {'processed': 0, 'failed': [], 'batchItemFailures': []}
+
+
+def test_failed_notification_does_not_fail_the_batch(runtime, fake_s3, monkeypatch):
+    def notify(*args, **kwargs):
+        raise RuntimeError('email service down')
+
+    monkeypatch.setattr(runtime, '_notifier', type('Notifier', (), {'notify': staticmethod(notify)})())
+
+    response = handler.handler(dict(_sqs(make_s3_event('src', fake_s3.keys[4])), notify='someone@example.com'))
+
+    assert response['processed'] == 1
+    assert response['batchItemFailures'] == []
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from services.memory_budget import MemoryBudget, estimate_image_memory
+
+
+def _reserve_in_thread(budget: MemoryBudget, size: int):
+    granted = threading.Event()
+
+    def reserve():
+        budget.reserve(size)
+        granted.set()
+
+    threading.Thread(target=reserve, daemon=True).start()
+    return granted
+
+
+def test_reservations_within_the_limit_do_not_wait():
+    budget = MemoryBudget(100)
+
+    assert budget.reserve(60) == 60
+    assert budget.reserve(40) == 40
+    assert budget.stats()['in_use_bytes'] == 100
+    assert budget.stats()['waits'] == 0
+
+
+def test_reservation_waits_until_memory_is_released():
+    budget = MemoryBudget(100)
+    budget.reserve(80)
+
+    granted = _reserve_in_thread(budget, 50)
+    assert not granted.wait(0.1)
+
+    budget.release(80)
+    assert granted.wait(2)
+    assert budget.stats()['in_use_bytes'] == 50
+    assert budget.stats()['waits'] == 1
+
+
+def test_oversized_reservation_runs_alone():
+    budget = MemoryBudget(100)
+    budget.reserve(10)
+
+    granted = _reserve_in_thread(budget, 500)
+    assert not granted.wait(0.1)
+
+    budget.release(10)
+    assert granted.wait(2)
+    assert budget.stats()['peak_bytes'] == 500
+
+
+def test_shrinking_a_reservation_wakes_waiters():
+    budget = MemoryBudget(100)
+    reserved = budget.reserve(90)
+    granted = _reserve_in_thread(budget, 50)
+    assert not granted.wait(0.1)
+
+    assert budget.resize(reserved, 40) == 40
+
+    assert granted.wait(2)
+    assert budget.stats()['in_use_bytes'] == 90
+
+
+def test_growing_a_reservation_never_blocks():
+    budget = MemoryBudget(100)
+    reserved = budget.reserve(50)
+
+    budget.resize(reserved, 150)
+
+    assert budget.stats()['in_use_bytes'] == 150
+
+
+def test_estimates_and_invalid_limits():
+    assert estimate_image_memory(1000) > 1000
+    assert estimate_image_memory(None) == estimate_image_memory(0) > 0
+    with pytest.raises(ValueError):
+        MemoryBudget(0)
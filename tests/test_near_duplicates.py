@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from services.near_duplicates import MultiIndexHash, hamming
+
+
+def _flip_bits(value: int, count: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def _brute_force(entries, query: int, max_distance: int):
+    return sorted((hamming(query, hash_value), value) for hash_value, value in entries
+                  if hamming(query, hash_value) <= max_distance)
+
+
+@pytest.mark.parametrize('max_distance', [0, 4, 6, 10])
+def test_search_finds_everything_a_linear_scan_finds(max_distance):
+    rng = random.Random(max_distance)
+    index = MultiIndexHash(max_distance=max_distance)
+    entries = []
+    # Clusters of near copies, so every query has neighbours at all distances
+    for cluster in range(200):
+        base = rng.getrandbits(64)
+        for copy in range(5):
+            hash_value = _flip_bits(base, rng.randint(0, max_distance + 2), rng)
+            entries.append((hash_value, (cluster, copy)))
+            index.add(hash_value, (cluster, copy))
+
+    for _ in range(300):
+        hash_value, _ = rng.choice(entries)
+        query = _flip_bits(hash_value, rng.randint(0, max_distance), rng)
+        assert sorted(index.search(query)) == _brute_force(entries, query, max_distance)
+
+
+def test_search_is_closest_first_and_capped_at_the_index_distance():
+    index = MultiIndexHash(max_distance=6)
+    index.add(0b1111, 'four')
+    index.add(0b1, 'one')
+    index.add((1 << 10) - 1, 'ten')
+
+    assert [value for _, value in index.search(0)] == ['one', 'four']
+    assert index.search(0, max_distance=2) == [(1, 'one')]
+    assert index.nearest(0) == (1, 'one')
+    assert index.nearest(1 << 63, max_distance=0) is None
+
+
+def test_removed_entries_are_not_found():
+    index = MultiIndexHash(max_distance=4)
+    first = index.add(42, 'first')
+    index.add(42, 'second')
+
+    index.remove(first)
+
+    assert len(index) == 1
+    assert index.search(42) == [(0, 'second')]
@@ -0,0 +1,110 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from analyzers.pipeline import StagePipeline, resolve_stage_concurrency
+
+
+def _double(value):
+    return value * 2
+
+
+def _pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+
+
+def _wait_for_pipeline_threads(timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while _pipeline_threads() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return _pipeline_threads()
+
+
+def test_ordered_run_yields_in_submission_order():
+    # Early items are the slowest, so completion order is the reverse of submission order
+    def wait(value):
+        time.sleep(0.002 * (20 - value))
+        return value
+
+    items = list(StagePipeline([('wait', wait, 8), ('double', _double, 2)]).run(range(20), ordered=True))
+
+    assert [item.seq for item in items] == list(range(20))
+    assert [item.value for item in items] == [value * 2 for value in range(20)]
+    assert all(item.ok for item in items)
+
+
+def test_unordered_run_yields_every_item_once():
+    items = list(StagePipeline([('double', _double, 4), ('double_again', _double, 3)]).run(range(100)))
+
+    assert sorted(item.seq for item in items) == list(range(100))
+    assert sorted(item.value for item in items) == [value * 4 for value in range(100)]
+
+
+def test_failed_item_skips_later_stages_and_keeps_its_input():
+    reached = []
+
+    def check(value):
+        if value == 3:
+            raise ValueError('unreadable image')
+        return value
+
+    def record(value):
+        reached.append(value)
+        return value
+
+    items = list(StagePipeline([('check', check, 2), ('record', record, 2)]).run(range(6), ordered=True))
+
+    failed = [item for item in items if not item.ok]
+    assert [item.seq for item in failed] == [3]
+    assert failed[0].failed_stage == 'check'
+    assert isinstance(failed[0].error, ValueError)
+    assert failed[0].value == 3
+    assert sorted(reached) == [0, 1, 2, 4, 5]
+    assert [item.seq for item in items] == list(range(6))
+
+
+def test_failing_input_ends_the_run_after_the_items_read():
+    def source():
+        yield 1
+        yield 2
+        raise RuntimeError('listing failed')
+
+    items = list(StagePipeline([('double', _double, 2)]).run(source(), ordered=True))
+
+    assert [item.value for item in items] == [2, 4]
+
+
+def test_workers_exit_after_a_complete_run():
+    list(StagePipeline([('double', _double, 3), ('double_again', _double, 2)]).run(range(10)))
+
+    assert _wait_for_pipeline_threads() == []
+
+
+def test_stopping_early_shuts_the_workers_down():
+    def slow(value):
+        time.sleep(0.001)
+        return value
+
+    run = StagePipeline([('slow', slow, 2), ('double', _double, 2)], queue_size=2).run(itertools.count())
+    assert next(run).ok
+    run.close()
+
+    assert _wait_for_pipeline_threads() == []
+
+
+def test_invalid_stages_are_rejected():
+    with pytest.raises(ValueError):
+        StagePipeline([])
+    with pytest.raises(ValueError):
+        StagePipeline([('double', _double, 0)])
+
+
+def test_resolve_stage_concurrency():
+    concurrency = resolve_stage_concurrency({'detect': 3})
+
+    assert concurrency['detect'] == 3
+    assert concurrency['fetch'] == 16
+    with pytest.raises(ValueError):
+        resolve_stage_concurrency({'unknown': 1})
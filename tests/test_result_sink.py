@@ -0,0 +1,156 @@
+import gzip
+import json
+import threading
+
+import pytest
+
+from benchmarks.fake_aws import FakeS3
+from services.result_sink import ResultSink
+
+
+def _records(s3: FakeS3, key: str, compressed: bool = False):
+    data = s3.objects[key]
+    if compressed:
+        data = gzip.decompress(data)
+    return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+
+def _failing(method, failures: list):
+    # Raises while failures[0] is positive, counting down
+    def call(**kwargs):
+        if failures[0] > 0:
+            failures[0] -= 1
+            raise RuntimeError('upload failed')
+        return method(**kwargs)
+    return call
+
+
+@pytest.fixture
+def s3():
+    return FakeS3(num_objects=0)
+
+
+def test_small_file_is_one_put_and_callbacks_get_its_key(s3):
+    written = []
+    sink = ResultSink(s3, 'out', prefix='results/', max_file_seconds=None)
+    for index in range(5):
+        sink.write({'index': index}, callback=written.append)
+
+    key = sink.rotate()
+
+    assert key.startswith('results/dt=') and key.endswith('.jsonl.gz')
+    assert written == [key] * 5
+    assert [record['index'] for record in _records(s3, key, compressed=True)] == list(range(5))
+    assert s3.calls['put_object'] == 1
+    assert s3.calls['create_multipart_upload'] == 0
+
+
+def test_large_file_is_uploaded_in_parts(s3):
+    written = []
+    sink = ResultSink(s3, 'out', part_size=20000, compress=False, max_file_seconds=None)
+    for index in range(200):
+        sink.write({'index': index, 'pad': 'x' * 400}, callback=written.append)
+    sink.close()
+
+    assert len(set(written)) == 1
+    assert [record['index'] for record in _records(s3, written[0])] == list(range(200))
+    assert s3.calls['upload_part'] > 1
+    assert s3.calls['complete_multipart_upload'] == 1
+    assert s3.calls['put_object'] == 0
+
+
+def test_files_rotate_at_max_file_bytes(s3):
+    written = []
+    sink = ResultSink(s3, 'out', max_file_bytes=50000, part_size=20000, compress=False, max_file_seconds=None)
+    for index in range(300):
+        sink.write({'index': index, 'pad': 'y' * 400}, callback=written.append)
+    sink.close()
+
+    keys = sorted(set(written))
+    assert len(keys) > 1
+    indexes = [record['index'] for key in keys for record in _records(s3, key)]
+    assert sorted(indexes) == list(range(300))
+    assert sink.stats()['files'] == len(keys)
+
+
+def test_concurrent_writers_lose_no_records(s3):
+    written = []
+    sink = ResultSink(s3, 'out', part_size=10000, compress=False, max_file_seconds=None)
+
+    def writer(number):
+        for index in range(100):
+            sink.write({'writer': number, 'index': index, 'pad': 'z' * 200}, callback=written.append)
+
+    threads = [threading.Thread(target=writer, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.close()
+
+    records = _records(s3, written[0])
+    assert len(written) == 800
+    assert {(record['writer'], record['index']) for record in records} == \
+        {(number, index) for number in range(8) for index in range(100)}
+    assert len(records) == 800
+
+
+def test_failed_part_is_retried_when_the_file_closes(s3):
+    s3.upload_part = _failing(s3.upload_part, [2])
+    written = []
+    sink = ResultSink(s3, 'out', part_size=10000, compress=False, max_file_seconds=None)
+    for index in range(100):
+        sink.write({'index': index, 'pad': str(index) * 200}, callback=written.append)
+    sink.close()
+
+    assert None not in written
+    assert [record['index'] for record in _records(s3, written[0])] == list(range(100))
+    assert sink.stats()['failed_files'] == 0
+
+
+def test_callbacks_get_none_when_the_file_cannot_be_written(s3):
+    s3.put_object = _failing(s3.put_object, [1])
+    written = []
+    sink = ResultSink(s3, 'out', max_file_seconds=None)
+    for index in range(3):
+        sink.write({'index': index}, callback=written.append)
+
+    assert sink.rotate() is None
+    assert written == [None, None, None]
+    assert sink.stats()['failed_files'] == 1
+
+
+def test_callbacks_get_none_when_the_multipart_upload_cannot_complete(s3):
+    s3.complete_multipart_upload = _failing(s3.complete_multipart_upload, [1])
+    written = []
+    sink = ResultSink(s3, 'out', part_size=10000, compress=False, max_file_seconds=None)
+    for index in range(100):
+        sink.write({'index': index, 'pad': 'x' * 200}, callback=written.append)
+    sink.close()
+
+    assert set(written) == {None}
+    assert s3.multipart == {}
+
+
+def test_failing_callback_does_not_stop_the_others(s3):
+    written = []
+
+    def broken(key):
+        raise RuntimeError('callback failed')
+
+    sink = ResultSink(s3, 'out', max_file_seconds=None)
+    sink.write({'index': 0}, callback=broken)
+    sink.write({'index': 1}, callback=written.append)
+
+    key = sink.rotate()
+
+    assert written == [key]
+
+
+def test_rotate_without_records_and_write_after_close(s3):
+    sink = ResultSink(s3, 'out', max_file_seconds=None)
+
+    assert sink.rotate() is None
+    sink.close()
+    with pytest.raises(RuntimeError):
+        sink.write({'index': 0})
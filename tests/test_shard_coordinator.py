@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from services.shard_coordinator import (
+    SHARD_DONE, SHARD_LEASED, SHARD_PENDING, SQLiteLeaseBackend, jump_hash, plan_hash_shards
+)
+
+KEYS = [f"images/{index:06d}.jpg" for index in range(5000)]
+
+
+def test_jump_hash_is_deterministic_and_in_range():
+    first = [jump_hash(key, 7) for key in KEYS]
+
+    assert first == [jump_hash(key, 7) for key in KEYS]
+    assert set(first) == set(range(7))
+    assert jump_hash('anything', 1) == 0
+
+
+def test_jump_hash_spreads_keys_evenly():
+    counts = [0] * 8
+    for key in KEYS:
+        counts[jump_hash(key, 8)] += 1
+
+    assert min(counts) > len(KEYS) / 8 * 0.8
+    assert max(counts) < len(KEYS) / 8 * 1.2
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    before = {key: jump_hash(key, 10) for key in KEYS}
+    after = {key: jump_hash(key, 11) for key in KEYS}
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+
+    assert all(after[key] == 10 for key in moved)
+    assert len(moved) < len(KEYS) / 11 * 1.3
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteLeaseBackend(db_path=str(tmp_path / 'shards.sqlite'))
+    backend.register_shards('run', plan_hash_shards(2))
+    yield backend
+    backend.close()
+
+
+def test_each_shard_is_leased_to_one_worker(backend):
+    first = backend.acquire('run', 'worker-a', lease_seconds=60)
+    second = backend.acquire('run', 'worker-b', lease_seconds=60)
+
+    assert first['shard_id'] != second['shard_id']
+    assert backend.acquire('run', 'worker-c', lease_seconds=60) is None
+    assert {shard['state'] for shard in backend.status('run')} == {SHARD_LEASED}
+
+
+def test_registering_again_keeps_progress(backend):
+    shard = backend.acquire('run', 'worker-a', lease_seconds=60)
+    backend.renew('run', shard['shard_id'], 'worker-a', 60, checkpoint_key='images/000010.jpg', processed=11)
+
+    backend.register_shards('run', plan_hash_shards(2))
+
+    row = next(row for row in backend.status('run') if row['shard_id'] == shard['shard_id'])
+    assert (row['state'], row['checkpoint_key'], row['processed']) == (SHARD_LEASED, 'images/000010.jpg', 11)
+
+
+def test_expired_lease_is_taken_over_from_the_checkpoint(backend):
+    backend.acquire('run', 'worker-b', lease_seconds=60)
+    shard = backend.acquire('run', 'worker-a', lease_seconds=0.05)
+    assert backend.renew('run', shard['shard_id'], 'worker-a', 0.05, checkpoint_key='images/000042.jpg')
+
+    assert backend.acquire('run', 'worker-c', lease_seconds=60) is None
+    time.sleep(0.1)
+    taken = backend.acquire('run', 'worker-c', lease_seconds=60)
+
+    assert taken['shard_id'] == shard['shard_id']
+    assert taken['owner'] == 'worker-c'
+    assert taken['checkpoint_key'] == 'images/000042.jpg'
+    assert taken['attempts'] == 2
+    # The worker that lost its lease can no longer record progress or finish the shard
+    assert not backend.renew('run', shard['shard_id'], 'worker-a', 60, checkpoint_key='images/000099.jpg')
+    assert not backend.complete('run', shard['shard_id'], 'worker-a')
+
+
+def test_released_shard_is_claimable_at_once(backend):
+    shard = backend.acquire('run', 'worker-a', lease_seconds=60)
+    backend.acquire('run', 'worker-b', lease_seconds=60)
+
+    backend.release('run', shard['shard_id'], 'worker-a')
+
+    row = next(row for row in backend.status('run') if row['shard_id'] == shard['shard_id'])
+    assert (row['state'], row['owner']) == (SHARD_PENDING, None)
+    assert backend.acquire('run', 'worker-c', lease_seconds=60)['shard_id'] == shard['shard_id']
+
+
+def test_completed_shard_is_not_leased_again(backend):
+    shard = backend.acquire('run', 'worker-a', lease_seconds=0.05)
+
+    assert backend.complete('run', shard['shard_id'], 'worker-a')
+    time.sleep(0.1)
+
+    other = backend.acquire('run', 'worker-b', lease_seconds=60)
+    assert other['shard_id'] != shard['shard_id']
+    assert backend.acquire('run', 'worker-c', lease_seconds=60) is None
+    assert sorted(row['state'] for row in backend.status('run')) == [SHARD_DONE, SHARD_LEASED]
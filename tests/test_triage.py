@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+from services.damage_taxonomy import DamageTaxonomy
+from services.triage import ROUTE_FAST, ROUTE_FULL, ROUTE_SKIP, TriagePolicy, route_model
+
+
+def _label(name: str, confidence: float = 95.0, parents=(), categories=()):
+    return {
+        'Name': name,
+        'Confidence': confidence,
+        'Parents': [{'Name': parent} for parent in parents],
+        'Categories': [{'Name': category} for category in categories]
+    }
+
+
+def test_no_damage_labels_are_skipped():
+    decision = TriagePolicy().decide([])
+
+    assert decision['route'] == ROUTE_SKIP
+    assert decision['matches'] == 0
+
+
+def test_few_confident_minor_labels_go_to_the_fast_model():
+    decision = TriagePolicy().decide([_label('Scratch', 97.0), _label('Dent', 93.5)])
+
+    assert decision['route'] == ROUTE_FAST
+    assert decision['max_confidence'] == 97.0
+
+
+def test_low_confidence_label_goes_to_the_full_model():
+    decision = TriagePolicy().decide([_label('Scratch', 97.0), _label('Dent', 72.0)])
+
+    assert decision['route'] == ROUTE_FULL
+    assert 'Dent' in decision['reason']
+
+
+def test_many_labels_go_to_the_full_model():
+    labels = [_label('Scratch'), _label('Dent'), _label('Rust')]
+
+    assert TriagePolicy(fast_max_matches=2).decide(labels)['route'] == ROUTE_FULL
+
+
+def test_severe_keyword_in_name_parent_or_category_escalates():
+    policy = TriagePolicy()
+
+    assert policy.decide([_label('Fires')])['route'] == ROUTE_FULL
+    assert policy.decide([_label('Bumper', parents=['Collision'])])['route'] == ROUTE_FULL
+    assert policy.decide([_label('Dent', categories=['Structural Failure'])])['route'] == ROUTE_FULL
+
+
+def test_severe_keywords_match_whole_words_only():
+    assert TriagePolicy().decide([_label('Fireplace')])['route'] == ROUTE_FAST
+
+
+def test_taxonomy_severity_escalates():
+    labels = DamageTaxonomy().filter_labels([_label('Shattered Window')])
+
+    decision = TriagePolicy(severe_keywords=()).decide(labels)
+
+    assert decision['route'] == ROUTE_FULL
+    assert decision['reason'] == 'severe: shattered'
+
+
+def test_route_model():
+    bedrock_service = SimpleNamespace(model_id='full-model', fast_model_id='fast-model')
+
+    assert route_model(ROUTE_SKIP, bedrock_service) is None
+    assert route_model(ROUTE_FAST, bedrock_service) == 'fast-model'
+    assert route_model(ROUTE_FULL, bedrock_service) == 'full-model'
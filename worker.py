@@ -0,0 +1,103 @@
+import argparse
+import logging
+import signal
+from config.aws_config import AWSConfig
+from services.s3_service import S3Service
+from services.rekognition_service import RekognitionService
+from services.bedrock_service import BedrockService
+from services.report_cache import ReportCache
+from services.checkpoint_manifest import CheckpointManifest
+from services.instrumentation import Instrumentation
+from services.memory_budget import MemoryBudget
+from services.damage_taxonomy import DamageTaxonomy
+from services.event_queue import FileEventQueue, SQSEventQueue
+from analyzers.multiimagedamage_analyzer import MultiImageDamageAnalyzer
+from analyzers.event_worker import EventWorker
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# SQS queue subscribed to the source bucket's s3:ObjectCreated:* notifications
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/damage-analyzer-uploads'
+OUTPUT_BUCKET = 'damage-analyzer1124-test'
+MANIFEST_PATH = 'manifest.sqlite'
+METRICS_PATH = 'metrics.prom'
+
+# Cap on the memory held by in-flight images; downloads wait once it is reached
+MEMORY_BUDGET_MB = 1024
+
+# YAML damage taxonomy (terms, categories, severity weights); None uses the built-in one
+TAXONOMY_PATH = None
+
+# Client-side rate limiting and retries; off by default since the limits in
+# services/rate_limiter.DEFAULT_LIMITS are placeholders. Before enabling, set
+# RATE_LIMITS to the account's quotas, e.g. {'bedrock-runtime': {'tokens_per_minute': 2000000.0}}
+RATE_LIMITED = False
+RATE_LIMITS = {}
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse images as they are uploaded")
+    parser.add_argument('--queue-url', default=QUEUE_URL, help='SQS queue receiving S3 notifications')
+    parser.add_argument('--queue-dir', help='Use a local spool directory of notification files instead of SQS')
+    parser.add_argument('--drain', action='store_true', help='Exit once the queue is empty')
+    parser.add_argument('--prefetch', type=int, default=32, help='Images received ahead of the pipeline')
+    args = parser.parse_args()
+
+    try:
+        instrumentation = Instrumentation()
+        aws_config = AWSConfig(
+            region_name='us-east-1',
+            max_pool_connections=64,
+            rate_limited=RATE_LIMITED,
+            rate_limits=RATE_LIMITS,
+            instrumentation=instrumentation
+        )
+
+        # Clients, pools and the cache are created once and stay warm for the life of the worker
+        report_cache = ReportCache(db_path='report_cache.sqlite', instrumentation=instrumentation)
+        taxonomy = DamageTaxonomy.from_file(TAXONOMY_PATH) if TAXONOMY_PATH else None
+        analyzer = MultiImageDamageAnalyzer(
+            s3_service=S3Service(aws_config.client('s3')),
+            rekognition_service=RekognitionService(aws_config.client('rekognition'), cache=report_cache,
+                                                   taxonomy=taxonomy),
+            bedrock_service=BedrockService(aws_config.client('bedrock'), cache=report_cache,
+                                           instrumentation=instrumentation),
+            manifest=CheckpointManifest(MANIFEST_PATH),
+            instrumentation=instrumentation,
+            memory_budget=MemoryBudget(MEMORY_BUDGET_MB * 1024 * 1024, instrumentation=instrumentation)
+        )
+
+        if args.queue_dir:
+            event_queue = FileEventQueue(args.queue_dir)
+        else:
+            event_queue = SQSEventQueue(aws_config.client('sqs'), args.queue_url)
+
+        worker = EventWorker(
+            analyzer,
+            event_queue,
+            output_bucket=OUTPUT_BUCKET,
+            prefetch=args.prefetch,
+            instrumentation=instrumentation
+        )
+
+        # Finish what has been received, then exit
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+
+        counts = worker.run(drain=args.drain)
+        logger.info(f"Processed: {counts}")
+        logger.info(f"Report cache: {report_cache.stats()}")
+
+        instrumentation.write(METRICS_PATH)
+        logger.info(f"Metrics written to {METRICS_PATH}")
+
+    except Exception as e:
+        logger.error(f"Worker error: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()